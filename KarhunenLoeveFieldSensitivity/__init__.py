@@ -8,9 +8,37 @@ from ._aggregatedKarhunenLoeveResults import *
 from ._karhunenLoeveGeneralizedFunctionWrapper import *
 from ._karhunenLoeveSobolIndicesExperiment import *
 from ._sobolIndicesFactory import *
+from ._evaluationCheckpoint import *
+from ._evaluationInstrumentation import *
+from ._asyncSimulatorEvaluation import *
+from ._parallelEvaluation import *
+from ._evaluationServer import *
+from ._fileWorkQueue import *
+from ._karhunenLoeveSnapshot import *
+from ._outputCompression import *
+from ._virtualSobolDesign import *
+from ._streamingSobolPipeline import *
+from ._replicatedSobolIndices import *
+from ._trajectorySobolExperiments import *
+from ._givenDataSensitivity import *
+from ._sobolDesignMetadata import *
 
 
 __all__ = (_aggregatedKarhunenLoeveResults.__all__ 
            + _karhunenLoeveGeneralizedFunctionWrapper.__all__ 
            + _karhunenLoeveSobolIndicesExperiment.__all__
-           + _sobolIndicesFactory.__all__)
\ No newline at end of file
+           + _sobolIndicesFactory.__all__
+           + _evaluationCheckpoint.__all__
+           + _evaluationInstrumentation.__all__
+           + _asyncSimulatorEvaluation.__all__
+           + _parallelEvaluation.__all__
+           + _evaluationServer.__all__
+           + _fileWorkQueue.__all__
+           + _karhunenLoeveSnapshot.__all__
+           + _outputCompression.__all__
+           + _virtualSobolDesign.__all__
+           + _streamingSobolPipeline.__all__
+           + _replicatedSobolIndices.__all__
+           + _trajectorySobolExperiments.__all__
+           + _givenDataSensitivity.__all__
+           + _sobolDesignMetadata.__all__)
\ No newline at end of file
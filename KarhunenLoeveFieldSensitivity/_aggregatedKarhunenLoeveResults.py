@@ -5,6 +5,7 @@ __date__  = '17.09.20'
 __all__ = ['AggregatedKarhunenLoeveResults']
 
 import openturns as ot
+import numpy as np
 import uuid
 from collections import Sequence, Iterable
 from copy import copy, deepcopy
@@ -22,6 +23,30 @@ def atLeastList(elem):
     else :
         return [elem]
 
+def processSampleFromArray(mesh, values, dimension=1):
+    '''Builds a ProcessSample in one step from the values of its fields
+
+    Arguments
+    ---------
+    mesh : ot.Mesh
+        mesh of the fields
+    values : numpy.ndarray
+        of shape (n, vertices, dimension), or any shape that can be reshaped
+        into it
+    dimension : int
+        dimension of the values of the fields
+
+    Returns
+    -------
+    processSample : ot.ProcessSample
+    '''
+    size = len(values)
+    if size == 0 :
+        return ot.ProcessSample(mesh, 0, dimension)
+    values = np.ascontiguousarray(values, dtype=float).reshape(
+                                    size, mesh.getVerticesNumber(), dimension)
+    return ot.ProcessSample(mesh, values)
+
 def addConstant2Iterable(obj, constant):
     '''Method to add a constant value to a openTURNS object.
 
@@ -88,6 +113,8 @@ class AggregatedKarhunenLoeveResults(object):
         self.__isAggregated__ = False
         self.__means__ = [.0]*self.__field_distribution_count__
         self.__liftWithMean__ = False
+        self.__scaled_modes_arrays__ = [None]*self.__field_distribution_count__
+        self.__verbose__ = False
 
         # checking the nature of eachelement of the input list
         for i in range(self.__field_distribution_count__):
@@ -230,6 +257,15 @@ class AggregatedKarhunenLoeveResults(object):
         '''
         self.__liftWithMean__ = theBool
 
+    def setVerbose(self, verbose):
+        '''Flag to print a message at each lifting
+
+        Parameters
+        ----------
+        verbose : bool
+        '''
+        self.__verbose__ = verbose
+
     def getClassName(self):
         '''Returns a list of the class each process/distribution belongs to.
         '''
@@ -319,7 +355,7 @@ class AggregatedKarhunenLoeveResults(object):
             ordered list of samples of scalars (ot.Sample) and field samples (ot.ProcessSample)
         '''
         assert isinstance(coefficients, (ot.Sample, ot.SampleImplementation))
-        print('Lifting as process sample')
+        if self.__verbose__ : print('Lifting as process sample')
         jumpDim = 0
         processes = []
         for i in range(self.__field_distribution_count__):
@@ -351,8 +387,60 @@ class AggregatedKarhunenLoeveResults(object):
             jumpDim += self.__mode_count__[i]
         return processes
 
+    def liftAsArrays(self, coefficients):
+        '''Function to lift a sample of coefficients into numpy arrays, one per
+        process or distribution of the aggregation, without building any
+        openturns Field.
+
+        Parameters
+        ----------
+        coefficients : ot.Sample or numpy.ndarray
+            sample of values, of shape (n, getSizeModes())
+
+        Returns
+        -------
+        arrays : dict
+            name of the process or distribution -> numpy array of shape
+            (n, vertices) for processes of dimension 1, (n, vertices, dim)
+            for processes of higher dimension and (n,) for the scalars
+
+        Note
+        ----
+        The fields are obtained with a single product of the coefficients with
+        the scaled modes of each process, which are extracted once and kept.
+        '''
+        coefficients = np.asarray(coefficients, dtype=float)
+        assert coefficients.ndim == 2 and coefficients.shape[1] == sum(self.__mode_count__), \
+            'DimensionError : the sample of coefficients has the wrong shape'
+        arrays = dict()
+        jumpDim = 0
+        for i in range(self.__field_distribution_count__):
+            coeffs = coefficients[:, jumpDim : jumpDim + self.__mode_count__[i]]
+            if self.__isProcess__[i] :
+                modes = self._getScaledModesArray(i)
+                values = np.tensordot(coeffs, modes, axes=1)
+                if values.shape[2] == 1 :
+                    values = values[:, :, 0]
+            else :
+                values = np.array(self.__KL_lifting__[i](ot.Sample(coeffs)))[:, 0]
+            if self.__liftWithMean__ :
+                values += self.__means__[i]
+            arrays[self.__process_distribution_description__[i]] = values
+            jumpDim += self.__mode_count__[i]
+        return arrays
+
+    def _getScaledModesArray(self, i):
+        '''Returns the scaled modes of the process at index i as an array of
+        shape (n_modes, vertices, dim), extracted only once.
+        '''
+        if self.__scaled_modes_arrays__[i] is None :
+            modes = self.__KLResultsAndDistributions__[i].getScaledModesAsProcessSample()
+            self.__scaled_modes_arrays__[i] = np.stack(
+                [np.asarray(modes[k]) for k in range(modes.getSize())])
+        return self.__scaled_modes_arrays__[i]
+
     def liftAsField(self, coefficients):
-                '''Function to lift a vector of coefficients into a list of
+        '''Function to lift a vector of coefficients into a list of
         process samples and points.
 
         Parameters
@@ -367,7 +455,7 @@ class AggregatedKarhunenLoeveResults(object):
         '''
         assert isinstance(coefficients, (ot.Point)), 'function only lifts points'
         valid = self._checkCoefficients(coefficients)
-        print('Lifting as field')
+        if self.__verbose__ : print('Lifting as field')
         if valid :
             to_return = []
             jumpDim = 0
@@ -404,7 +492,7 @@ class AggregatedKarhunenLoeveResults(object):
         ''' function to lift into a list of samples a Point of coefficents
         '''
         assert isinstance(coefficients, ot.Point)
-        print('Lifting as sample')
+        if self.__verbose__ : print('Lifting as sample')
         valid = self._checkCoefficients(coefficients)
         modes = self.__mode_count__
         jumpDim = 0
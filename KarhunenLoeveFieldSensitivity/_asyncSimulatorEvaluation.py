@@ -0,0 +1,169 @@
+__author__ = 'Kristof Attila S.'
+__version__ = '0.1'
+__date__  = '19.10.26'
+
+__all__ = ['ExternalSimulator']
+
+import os
+import asyncio
+import numpy as np
+
+
+def writeInputsAsText(work_directory, inputs):
+    '''Default input writer : one text file <name>.txt per input, with the
+    values of the field (one vertex per line) or the scalar value.
+    '''
+    for name, values in inputs.items():
+        np.savetxt(os.path.join(work_directory, name + '.txt'),
+                   np.atleast_1d(values))
+
+
+class ExternalSimulator(object):
+    '''External executable launched once per realization of the inputs.
+
+    For each row of the design, a work directory is created, the lifted inputs
+    are written in it, the command is launched as a subprocess inside it, and
+    the outputs it writes are parsed back. The runs are driven by asyncio, at
+    most max_concurrency of them being in flight at the same time, so that
+    hundreds of runs can be waited upon without blocking the python process.
+
+    Parameters
+    ----------
+    command : list of str
+        command and arguments of the simulator. The placeholders {workdir}
+        and {index} are replaced by the work directory and the row index.
+    work_directory : str
+        root directory under which the run_XXXXXX directories are created
+    output_names : list of str
+        names of the outputs. The default reader loads <name>.txt for each.
+    write_inputs : callable, optional
+        write_inputs(work_directory, inputs), with inputs a dictionary
+        name -> numpy array of one realization. Default : writeInputsAsText
+    read_outputs : callable, optional
+        read_outputs(work_directory) -> list of floats or numpy arrays, one
+        per output, in the order of the outputs of the wrapper.
+    max_concurrency : int
+        maximal number of simulator processes running at the same time
+    timeout : float, optional
+        time in seconds after which a run is killed
+    '''
+    def __init__(self, command, work_directory, output_names=None,
+                 write_inputs=None, read_outputs=None, max_concurrency=8,
+                 timeout=None):
+        assert output_names is not None or read_outputs is not None, \
+            "Give the names of the output files or a function to read them"
+        self.command = list(command)
+        self.work_directory = work_directory
+        self.output_names = output_names
+        self.write_inputs = write_inputs if write_inputs is not None else writeInputsAsText
+        self.read_outputs = read_outputs if read_outputs is not None else self._readOutputsAsText
+        self.max_concurrency = int(max_concurrency)
+        self.timeout = timeout
+        if not os.path.isdir(self.work_directory):
+            os.makedirs(self.work_directory)
+
+    def __repr__(self):
+        return ', '.join(['ExternalSimulator',
+                          'command : {}'.format(' '.join(self.command)),
+                          'work directory : {}'.format(self.work_directory),
+                          'max concurrency : {}'.format(self.max_concurrency)])
+
+    def getRunDirectory(self, idx):
+        '''Returns the work directory of the run of row idx
+        '''
+        return os.path.join(self.work_directory, 'run_{:06d}'.format(idx))
+
+    async def evaluate(self, inputArrays, size, offset=0, return_exceptions=False,
+                       rows=None):
+        '''Runs the simulator on every row of the lifted inputs
+
+        Arguments
+        ---------
+        inputArrays : dict
+            name -> numpy array whose first dimension is the size of the sample,
+            as returned by AggregatedKarhunenLoeveResults.liftAsArrays
+        size : int
+            number of rows
+        offset : int
+            index of the first row, used to name the run directories
+        return_exceptions : bool
+            if True, the exception of a failed run is returned in place of its
+            outputs instead of being raised
+        rows : list of int, optional
+            only runs these rows, for instance the failed rows to retry, by
+            default all the rows
+
+        Returns
+        -------
+        outputs : list
+            for each row run, the list of its outputs
+
+        Note
+        ----
+        If a run fails, the other runs are still awaited before its exception
+        is raised. At most max_concurrency runs are started at once.
+        '''
+        if rows is None :
+            rows = range(size)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        async def bounded(j):
+            async with semaphore:
+                inputs = {name : values[j] for name, values in inputArrays.items()}
+                return await self.run(offset + j, inputs)
+        outputs = await asyncio.gather(*[bounded(j) for j in rows],
+                                       return_exceptions=True)
+        if return_exceptions :
+            return outputs
+        # all the runs are finished before raising, so no process is orphaned
+        for output in outputs:
+            if isinstance(output, BaseException):
+                raise output
+        return outputs
+
+    async def run(self, idx, inputs):
+        '''Runs the simulator for one realization of the inputs
+
+        Arguments
+        ---------
+        idx : int
+            index of the row in the design
+        inputs : dict
+            name -> numpy array (or float) of the realization
+
+        Returns
+        -------
+        outputs : list of floats or numpy arrays
+        '''
+        workdir = self.getRunDirectory(idx)
+        if not os.path.isdir(workdir):
+            os.makedirs(workdir)
+        self.write_inputs(workdir, inputs)
+        command = [arg.format(workdir=workdir, index=idx) for arg in self.command]
+        process = await asyncio.create_subprocess_exec(*command, cwd=workdir,
+                                                stdout=asyncio.subprocess.PIPE,
+                                                stderr=asyncio.subprocess.PIPE)
+        try :
+            stdout, stderr = await asyncio.wait_for(process.communicate(),
+                                                    self.timeout)
+        except asyncio.TimeoutError :
+            process.kill()
+            await process.wait()
+            raise TimeoutError(
+                'Run {} did not finish in {} seconds'.format(idx, self.timeout))
+        except asyncio.CancelledError :
+            process.kill()
+            await process.wait()
+            raise
+        with open(os.path.join(workdir, 'stdout.txt'), 'wb') as fic:
+            fic.write(stdout)
+        if process.returncode != 0 :
+            raise RuntimeError('Run {} exited with code {} :\n{}'.format(
+                idx, process.returncode, stderr.decode(errors='replace')[-2000:]))
+        return self.read_outputs(workdir)
+
+    def _readOutputsAsText(self, work_directory):
+        outputs = []
+        for name in self.output_names:
+            values = np.loadtxt(os.path.join(work_directory, name + '.txt'), ndmin=1)
+            outputs.append(values[0] if values.size == 1 else values)
+        return outputs
@@ -0,0 +1,254 @@
+__author__ = 'Kristof Attila S.'
+__version__ = '0.1'
+__date__  = '19.10.26'
+
+__all__ = ['EvaluationCheckpoint']
+
+import os
+import json
+import pickle
+import hashlib
+import numpy as np
+from numbers import Integral
+try :
+    from ._virtualSobolDesign import VirtualSobolDesign
+except ImportError :
+    from _virtualSobolDesign import VirtualSobolDesign
+
+
+class EvaluationCheckpoint(object):
+    '''On-disk store for the chunks of a long batch evaluation.
+
+    Each evaluated chunk is pickled in its own file, and a json manifest keeps
+    track of the chunks that are finished. The chunks are stored in a sub
+    directory named after a hash of the design, of the chunk size and of the
+    identity of the model, so that a resumed evaluation of the same design
+    by the same model finds its chunks back, while a different design or a
+    different model never mixes its results with them.
+
+    Parameters
+    ----------
+    directory : str
+        root directory of the store
+    chunk_size : int
+        number of rows per chunk
+    model_tag : str, optional
+        identity of the model evaluated, see
+        KarhunenLoeveGeneralizedFunctionWrapper.getModelTag
+
+    Note
+    ----
+    Every file is first written under a temporary name and then renamed, so a
+    crash or a preemption can never leave a half written chunk or manifest.
+    '''
+    def __init__(self, directory, chunk_size=1000, model_tag=None):
+        assert isinstance(chunk_size, Integral) and chunk_size > 0, \
+                "Chunk size can only be positive integer"
+        self.directory = directory
+        self.chunk_size = int(chunk_size)
+        self.model_tag = model_tag
+        self.__designKey__ = None
+        self.__manifest__ = None
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def __repr__(self):
+        return ', '.join(['EvaluationCheckpoint',
+                          'directory : {}'.format(self.directory),
+                          'chunk size : {}'.format(self.chunk_size),
+                          'model : {}'.format(self.model_tag),
+                          'completed chunks : {}'.format(
+                                len(self.getCompletedChunks()))])
+
+    @staticmethod
+    def getDesignKey(design, chunk_size, model_tag=None):
+        '''Returns the hash identifying a design evaluated by a model with a
+        chunk size.
+
+        Arguments
+        ---------
+        design : ot.Sample or VirtualSobolDesign
+            the input design of the batch evaluation
+        chunk_size : int
+            number of rows per chunk
+        model_tag : str, optional
+            identity of the model
+        '''
+        if isinstance(design, VirtualSobolDesign):
+            # hashed from the samples it is mixed from, without building it
+            sha = hashlib.sha1()
+            for array in design.getSamples():
+                sha.update(np.ascontiguousarray(array).tobytes())
+            sha.update(str((design.getModeCount(), design.getGroups(),
+                            design.second_order)).encode())
+            sha.update(str((len(design), design.getDimension())).encode())
+            sha.update(str((chunk_size, model_tag)).encode())
+            return sha.hexdigest()
+        array = np.ascontiguousarray(np.asarray(design), dtype=float)
+        sha = hashlib.sha1(array.tobytes())
+        sha.update(str(array.shape).encode())
+        sha.update(str((chunk_size, model_tag)).encode())
+        return sha.hexdigest()
+
+    def open(self, design):
+        '''Opens (or creates) the store of the passed design.
+
+        Arguments
+        ---------
+        design : ot.Sample
+            the input design of the batch evaluation
+
+        Returns
+        -------
+        bounds : list of tuples
+            (start, stop) row indices of each chunk of the design
+        '''
+        size = len(design)
+        self.__designKey__ = self.getDesignKey(design, self.chunk_size, self.model_tag)
+        if not os.path.isdir(self._getDesignDirectory()):
+            os.makedirs(self._getDesignDirectory())
+        if os.path.isfile(self._getManifestPath()):
+            with open(self._getManifestPath(), 'r') as fic:
+                self.__manifest__ = json.load(fic)
+        else :
+            self.__manifest__ = {'design_key' : self.__designKey__,
+                                 'model_tag'  : self.model_tag,
+                                 'size'       : size,
+                                 'dimension'  : len(design[0]),
+                                 'chunk_size' : self.chunk_size,
+                                 'n_chunks'   : -(-size // self.chunk_size),
+                                 'completed'  : []}
+            self._writeManifest()
+        return self.getChunkBounds()
+
+    def getChunkBounds(self):
+        '''Returns the (start, stop) row indices of each chunk of the design
+        '''
+        self._checkOpen()
+        size = self.__manifest__['size']
+        return [(start, min(start + self.chunk_size, size))
+                                for start in range(0, size, self.chunk_size)]
+
+    def getChunkSize(self):
+        '''Returns the number of rows per chunk
+        '''
+        return self.chunk_size
+
+    def getCompletedChunks(self):
+        '''Returns the sorted indices of the chunks already on disk
+        '''
+        if self.__manifest__ is None :
+            return []
+        return sorted(self.__manifest__['completed'])
+
+    def getDirectory(self):
+        '''Returns the root directory of the store
+        '''
+        return self.directory
+
+    def hasChunk(self, idx):
+        '''Checks if the chunk at index idx has already been evaluated
+        '''
+        self._checkOpen()
+        return idx in self.__manifest__['completed'] and \
+                                    os.path.isfile(self._getChunkPath(idx))
+
+    def isComplete(self):
+        '''Checks if all the chunks of the design are on disk
+        '''
+        self._checkOpen()
+        return len(self.__manifest__['completed']) == self.__manifest__['n_chunks']
+
+    def loadChunk(self, idx):
+        '''Loads the outputs of the chunk at index idx
+
+        Returns
+        -------
+        output : list
+            list of ot.Sample and ot.ProcessSample, as returned by the wrapper
+        '''
+        return self.loadChunkData(idx)[0]
+
+    def loadChunkMask(self, idx):
+        '''Loads the mask of the rows of the chunk at index idx that failed
+
+        Returns
+        -------
+        mask : numpy.ndarray of bool
+        '''
+        return self.loadChunkData(idx)[1]
+
+    def loadChunkData(self, idx):
+        '''Loads the outputs and the mask of the chunk at index idx, reading
+        the file once
+
+        Returns
+        -------
+        output : list
+            list of ot.Sample and ot.ProcessSample, as returned by the wrapper
+        mask : numpy.ndarray of bool
+            True for the rows of the chunk that failed
+        '''
+        self._checkOpen()
+        with open(self._getChunkPath(idx), 'rb') as fic:
+            data = pickle.load(fic)
+        return data['output'], data['mask']
+
+    def saveChunk(self, idx, output, mask=None):
+        '''Appends the outputs of the chunk at index idx to the store
+
+        Arguments
+        ---------
+        idx : int
+            index of the chunk
+        output : list
+            list of ot.Sample and ot.ProcessSample, as returned by the wrapper
+        mask : numpy.ndarray of bool, optional
+            True for the rows of the chunk that failed
+        '''
+        self._checkOpen()
+        bounds = self.getChunkBounds()[idx]
+        if mask is None :
+            mask = np.zeros(bounds[1] - bounds[0], dtype=bool)
+        path = self._getChunkPath(idx)
+        with open(path + '.tmp', 'wb') as fic:
+            pickle.dump({'output' : output, 'mask' : np.asarray(mask, dtype=bool)},
+                        fic, protocol=pickle.HIGHEST_PROTOCOL)
+            fic.flush()
+            os.fsync(fic.fileno())
+        os.replace(path + '.tmp', path)
+        if idx not in self.__manifest__['completed']:
+            self.__manifest__['completed'].append(idx)
+        self._writeManifest()
+
+    def clear(self):
+        '''Removes the evaluated chunks of the opened design
+        '''
+        self._checkOpen()
+        for idx in self.__manifest__['completed']:
+            if os.path.isfile(self._getChunkPath(idx)):
+                os.remove(self._getChunkPath(idx))
+        self.__manifest__['completed'] = []
+        self._writeManifest()
+
+    def _checkOpen(self):
+        assert self.__manifest__ is not None, \
+                "Open the checkpoint with the design to evaluate first"
+
+    def _getDesignDirectory(self):
+        return os.path.join(self.directory, self.__designKey__)
+
+    def _getManifestPath(self):
+        return os.path.join(self._getDesignDirectory(), 'manifest.json')
+
+    def _getChunkPath(self, idx):
+        return os.path.join(self._getDesignDirectory(),
+                            'chunk_{:06d}.pkl'.format(idx))
+
+    def _writeManifest(self):
+        path = self._getManifestPath()
+        with open(path + '.tmp', 'w') as fic:
+            json.dump(self.__manifest__, fic)
+            fic.flush()
+            os.fsync(fic.fileno())
+        os.replace(path + '.tmp', path)
@@ -0,0 +1,197 @@
+__author__ = 'Kristof Attila S.'
+__version__ = '0.1'
+__date__  = '19.10.26'
+
+__all__ = ['EvaluationInstrumentation']
+
+import json
+import time
+from contextlib import contextmanager
+import numpy as np
+import openturns as ot
+
+
+def getNBytes(obj):
+    '''Returns the number of bytes used by the values of an object of the
+    evaluation : numpy arrays, openturns samples, fields and process samples,
+    or lists and dictionaries of them.
+    '''
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    if isinstance(obj, ot.ProcessSample):
+        return 8 * obj.getSize() * obj.getMesh().getVerticesNumber() * obj.getDimension()
+    if isinstance(obj, ot.Field):
+        return 8 * obj.getMesh().getVerticesNumber() * obj.getOutputDimension()
+    if isinstance(obj, ot.Sample):
+        return 8 * obj.getSize() * obj.getDimension()
+    if isinstance(obj, ot.Point):
+        return 8 * obj.getDimension()
+    if isinstance(obj, dict):
+        return sum(getNBytes(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(getNBytes(value) for value in obj)
+    if hasattr(obj, 'nbytes'):
+        # compressed outputs
+        return int(obj.nbytes)
+    return 0
+
+
+class EvaluationInstrumentation(object):
+    '''Timers and counters of the evaluations done by the function wrapper.
+
+    The time spent in each stage of an evaluation (lifting of the
+    coefficients, execution of the model, conversion of the outputs) is
+    accumulated over all calls and kept for the last call, together with the
+    number of rows evaluated, the number of bytes of the lifted inputs and of
+    the outputs, the hits and misses of the caches of the wrapper, the rows
+    whose evaluation failed, the duplicated rows evaluated only once and the
+    rows predicted by the surrogate.
+
+    If a log file is set, one json line is appended per call.
+    '''
+    STAGES = ('lifting', 'execution', 'conversion')
+
+    def __init__(self, log_file=None):
+        self.log_file = log_file
+        self.reset()
+
+    def __repr__(self):
+        stats = self.getStatistics()
+        return ', '.join(['EvaluationInstrumentation',
+                          'calls : {}'.format(stats['calls']),
+                          'rows : {}'.format(stats['rows']),
+                          'rows per second : {:.4g}'.format(stats['rows_per_second'])]
+                         + ['{} : {:.4g}s'.format(stage, stats['time'][stage])
+                                            for stage in stats['time']])
+
+    def reset(self):
+        '''Sets all the timers and counters back to zero
+        '''
+        self.__time__ = dict.fromkeys(self.STAGES, 0.)
+        self.__counters__ = {'calls' : 0, 'rows' : 0, 'bytes_lifted' : 0,
+                             'bytes_output' : 0, 'cache_hits' : 0,
+                             'cache_misses' : 0, 'failed_rows' : 0,
+                             'deduplicated_rows' : 0, 'surrogate_rows' : 0}
+        self.__lastCall__ = None
+        self.__currentCall__ = None
+        self.__wallTime__ = 0.
+
+    @contextmanager
+    def timeStage(self, stage):
+        '''Context manager adding the time spent in its block to a stage
+
+        Arguments
+        ---------
+        stage : str
+            'lifting', 'execution', 'conversion' or any other stage name
+        '''
+        tic = time.perf_counter()
+        try :
+            yield
+        finally :
+            elapsed = time.perf_counter() - tic
+            self.__time__[stage] = self.__time__.get(stage, 0.) + elapsed
+            if self.__currentCall__ is not None :
+                times = self.__currentCall__['time']
+                times[stage] = times.get(stage, 0.) + elapsed
+
+    def startCall(self):
+        '''Starts the record of a call to the wrapper
+        '''
+        self.__currentCall__ = {'time' : dict.fromkeys(self.STAGES, 0.),
+                                'bytes_lifted' : 0, 'bytes_output' : 0,
+                                'cache_hits' : 0, 'cache_misses' : 0,
+                                'start' : time.perf_counter()}
+
+    def stopCall(self, rows):
+        '''Ends the record of a call to the wrapper
+
+        Arguments
+        ---------
+        rows : int
+            number of rows evaluated by the call
+        '''
+        call = self.__currentCall__
+        if call is None :
+            return None
+        wallTime = time.perf_counter() - call.pop('start')
+        self.__currentCall__ = None
+        self.__counters__['calls'] += 1
+        self.__counters__['rows'] += int(rows)
+        self.__wallTime__ += wallTime
+        call['call'] = self.__counters__['calls']
+        call['rows'] = int(rows)
+        call['wall_time'] = wallTime
+        call['rows_per_second'] = rows / wallTime if wallTime > 0 else 0.
+        self.__lastCall__ = call
+        if self.log_file is not None :
+            with open(self.log_file, 'a') as fic:
+                fic.write(json.dumps(call) + '\n')
+
+    def addBytes(self, kind, obj):
+        '''Counts the bytes of the lifted inputs or of the outputs of a chunk
+
+        Arguments
+        ---------
+        kind : str
+            'lifted' or 'output'
+        obj : object of the evaluation (see getNBytes)
+        '''
+        self._count('bytes_' + kind, getNBytes(obj))
+
+    def addCacheHits(self, hits=0, misses=0):
+        '''Counts the rows found in (hits) or missing from (misses) a cache
+        '''
+        self._count('cache_hits', hits)
+        self._count('cache_misses', misses)
+
+    def addDuplicates(self, rows):
+        '''Counts the rows not evaluated because identical to another one
+        '''
+        self._count('deduplicated_rows', rows)
+
+    def addSurrogateRows(self, rows):
+        '''Counts the rows predicted by the surrogate of the model
+        '''
+        self._count('surrogate_rows', rows)
+
+    def addFailures(self, rows):
+        '''Counts the rows whose evaluation failed
+        '''
+        self._count('failed_rows', rows)
+
+    def getLastCall(self):
+        '''Returns the record of the last call
+
+        Returns
+        -------
+        call : dict or None
+        '''
+        return self.__lastCall__
+
+    def getStatistics(self):
+        '''Returns the cumulated timers and counters
+
+        Returns
+        -------
+        statistics : dict
+        '''
+        stats = dict(self.__counters__)
+        stats['time'] = dict(self.__time__)
+        stats['wall_time'] = self.__wallTime__
+        stats['rows_per_second'] = (stats['rows'] / self.__wallTime__
+                                    if self.__wallTime__ > 0 else 0.)
+        lookups = stats['cache_hits'] + stats['cache_misses']
+        stats['cache_hit_rate'] = stats['cache_hits'] / lookups if lookups > 0 else 0.
+        stats['last_call'] = self.__lastCall__
+        return stats
+
+    def setLogFile(self, log_file=None):
+        '''Sets the json lines file where each call is logged, None to stop
+        '''
+        self.log_file = log_file
+
+    def _count(self, key, value):
+        self.__counters__[key] = self.__counters__.get(key, 0) + int(value)
+        if self.__currentCall__ is not None :
+            self.__currentCall__[key] = self.__currentCall__.get(key, 0) + int(value)
@@ -0,0 +1,407 @@
+__author__ = 'Kristof Attila S.'
+__version__ = '0.1'
+__date__  = '19.10.26'
+
+__all__ = ['EvaluationServer', 'EvaluationClient']
+
+import os
+import threading
+import itertools
+import multiprocessing
+from multiprocessing.connection import Listener, Client
+import numpy as np
+import openturns as ot
+try :
+    from ._karhunenLoeveGeneralizedFunctionWrapper import concatenateOutputs
+except ImportError :
+    from _karhunenLoeveGeneralizedFunctionWrapper import concatenateOutputs
+
+
+def _workerLoop(factory, tasks, results, current):
+    '''Loop of a worker process : builds the function wrapper once, then
+    evaluates the chunks of coefficients of the task queue until it receives
+    None. The client, job and chunk being evaluated are written in the shared
+    array current, -1 when idle.
+    '''
+    try :
+        wrapper = factory()
+    except Exception as e :
+        results.put(('failed', os.getpid(), repr(e)))
+        return None
+    results.put(('ready', os.getpid(), None))
+    while True :
+        task = tasks.get()
+        if task is None :
+            break
+        client, job, chunk, coefficients = task
+        # in shared memory, written at once : lets the server answer the
+        # client if the process dies on the chunk
+        current[:] = [client, job, chunk]
+        try :
+            output = wrapper(ot.Sample(coefficients))
+            mask = wrapper.getFailureMask()
+            if mask is None :
+                mask = np.zeros(len(coefficients), dtype=bool)
+            results.put(('result', client, (job, chunk, output, mask)))
+        except Exception as e :
+            results.put(('error', client, (job, chunk, repr(e))))
+        current[:] = [-1, -1, -1]
+
+
+class EvaluationServer(object):
+    '''Local evaluation service keeping a pool of warm worker processes.
+
+    Each worker builds the function wrapper (the model and its
+    AggregatedKarhunenLoeveResults) only once, when the server starts, and
+    then evaluates the chunks of coefficients sent by any number of clients
+    (see EvaluationClient) over a local socket. Several studies or notebooks
+    on the same machine can so share the same pool without paying the
+    startup costs of the model at each call.
+
+    The workers are checked every POLL_TIME seconds : a worker that died
+    (killed for its memory, or crashed in the model) is replaced by a new
+    one, and the client of the chunk it was evaluating receives an error
+    for that chunk, as the chunk may be what killed it.
+
+    Parameters
+    ----------
+    factory : callable
+        function without arguments returning a
+        KarhunenLoeveGeneralizedFunctionWrapper. It is called once in each
+        worker, so it has to be picklable (defined at module level).
+    address : tuple or str
+        (host, port) of the socket, port 0 for a free port, or the path of a
+        unix socket
+    authkey : bytes
+        key the clients need to connect
+    n_workers : int
+        number of worker processes
+    '''
+    POLL_TIME = 0.5
+
+    def __init__(self, factory, address=('localhost', 0), authkey=b'klfs',
+                 n_workers=2):
+        self.factory = factory
+        self.address = address
+        self.authkey = authkey
+        self.n_workers = int(n_workers)
+        self.__listener__ = None
+        self.__workers__ = list()
+        self.__clients__ = dict()
+        self.__lock__ = threading.Lock()
+        self.__threads__ = list()
+        self.__ids__ = itertools.count()
+        self.__ready__ = threading.Semaphore(0)
+        self.__failed__ = list()
+        # for each worker, the client, job and chunk it evaluates
+        self.__current__ = list()
+        self.__stopping__ = threading.Event()
+
+    def __repr__(self):
+        return ', '.join(['EvaluationServer',
+                          'address : {}'.format(self.getAddress()),
+                          'workers : {}'.format(self.n_workers),
+                          'clients : {}'.format(len(self.__clients__))])
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def getAddress(self):
+        '''Returns the address the clients connect to
+        '''
+        if self.__listener__ is not None :
+            return self.__listener__.address
+        return self.address
+
+    def isRunning(self):
+        '''Checks if the server accepts connections
+        '''
+        return self.__listener__ is not None
+
+    def start(self, timeout=None):
+        '''Starts the workers, waits until they have built their wrapper, and
+        starts accepting the clients.
+
+        Arguments
+        ---------
+        timeout : float, optional
+            maximal time in seconds to wait for each worker to be ready
+        '''
+        assert self.__listener__ is None, "The server is already running"
+        self.__tasks__ = multiprocessing.Queue()
+        self.__results__ = multiprocessing.Queue()
+        self.__stopping__.clear()
+        self.__current__ = [multiprocessing.Array('q', [-1, -1, -1])
+                            for i in range(self.n_workers)]
+        self.__workers__ = [self._startWorker(current) for current in self.__current__]
+        self._startThread(self._dispatchResults)
+        for i in range(self.n_workers):
+            if not self.__ready__.acquire(timeout=timeout):
+                self.stop()
+                raise TimeoutError('The workers were not ready in time')
+        if len(self.__failed__) > 0 :
+            self.stop()
+            raise RuntimeError('Could not build the function wrapper in the workers : '
+                               + self.__failed__[0])
+        self.__listener__ = Listener(self.address, authkey=self.authkey)
+        self._startThread(self._acceptClients)
+        self._startThread(self._monitorWorkers)
+
+    def stop(self):
+        '''Stops accepting clients, disconnects them and stops the workers
+        '''
+        self.__stopping__.set()
+        listener, self.__listener__ = self.__listener__, None
+        if listener is not None :
+            try :
+                Client(listener.address, authkey=self.authkey).close()
+            except (OSError, EOFError):
+                pass
+            listener.close()
+        with self.__lock__ :
+            for connection in self.__clients__.values():
+                connection.close()
+            self.__clients__.clear()
+        for worker in self.__workers__ :
+            self.__tasks__.put(None)
+        for worker in self.__workers__ :
+            worker.join(5)
+            if worker.is_alive():
+                worker.terminate()
+        if len(self.__workers__) > 0 :
+            self.__results__.put(None)
+        self.__workers__ = list()
+        for thread in self.__threads__ :
+            thread.join(5)
+        self.__threads__ = list()
+
+    def serveForever(self):
+        '''Starts the server if needed and blocks until it is interrupted
+        '''
+        if not self.isRunning():
+            self.start()
+        try :
+            while self.isRunning():
+                threading.Event().wait(1.)
+        except KeyboardInterrupt :
+            pass
+        finally :
+            self.stop()
+
+    def _startWorker(self, current):
+        worker = multiprocessing.Process(target=_workerLoop,
+                                         args=(self.factory, self.__tasks__,
+                                               self.__results__, current),
+                                         daemon=True)
+        worker.start()
+        return worker
+
+    def _monitorWorkers(self):
+        '''Replaces the dead workers, and fails the chunks they were evaluating
+        '''
+        while not self.__stopping__.wait(self.POLL_TIME):
+            for i, worker in enumerate(self.__workers__):
+                if worker.is_alive() or self.__stopping__.is_set():
+                    continue
+                client, job, chunk = self.__current__[i][:]
+                self.__current__[i][:] = [-1, -1, -1]
+                self.__workers__[i] = self._startWorker(self.__current__[i])
+                if client >= 0 :
+                    self._send(client, ('error', job, chunk,
+                        'the worker died with exit code {}'.format(worker.exitcode)))
+
+    def _startThread(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self.__threads__.append(thread)
+
+    def _acceptClients(self):
+        listener = self.__listener__
+        while True :
+            try :
+                connection = listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError):
+                # a client with the wrong key, or the closed listener
+                if self.__listener__ is None :
+                    break
+                continue
+            if self.__listener__ is None :
+                # the connection made by stop to wake the listener up
+                connection.close()
+                break
+            client = next(self.__ids__)
+            with self.__lock__ :
+                self.__clients__[client] = connection
+            self._startThread(self._serveClient, client, connection)
+
+    def _serveClient(self, client, connection):
+        '''Forwards the chunks sent by a client to the workers
+        '''
+        try :
+            while True :
+                message = connection.recv()
+                if message[0] == 'evaluate' :
+                    job, chunk, coefficients = message[1:]
+                    self.__tasks__.put((client, job, chunk, coefficients))
+                elif message[0] == 'info' :
+                    self._send(client, ('info', {'workers' : self.n_workers}))
+                elif message[0] == 'close' :
+                    break
+        except (EOFError, OSError, TypeError):
+            # TypeError : the connection closed by stop while receiving
+            pass
+        finally :
+            with self.__lock__ :
+                self.__clients__.pop(client, None)
+            connection.close()
+
+    def _dispatchResults(self):
+        '''Sends the results of the workers back to their client
+        '''
+        while True :
+            message = self.__results__.get()
+            if message is None :
+                break
+            kind, client, content = message
+            if kind == 'ready' :
+                self.__ready__.release()
+            elif kind == 'failed' :
+                self.__failed__.append(content)
+                self.__ready__.release()
+            else :
+                self._send(client, (kind,) + content)
+
+    def _send(self, client, message):
+        with self.__lock__ :
+            connection = self.__clients__.get(client)
+            if connection is None :
+                return None
+            try :
+                connection.send(message)
+            except (OSError, EOFError):
+                self.__clients__.pop(client, None)
+
+
+class EvaluationClient(object):
+    '''Client of an EvaluationServer.
+
+    Parameters
+    ----------
+    address : tuple or str
+        address of the server, see EvaluationServer.getAddress
+    authkey : bytes
+        key of the server
+    chunk_size : int
+        number of rows per chunk sent to the server
+    max_in_flight : int, optional
+        number of chunks sent and not yet received, by default twice the
+        number of workers of the server
+    timeout : float, optional
+        maximal time in seconds to wait for the next chunk from the server,
+        after which a TimeoutError is raised, by default no limit
+    '''
+    def __init__(self, address, authkey=b'klfs', chunk_size=100, max_in_flight=None,
+                 timeout=None):
+        self.connection = Client(address, authkey=authkey)
+        self.chunk_size = int(chunk_size)
+        self.timeout = timeout
+        self.connection.send(('info',))
+        self.info = self.connection.recv()[1]
+        self.max_in_flight = int(max_in_flight) if max_in_flight is not None \
+                                            else 2 * self.info['workers']
+        self.__jobs__ = itertools.count()
+        self.__lastMask__ = None
+
+    def __repr__(self):
+        return ', '.join(['EvaluationClient',
+                          'server workers : {}'.format(self.info['workers']),
+                          'chunk size : {}'.format(self.chunk_size)])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __call__(self, X):
+        return self.evaluate(X)
+
+    def close(self):
+        '''Closes the connection to the server
+        '''
+        try :
+            self.connection.send(('close',))
+        except (OSError, EOFError):
+            pass
+        self.connection.close()
+
+    def evaluate(self, X):
+        '''Evaluates the coefficients on the server
+
+        Arguments
+        ---------
+        X : ot.Sample or numpy.ndarray
+            the coefficients, of the input dimension of the wrapper
+
+        Returns
+        -------
+        outputs : list
+            list of ot.Sample and ot.ProcessSample, in the order of the rows
+        '''
+        outputs = dict()
+        masks = dict()
+        for start, stop, output, mask in self.iterateChunks(X):
+            outputs[start] = output
+            masks[start] = mask
+        starts = sorted(outputs)
+        self.__lastMask__ = np.concatenate([masks[start] for start in starts])
+        if len(starts) == 1 :
+            return outputs[starts[0]]
+        return concatenateOutputs([outputs[start] for start in starts])
+
+    def getFailureMask(self):
+        '''Returns the mask of the rows that failed in the last evaluate call
+        '''
+        return self.__lastMask__
+
+    def iterateChunks(self, X):
+        '''Sends the coefficients chunk by chunk to the server, and yields the
+        outputs of each chunk as soon as the server has evaluated it.
+
+        Yields
+        ------
+        start, stop : int
+            rows of the chunk in X
+        output : list
+            list of ot.Sample and ot.ProcessSample of the chunk
+        mask : numpy.ndarray of bool
+            True for the rows of the chunk that failed
+        '''
+        array = np.array(X, dtype=float)
+        size = array.shape[0]
+        job = next(self.__jobs__)
+        bounds = [(start, min(start + self.chunk_size, size))
+                                for start in range(0, size, self.chunk_size)]
+        sent = 0
+        received = 0
+        while received < len(bounds):
+            while sent < len(bounds) and sent - received < self.max_in_flight :
+                start, stop = bounds[sent]
+                self.connection.send(('evaluate', job, sent, array[start:stop]))
+                sent += 1
+            if not self.connection.poll(self.timeout):
+                raise TimeoutError('No chunk received from the server in {} s'.format(
+                                                                        self.timeout))
+            message = self.connection.recv()
+            if message[1] != job :
+                continue
+            received += 1
+            start, stop = bounds[message[2]]
+            if message[0] == 'error' :
+                raise RuntimeError('Chunk {} failed on the server : {}'.format(
+                                                            message[2], message[3]))
+            yield start, stop, message[3], message[4]
@@ -0,0 +1,454 @@
+__author__ = 'Kristof Attila S.'
+__version__ = '0.1'
+__date__  = '19.10.26'
+
+__all__ = ['FileWorkQueue', 'runWorker']
+
+import io
+import os
+import sys
+import json
+import time
+import logging
+import pickle
+import socket
+import argparse
+import importlib
+import threading
+from numbers import Integral
+import numpy as np
+import openturns as ot
+try :
+    from ._evaluationCheckpoint import EvaluationCheckpoint
+    from ._virtualSobolDesign import VirtualSobolDesign
+    from ._karhunenLoeveGeneralizedFunctionWrapper import concatenateOutputs
+except ImportError :
+    from _evaluationCheckpoint import EvaluationCheckpoint
+    from _virtualSobolDesign import VirtualSobolDesign
+    from _karhunenLoeveGeneralizedFunctionWrapper import concatenateOutputs
+
+
+class FileWorkQueue(object):
+    '''Work queue made of files in a shared directory, for several processes
+    or machines (sharing for example a NFS directory) to evaluate the same
+    design without any scheduler.
+
+    The coordinator splits the design in chunks, each written as a task file.
+    A worker claims a task by renaming its file into the claimed directory,
+    which only one worker can succeed in doing. While it evaluates the chunk,
+    the worker touches the claimed file at regular intervals (heartbeat). A
+    claimed task whose file was not touched for longer than the lease is put
+    back in the queue, so the chunks of a crashed worker are evaluated by
+    another one. The results are written as one file per chunk, and merged in
+    the order of the design by the coordinator.
+
+    Layout of a design directory (named after a hash of the design) :
+    manifest.json, clock, tasks/chunk_XXXXXX.npy,
+    claimed/chunk_XXXXXX__worker.npy, results/chunk_XXXXXX.pkl
+
+    Parameters
+    ----------
+    directory : str
+        shared root directory of the queue
+    chunk_size : int
+        number of rows per task
+    lease : float
+        time in seconds after which a claimed task without heartbeat expires
+
+    Note
+    ----
+    The age of a claimed file is measured against the file clock, touched
+    just before : both modification times are set by the same file system
+    (the server for NFS), so the clocks of the machines do not need to be
+    synchronized.
+    '''
+    def __init__(self, directory, chunk_size=100, lease=60.):
+        assert isinstance(chunk_size, Integral) and chunk_size > 0, \
+            "Chunk size can only be positive integer"
+        self.directory = directory
+        self.chunk_size = int(chunk_size)
+        self.lease = float(lease)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+
+    def __repr__(self):
+        return ', '.join(['FileWorkQueue',
+                          'directory : {}'.format(self.directory),
+                          'chunk size : {}'.format(self.chunk_size),
+                          'lease : {}s'.format(self.lease)])
+
+    def submit(self, design, model_tag=None):
+        '''Writes the chunks of the design as task files. The chunks already
+        queued, claimed or evaluated are not written again, so a design can
+        be submitted again after a crash of the coordinator.
+
+        Arguments
+        ---------
+        design : ot.Sample, numpy.ndarray or VirtualSobolDesign
+            the coefficients to evaluate
+        model_tag : str, optional
+            identity of the model, so that the results of another model on
+            the same design are kept apart
+
+        Returns
+        -------
+        key : str
+            key of the design in the queue
+        '''
+        if isinstance(design, VirtualSobolDesign):
+            array = design
+        else :
+            array = np.array(design, dtype=float)
+        key = EvaluationCheckpoint.getDesignKey(array, self.chunk_size, model_tag)
+        for sub in ('tasks', 'claimed', 'results'):
+            os.makedirs(os.path.join(self.directory, key, sub), exist_ok=True)
+        manifest = {'size' : len(array), 'chunk_size' : self.chunk_size,
+                    'n_chunks' : -(-len(array) // self.chunk_size)}
+        _atomicWrite(self._getPath(key, 'manifest.json'),
+                     json.dumps(manifest).encode())
+        claimed = set(self._getClaimedIndices(key))
+        for idx, (start, stop) in enumerate(self.getChunkBounds(key)):
+            if idx in claimed or os.path.isfile(self._getResultPath(key, idx)) :
+                continue
+            path = self._getTaskPath(key, idx)
+            if not os.path.isfile(path):
+                buffer = io.BytesIO()
+                np.save(buffer, np.asarray(array[start:stop]))
+                _atomicWrite(path, buffer.getvalue())
+        return key
+
+    def getChunkBounds(self, key):
+        '''Returns the (start, stop) rows of each chunk of the design
+        '''
+        manifest = self._getManifest(key)
+        size, chunk_size = manifest['size'], manifest['chunk_size']
+        return [(start, min(start + chunk_size, size))
+                                for start in range(0, size, chunk_size)]
+
+    def getProgress(self, key):
+        '''Returns the number of chunks queued, claimed and finished
+
+        Returns
+        -------
+        progress : dict
+        '''
+        return {'queued'   : len(self._listChunks(key, 'tasks')),
+                'claimed'  : len(self._getClaimedIndices(key)),
+                'finished' : len(self._listChunks(key, 'results')),
+                'total'    : self._getManifest(key)['n_chunks']}
+
+    def isComplete(self, key):
+        '''Checks if all the chunks of the design have been evaluated
+        '''
+        progress = self.getProgress(key)
+        return progress['finished'] == progress['total']
+
+    def claim(self, worker=None):
+        '''Claims the first queued task of any design of the queue
+
+        Arguments
+        ---------
+        worker : str, optional
+            name of the worker, by default host name and process id
+
+        Returns
+        -------
+        task : tuple or None
+            (key, idx, coefficients, claimed path), None if the queue is empty
+        '''
+        for key in sorted(os.listdir(self.directory)):
+            if not os.path.isdir(self._getPath(key, 'tasks')):
+                continue
+            task = self._claimFrom(key, worker)
+            if task is not None :
+                return task
+        return None
+
+    def heartbeat(self, claimedPath):
+        '''Renews the lease of a claimed task
+
+        Returns
+        -------
+        alive : bool
+            False if the task expired and was put back in the queue
+        '''
+        try :
+            os.utime(claimedPath)
+            return True
+        except OSError :
+            return False
+
+    def complete(self, key, idx, output, mask, claimedPath=None):
+        '''Writes the result of a chunk and removes its claim
+        '''
+        _atomicWrite(self._getResultPath(key, idx),
+                     pickle.dumps({'output' : output, 'mask' : np.asarray(mask, dtype=bool)},
+                                  protocol=pickle.HIGHEST_PROTOCOL))
+        if claimedPath is not None :
+            _removeIfExists(claimedPath)
+        # the task may have expired and been queued again meanwhile
+        _removeIfExists(self._getTaskPath(key, idx))
+
+    def release(self, key, idx, claimedPath):
+        '''Puts a claimed task back in the queue
+        '''
+        try :
+            os.rename(claimedPath, self._getTaskPath(key, idx))
+        except OSError :
+            pass
+
+    def requeueExpired(self, key=None):
+        '''Puts back in the queue the claimed tasks whose lease expired
+
+        Returns
+        -------
+        n_requeued : int
+        '''
+        keys = [key] if key is not None else [k for k in os.listdir(self.directory)
+                                if os.path.isdir(self._getPath(k, 'claimed'))]
+        requeued = 0
+        for key in keys :
+            now = self._getFileSystemTime(key)
+            claimedDir = self._getPath(key, 'claimed')
+            for name in os.listdir(claimedDir):
+                path = os.path.join(claimedDir, name)
+                try :
+                    expired = now - os.path.getmtime(path) > self.lease
+                except OSError :
+                    continue
+                if not expired :
+                    continue
+                idx = int(name.split('__')[0].split('_')[1])
+                if os.path.isfile(self._getResultPath(key, idx)):
+                    # finished, but its worker died before removing the claim
+                    _removeIfExists(path)
+                    continue
+                self.release(key, idx, path)
+                requeued += 1
+        return requeued
+
+    def loadResult(self, key, idx):
+        '''Loads the result of a chunk
+
+        Returns
+        -------
+        output : list
+            list of ot.Sample and ot.ProcessSample of the chunk
+        mask : numpy.ndarray of bool
+        '''
+        with open(self._getResultPath(key, idx), 'rb') as fic:
+            result = pickle.load(fic)
+        return result['output'], result['mask']
+
+    def collect(self, key, evaluate=None, timeout=None, poll=1.):
+        '''Waits until all the chunks of the design are evaluated, putting
+        the expired tasks back in the queue, and merges the results in order.
+
+        Arguments
+        ---------
+        key : str
+            key of the design, as returned by submit
+        evaluate : callable, optional
+            evaluate(coefficients) -> (output, mask). If given, the coordinator
+            evaluates queued chunks of the design itself while waiting.
+        timeout : float, optional
+            maximal time to wait, in seconds
+        poll : float
+            time between two checks of the results, in seconds
+
+        Returns
+        -------
+        outputs : list
+            list of ot.Sample and ot.ProcessSample of the whole design
+        mask : numpy.ndarray of bool
+            True for the rows that failed
+        '''
+        tic = time.time()
+        while not self.isComplete(key):
+            if timeout is not None and time.time() - tic > timeout :
+                raise TimeoutError('The design {} was not evaluated in {} seconds : {}'.format(
+                                        key, timeout, self.getProgress(key)))
+            self.requeueExpired(key)
+            task = self._claimFrom(key) if evaluate is not None else None
+            if task is not None :
+                _evaluateTask(self, task, evaluate)
+            else :
+                time.sleep(poll)
+        results = [self.loadResult(key, idx) for idx in range(len(self.getChunkBounds(key)))]
+        mask = np.concatenate([result[1] for result in results])
+        if len(results) == 1 :
+            return results[0][0], mask
+        return concatenateOutputs([result[0] for result in results]), mask
+
+    def _claimFrom(self, key, worker=None):
+        worker = worker if worker is not None else getWorkerName()
+        for idx in self._listChunks(key, 'tasks'):
+            claimedPath = self._getClaimedPath(key, idx, worker)
+            try :
+                # the lease starts at the claim : the task is touched before
+                # being renamed, which keeps its modification time
+                os.utime(self._getTaskPath(key, idx))
+                os.rename(self._getTaskPath(key, idx), claimedPath)
+            except OSError :
+                # claimed by another worker in the meantime
+                continue
+            return key, idx, np.load(claimedPath), claimedPath
+        return None
+
+    def _getFileSystemTime(self, key):
+        '''Returns the current time of the file system of the design, as the
+        modification time of its clock file touched now
+        '''
+        path = self._getPath(key, 'clock')
+        with open(path, 'ab'):
+            pass
+        os.utime(path)
+        return os.path.getmtime(path)
+
+    def _getManifest(self, key):
+        with open(self._getPath(key, 'manifest.json'), 'r') as fic:
+            return json.load(fic)
+
+    def _listChunks(self, key, sub):
+        return sorted(int(name.split('.')[0].split('_')[1])
+                      for name in os.listdir(self._getPath(key, sub))
+                      if name.startswith('chunk_') and not name.endswith('.tmp'))
+
+    def _getClaimedIndices(self, key):
+        return [int(name.split('__')[0].split('_')[1])
+                for name in os.listdir(self._getPath(key, 'claimed'))]
+
+    def _getPath(self, key, *names):
+        return os.path.join(self.directory, key, *names)
+
+    def _getTaskPath(self, key, idx):
+        return self._getPath(key, 'tasks', 'chunk_{:06d}.npy'.format(idx))
+
+    def _getClaimedPath(self, key, idx, worker):
+        return self._getPath(key, 'claimed', 'chunk_{:06d}__{}.npy'.format(idx, worker))
+
+    def _getResultPath(self, key, idx):
+        return self._getPath(key, 'results', 'chunk_{:06d}.pkl'.format(idx))
+
+
+def getWorkerName():
+    '''Returns the name of the current process : host name and process id
+    '''
+    return '{}-{}'.format(socket.gethostname().replace('_', '-'), os.getpid())
+
+
+def _removeIfExists(path):
+    try :
+        os.remove(path)
+    except OSError :
+        pass
+
+
+def _atomicWrite(path, data):
+    tmp = '{}.{}.tmp'.format(path, getWorkerName())
+    with open(tmp, 'wb') as fic:
+        fic.write(data)
+        fic.flush()
+        os.fsync(fic.fileno())
+    os.replace(tmp, path)
+
+
+def _evaluateTask(queue, task, evaluate):
+    '''Evaluates a claimed task, renewing its lease from a thread until the
+    evaluation is finished, and writes its result.
+    '''
+    key, idx, coefficients, claimedPath = task
+    finished = threading.Event()
+    def beat():
+        while not finished.wait(queue.lease / 3.):
+            queue.heartbeat(claimedPath)
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try :
+        output, mask = evaluate(coefficients)
+    except BaseException :
+        finished.set()
+        queue.release(key, idx, claimedPath)
+        raise
+    finished.set()
+    thread.join()
+    queue.complete(key, idx, output, mask, claimedPath)
+
+
+def runWorker(directory, factory, lease=60., poll=1., idle_timeout=None, worker=None):
+    '''Entry point of a worker process : builds the function wrapper once,
+    then claims and evaluates the tasks of the queue.
+
+    Arguments
+    ---------
+    directory : str
+        root directory of the queue
+    factory : callable
+        function without arguments returning a
+        KarhunenLoeveGeneralizedFunctionWrapper
+    lease : float
+        lease of the queue, in seconds
+    poll : float
+        time between two looks at an empty queue, in seconds
+    idle_timeout : float, optional
+        time after which a worker finding the queue empty stops
+    worker : str, optional
+        name of the worker
+
+    Returns
+    -------
+    n_chunks : int
+        number of chunks evaluated by the worker
+
+    Note
+    ----
+    From a shell : python -m KarhunenLoeveFieldSensitivity._fileWorkQueue
+    DIRECTORY module:factory
+    '''
+    queue = FileWorkQueue(directory, lease=lease)
+    wrapper = factory()
+    def evaluate(coefficients):
+        output = wrapper(ot.Sample(coefficients))
+        mask = wrapper.getFailureMask()
+        if mask is None :
+            mask = np.zeros(len(coefficients), dtype=bool)
+        return output, mask
+    n_chunks = 0
+    idleSince = time.time()
+    while True :
+        queue.requeueExpired()
+        task = queue.claim(worker)
+        if task is None :
+            if idle_timeout is not None and time.time() - idleSince > idle_timeout :
+                return n_chunks
+            time.sleep(poll)
+            continue
+        _evaluateTask(queue, task, evaluate)
+        n_chunks += 1
+        idleSince = time.time()
+
+
+def main(argv=None):
+    '''Command line entry point of a worker, logging the number of chunks
+    it evaluated. Returns the exit status.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Worker evaluating the tasks of a FileWorkQueue')
+    parser.add_argument('directory', help='root directory of the queue')
+    parser.add_argument('factory', help='module:function returning the function wrapper')
+    parser.add_argument('--lease', type=float, default=60.)
+    parser.add_argument('--poll', type=float, default=1.)
+    parser.add_argument('--idle-timeout', type=float, default=None)
+    parser.add_argument('--quiet', action='store_true', help='only log the warnings')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO,
+                        format='%(asctime)s %(name)s %(message)s')
+    moduleName, functionName = args.factory.split(':')
+    factory = getattr(importlib.import_module(moduleName), functionName)
+    n_chunks = runWorker(args.directory, factory, args.lease, args.poll, args.idle_timeout)
+    logging.getLogger(__name__).info('Evaluated {} chunks'.format(n_chunks))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
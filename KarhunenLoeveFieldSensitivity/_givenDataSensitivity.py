@@ -0,0 +1,258 @@
+__author__ = 'Kristof Attila S.'
+__version__ = '0.1'
+__date__  = '19.10.26'
+
+__all__ = ['GivenDataSensitivityAlgorithm']
+
+from numbers import Integral
+import numpy as np
+import openturns as ot
+try :
+    from ._virtualSobolDesign import parseGroups
+except ImportError :
+    from _virtualSobolDesign import parseGroups
+
+
+class GivenDataSensitivityAlgorithm(object):
+    '''First order Sobol' indices estimated from a single i.i.d. sample of
+    coefficients and its outputs, without a Sobol design.
+
+    Each input of the aggregation is a vector of Karhunen-Loeve coefficients,
+    so the conditioning is done on vectors : for each row j, its nearest
+    neighbour n(j) in the space of the coefficients of the input (or group
+    of inputs) is searched, and the index is the correlation of the outputs
+    of the pairs,
+
+        S_i = mean_j (y_j - m)(y_n(j) - m) / var(y)
+
+    The rows of a pair have almost the same input i and independent other
+    inputs, like the rows A and A_B^i of a Sobol design. The estimator is
+    consistent, with a bias decreasing with the distance between neighbours,
+    so it needs the number of modes per input to stay small : max_modes
+    keeps only the first modes of each field (the largest eigenvalues).
+
+    The confidence intervals are obtained by bootstrap of the pairs.
+
+    Parameters
+    ----------
+    inputSample : ot.Sample or numpy.ndarray
+        coefficients, of shape (n, modes), for instance the training sample
+        of a metamodel
+    outputDesign : list
+        ot.Sample and ot.ProcessSample of the outputs of the rows
+    aggregation : AggregatedKarhunenLoeveResults
+        gives the modes of each input
+    groups : dict or list, optional
+        groups of inputs, as in KarhunenLoeveSobolIndicesExperiment.setGroups
+    max_modes : int, optional
+        number of first modes of each input used to find the neighbours
+    '''
+    def __init__(self, inputSample=None, outputDesign=None, aggregation=None,
+                 groups=None, max_modes=None):
+        self.inputSample = None
+        self.outputDesign = list()
+        self.mode_count = list()
+        self.variable_names = list()
+        self.groups = list()
+        self.group_names = list()
+        self.max_modes = max_modes
+        self.__BootstrapSize__ = ot.ResourceMap.GetAsUnsignedInteger(
+                                        'SobolIndicesAlgorithm-DefaultBootstrapSize')
+        self.ConfidenceLevel = ot.ResourceMap.GetAsScalar(
+                                        'SobolIndicesAlgorithm-DefaultBootstrapConfidenceLevel')
+        self.__pairs__ = None
+        self.__name__ = 'Unnamed'
+        if aggregation is not None :
+            self.setAggregation(aggregation, groups)
+        if inputSample is not None and outputDesign is not None :
+            self.setDesign(inputSample, outputDesign)
+
+    def __repr__(self):
+        return ', '.join(['GivenDataSensitivityAlgorithm',
+                          'size : {}'.format(0 if self.inputSample is None
+                                             else self.inputSample.shape[0]),
+                          'inputs : {}'.format(self.group_names),
+                          'bootstrap size : {}'.format(self.__BootstrapSize__)])
+
+    def getClassName(self):
+        return self.__class__.__name__
+
+    def getName(self):
+        return self.__name__
+
+    def setName(self, name):
+        self.__name__ = name
+
+    def getBootstrapSize(self):
+        return self.__BootstrapSize__
+
+    def setBootstrapSize(self, bootstrapSize):
+        assert isinstance(bootstrapSize, Integral) and bootstrapSize > 1, \
+            "The bootstrap size can only be an integer larger than 1"
+        self.__BootstrapSize__ = int(bootstrapSize)
+
+    def getConfidenceLevel(self):
+        return self.ConfidenceLevel
+
+    def setConfidenceLevel(self, confidenceLevel):
+        assert 0 < confidenceLevel < 1, "The confidence level must be in ]0, 1["
+        self.ConfidenceLevel = confidenceLevel
+
+    def getMaxModes(self):
+        return self.max_modes
+
+    def setMaxModes(self, max_modes=None):
+        '''Sets the number of first modes of each input used to find the
+        neighbours, None for all of them
+        '''
+        self.max_modes = max_modes
+        self.__pairs__ = None
+
+    def setAggregation(self, aggregation, groups=None):
+        '''Sets the modes of each input from the aggregation, and the groups
+        of inputs the indices are computed for
+        '''
+        self.mode_count = [int(count) for count in aggregation.__mode_count__]
+        self.variable_names = list(aggregation.__process_distribution_description__)
+        if groups is None :
+            groups = [[i] for i in range(len(self.mode_count))]
+        self.groups, names = parseGroups(groups, self.variable_names)
+        if names is None :
+            names = ['_'.join(self.variable_names[i] for i in group) for group in self.groups]
+        self.group_names = names
+        self.__pairs__ = None
+
+    def setDesign(self, inputSample, outputDesign):
+        '''Sets the sample of coefficients and its outputs
+
+        Arguments
+        ---------
+        inputSample : ot.Sample or numpy.ndarray
+        outputDesign : ot.Sample, ot.ProcessSample or list of them
+        '''
+        self.inputSample = np.array(inputSample, dtype=float)
+        if not isinstance(outputDesign, (list, tuple)):
+            outputDesign = [outputDesign]
+        assert all(len(output) == self.inputSample.shape[0] for output in outputDesign), \
+            "The outputs must have as many rows as the input sample"
+        self.outputDesign = list(outputDesign)
+        self.__pairs__ = None
+
+    def getNeighbours(self):
+        '''Returns for each group the index of the nearest neighbour of each
+        row in the space of its coefficients, as an array (groups, n)
+        '''
+        if self.__pairs__ is None :
+            assert self.inputSample is not None and len(self.mode_count) > 0, \
+                "Set the aggregation and the design first"
+            assert sum(self.mode_count) == self.inputSample.shape[1], \
+                "The input sample does not have the modes of the aggregation"
+            bounds = np.cumsum([0] + self.mode_count)
+            self.__pairs__ = []
+            for group in self.groups :
+                columns = np.concatenate([np.arange(bounds[i], bounds[i] + (self.mode_count[i]
+                            if self.max_modes is None else min(self.mode_count[i], self.max_modes)))
+                            for i in group])
+                self.__pairs__.append(_nearestNeighbours(self.inputSample[:, columns]))
+            self.__pairs__ = np.array(self.__pairs__)
+        return self.__pairs__
+
+    def getFirstOrderIndices(self):
+        '''Returns the first order indices
+
+        Returns
+        -------
+        FO_indices : list
+            for each output, the list of the indices of each input (or group),
+            as ot.Point for the scalar outputs and ot.Field for the field outputs
+        '''
+        neighbours = self.getNeighbours()
+        rows = np.arange(self.inputSample.shape[0])
+        return self._formatIndices([_pairCorrelation(values, rows, neighbours)
+                                    for values in self._getOutputValues()], 'Sobol_')
+
+    def getFirstOrderIndicesInterval(self):
+        '''Returns the bootstrap confidence intervals of the first order indices
+
+        Returns
+        -------
+        FO_indices_interval : list
+            for each output, the interval of each input, as ot.Interval for
+            the scalar outputs and as a tuple of the lower and upper bound
+            ot.Field for the field outputs
+        '''
+        neighbours = self.getNeighbours()
+        size = self.inputSample.shape[0]
+        resamples = [np.array(ot.BootstrapExperiment.GenerateSelection(size, size), dtype=int)
+                     for b in range(self.__BootstrapSize__)]
+        alpha = (1 - self.ConfidenceLevel) / 2
+        intervals = []
+        for values, structure in zip(self._getOutputValues(), self._getStructure()):
+            bootstrap = np.array([_pairCorrelation(values, rows, neighbours[:, rows])
+                                  for rows in resamples])
+            lower = np.quantile(bootstrap, alpha, axis=0)
+            upper = np.quantile(bootstrap, 1 - alpha, axis=0)
+            perGroup = []
+            for name, low, up in zip(self.group_names, lower, upper):
+                if structure['mesh'] is not None :
+                    bounds = (ot.Field(structure['mesh'], low.reshape(-1, structure['dimension'])),
+                              ot.Field(structure['mesh'], up.reshape(-1, structure['dimension'])))
+                    [bound.setName('Bounds_Sobol_' + structure['name'] + '_' + name) for bound in bounds]
+                else :
+                    bounds = ot.Interval(low, up)
+                    bounds.setName('Bounds_Sobol_' + structure['name'] + '_' + name)
+                perGroup.append(bounds)
+            intervals.append(perGroup)
+        return intervals
+
+    def _getOutputValues(self):
+        size = self.inputSample.shape[0]
+        return [np.array(output, dtype=float).reshape(size, -1) for output in self.outputDesign]
+
+    def _getStructure(self):
+        structure = []
+        for output in self.outputDesign :
+            mesh = output.getMesh() if hasattr(output, 'getMesh') else None
+            structure.append({'name' : output.getName(), 'mesh' : mesh,
+                              'dimension' : output.getDimension()})
+        return structure
+
+    def _formatIndices(self, indices, prefix):
+        formatted = []
+        for structure, values in zip(self._getStructure(), indices):
+            perGroup = []
+            for name, value in zip(self.group_names, values):
+                if structure['mesh'] is not None :
+                    element = ot.Field(structure['mesh'], value.reshape(-1, structure['dimension']))
+                else :
+                    element = ot.Point(value)
+                element.setName(prefix + structure['name'] + '_' + name)
+                perGroup.append(element)
+            formatted.append(perGroup)
+        return formatted
+
+
+def _nearestNeighbours(points, chunkSize=1024):
+    '''Returns the index of the nearest other row of each row, computing the
+    distances by chunks of rows to bound the memory
+    '''
+    size = points.shape[0]
+    squaredNorms = np.sum(points**2, axis=1)
+    neighbours = np.empty(size, dtype=int)
+    for start in range(0, size, chunkSize):
+        stop = min(start + chunkSize, size)
+        distances = squaredNorms[start:stop, None] - 2 * points[start:stop] @ points.T \
+                    + squaredNorms[None, :]
+        distances[np.arange(stop - start), np.arange(start, stop)] = np.inf
+        neighbours[start:stop] = np.argmin(distances, axis=1)
+    return neighbours
+
+
+def _pairCorrelation(values, rows, neighbours):
+    '''Returns the first order indices of each group from the outputs of the
+    rows and of their neighbours, of shape (groups, marginals)
+    '''
+    y = values[rows]
+    mean, variance = y.mean(axis=0), y.var(axis=0, ddof=1)
+    return np.array([np.mean((y - mean) * (values[pairs] - mean), axis=0) / variance
+                     for pairs in neighbours])
@@ -4,10 +4,29 @@ __date__  = '17.09.20'
 
 __all__ = ['KarhunenLoeveGeneralizedFunctionWrapper']
 
+import time
+import asyncio
 import openturns as ot
-from collections import Iterable, UserList, Sequence
+import numpy as np
+from collections import Iterable, UserList, Sequence, OrderedDict
 from copy import copy, deepcopy
 from numbers import Complex, Integral, Real, Rational, Number
+try :
+    from ._aggregatedKarhunenLoeveResults import processSampleFromArray
+    from ._evaluationCheckpoint import EvaluationCheckpoint
+    from ._evaluationInstrumentation import EvaluationInstrumentation
+    from ._parallelEvaluation import ParallelEvaluator
+    from ._karhunenLoeveSnapshot import KarhunenLoeveSnapshot
+    from ._outputCompression import FieldOutputCompressor, CompressedProcessSample
+    from ._virtualSobolDesign import VirtualSobolDesign
+except ImportError :
+    from _aggregatedKarhunenLoeveResults import processSampleFromArray
+    from _evaluationCheckpoint import EvaluationCheckpoint
+    from _evaluationInstrumentation import EvaluationInstrumentation
+    from _parallelEvaluation import ParallelEvaluator
+    from _karhunenLoeveSnapshot import KarhunenLoeveSnapshot
+    from _outputCompression import FieldOutputCompressor, CompressedProcessSample
+    from _virtualSobolDesign import VirtualSobolDesign
 
 class KarhunenLoeveGeneralizedFunctionWrapper(object):
     '''Class allowing to rewrite any function taking as an input a list
@@ -21,6 +40,9 @@ class KarhunenLoeveGeneralizedFunctionWrapper(object):
     function. The input dimension of this function is dependent of the
     order of the Karhunen Loeve decomposition.
     '''
+    # rows read at once to identify the distinct rows of a sample
+    HASH_CHUNK_SIZE = 10000
+
     def __init__(self, AggregatedKarhunenLoeveResults=None, func=None,
         func_sample=None, n_outputs=1):
         self.func = func
@@ -34,6 +56,27 @@ class KarhunenLoeveGeneralizedFunctionWrapper(object):
         self.__name__ = 'Unnamed'
         self.__setDefaultState__()
         self.__output_backup__ = None
+        self.__chunkSize__ = None
+        self.__checkpoint__ = None
+        self.__modelTag__ = None
+        self.__outputSchema__ = None
+        self.__meshCache__ = dict()
+        self.__useNumpy__ = False
+        self.__verbose__ = False
+        self.__instrumentation__ = EvaluationInstrumentation()
+        self.__simulator__ = None
+        self.__failurePolicy__ = None
+        self.__failureMask__ = None
+        self.__failures__ = list()
+        self.__executor__ = None
+        self.__memoryBudget__ = None
+        self.__lastChunkSizes__ = list()
+        self.__deduplication__ = None
+        self.__rowCache__ = OrderedDict()
+        self.__outputStructure__ = None
+        self.__workQueue__ = None
+        self.__surrogate__ = None
+        self.__outputCompression__ = None
 
     def __setDefaultState__(self):
         """Gets the data from the inputs and intializes the attributes
@@ -74,21 +117,32 @@ class KarhunenLoeveGeneralizedFunctionWrapper(object):
         function that is passed to the class.
         """
         assert len(X)==self.getInputDimension()
-        inputFields = self.__AKLR__.liftAsField(X)
+        instrumentation = self.__instrumentation__
+        instrumentation.startCall()
+        with instrumentation.timeStage('lifting'):
+            inputFields = self.__AKLR__.liftAsField(X)
+        instrumentation.addBytes('lifted', inputFields)
         #evaluating ...
-        try :
-            result = self.func(inputFields)
-        except :
+        with instrumentation.timeStage('execution'):
             try :
-                result = self.func(*inputFields)
-            except TypeError as te:
-                print('did not manage to evaluate single function')
-                raise te
-        self.__output_backup__ = deepcopy(results)
+                result = self.func(inputFields)
+            except :
+                try :
+                    result = self.func(*inputFields)
+                except TypeError as te:
+                    print('did not manage to evaluate single function')
+                    raise te
+        self.__output_backup__ = deepcopy(result)
         # If the rest fails you can still get the data
-        result = CustomList.atLeastList(result)
-        result = self._convert_exec_ot(result)
+        with instrumentation.timeStage('conversion'):
+            result = CustomList.atLeastList(result)
+            if self.__outputSchema__ is not None :
+                result = self._convert_exec_schema(result)
+            else :
+                result = self._convert_exec_ot(result)
+        instrumentation.addBytes('output', result)
         self.__calls__+=1
+        instrumentation.stopCall(1)
         return result
 
     def _exec_sample(self, X):
@@ -96,22 +150,703 @@ class KarhunenLoeveGeneralizedFunctionWrapper(object):
         function that is passed to the class.
         """
         assert len(X[0])==self.getInputDimension()
-        inputProcessSamples = self.__AKLR__.liftAsProcessSample(X)
+        self.__instrumentation__.startCall()
+        self.__failures__ = list()
+        if self.isSurrogateActive():
+            result, self.__failureMask__ = self._exec_sample_surrogate(X)
+        elif self.__deduplication__ is not None :
+            result, self.__failureMask__ = self._exec_sample_unique(X)
+        else :
+            result, self.__failureMask__ = self._exec_sample_rows(X)
+        result = self._compressOutputs(result, self.__failureMask__)
+        self.__outputStructure__ = getOutputStructure(result)
+        self.__calls__ += X.__len__()
+        self.__instrumentation__.stopCall(X.__len__())
+        return result
+
+    def _exec_sample_surrogate(self, X):
+        """Predicts the outputs of X with the surrogate, and evaluates with the
+        true model the rows whose predicted variance exceeds the tolerance.
+        """
+        surrogate = self.__surrogate__
+        instrumentation = self.__instrumentation__
+        array = np.array(X, dtype=float)
+        size = array.shape[0]
+        fallback = np.zeros(size, dtype=bool)
+        if surrogate['variance'] is not None and surrogate['tolerance'] is not None :
+            variance = np.array(surrogate['variance'](array), dtype=float).reshape(size, -1)
+            fallback = (variance > surrogate['tolerance']).any(axis=1)
+        mask = np.zeros(size, dtype=bool)
+        if fallback.any():
+            self._log('{} of {} rows evaluated with the true model'.format(
+                                                        fallback.sum(), size))
+            result, mask[fallback] = self._exec_sample_rows(ot.Sample(array[fallback]))
+            self.__outputStructure__ = getOutputStructure(result)
+            if fallback.all():
+                return result, mask
+        structure = self._getKnownOutputStructure()
+        assert structure is not None, \
+            "Evaluate the true model once or declare an output schema before using the surrogate"
+        with instrumentation.timeStage('execution'):
+            predicted = np.array(surrogate['predict'](array[~fallback]), dtype=float)
+        predicted = predicted.reshape(predicted.shape[0], -1)
+        instrumentation.addSurrogateRows(int((~fallback).sum()))
+        sizes = [(element['mesh'].getVerticesNumber() if element['mesh'] is not None else 1)
+                  * element['dimension'] for element in structure]
+        assert predicted.shape[1] == sum(sizes), \
+            "The surrogate returns {} values per row, the outputs have {}".format(
+                                                        predicted.shape[1], sum(sizes))
+        outputs = [outputLike(structure[i], columns) for i, columns in
+                   enumerate(np.split(predicted, np.cumsum(sizes)[:-1], axis=1))]
+        # the outputs of the true model are already compressed, chunk by chunk
+        outputs = self._compressOutputs(outputs)
+        if fallback.any():
+            # the rows of the true model come first, then the predicted ones
+            order = np.concatenate([np.nonzero(fallback)[0], np.nonzero(~fallback)[0]])
+            position = np.empty(size, dtype=int)
+            position[order] = np.arange(size)
+            outputs = [takeRows(element, position)
+                       for element in concatenateOutputs([result, outputs])]
+        return outputs, mask
+
+    def _getKnownOutputStructure(self):
+        """Returns the structure of the outputs, from the output schema or from
+        the last batch evaluation, or None if unknown.
+        """
+        if self.__outputSchema__ is not None :
+            return [{'name'      : spec['name'],
+                     'mesh'      : spec['mesh'] if spec['kind'] == 'field' else None,
+                     'dimension' : spec['dimension']} for spec in self.__outputSchema__]
+        return self.__outputStructure__
+
+    def _exec_sample_rows(self, X):
+        """Evaluates all the rows of X through a work queue, in parallel, with
+        a memory budget, chunk by chunk or at once, depending on what is set.
+
+        Returns
+        -------
+        result : list of ot.Sample and ot.ProcessSample
+        mask : numpy.ndarray of bool
+            True for the rows that failed
+        """
+        if self.__workQueue__ is not None :
+            return self._exec_sample_queued(X)
+        elif self.__executor__ is not None :
+            return self._exec_sample_parallel(X)
+        elif self.__memoryBudget__ is not None and self.__checkpoint__ is None :
+            return self._exec_sample_budgeted(X)
+        elif self.__chunkSize__ is None and self.__checkpoint__ is None :
+            if isinstance(X, VirtualSobolDesign):
+                # the design is only built block by block
+                return self._exec_sample_chunked(X, X.getBlockSize())
+            if self.__outputCompression__ is not None :
+                # the fields are compressed chunk by chunk, never held at once
+                return self._exec_sample_chunked(X, self.__outputCompression__['chunk_size'])
+            return self._evaluateRows(X)
+        else :
+            return self._exec_sample_chunked(X)
+
+    def _exec_sample_queued(self, X):
+        """Submits the chunks of X to the file work queue and waits for the
+        workers to evaluate them, evaluating queued chunks too if set so.
+        """
+        settings = self.__workQueue__
+        queue = settings['queue']
+        key = queue.submit(X, self.getModelTag())
+        self._log('Submitted design {} : {}'.format(key, queue.getProgress(key)))
+        evaluate = None
+        if settings['participate'] :
+            evaluate = lambda coefficients : self._evaluateRows(ot.Sample(coefficients))
+        return queue.collect(key, evaluate, settings['timeout'], settings['poll'])
+
+    def _exec_sample_unique(self, X):
+        """Evaluates each distinct row of X only once, and scatters the
+        outputs back to all the rows. The rows are identified by the bytes of
+        their coefficients, read chunk by chunk so that X is never copied as
+        a whole. With a row cache, the outputs of the rows evaluated by the
+        previous calls are reused as well.
+        """
+        size = X.__len__()
+        instrumentation = self.__instrumentation__
+        cache = self.__rowCache__
+        position = dict()
+        keys = []
+        missing = []
+        # the first row of each missing unique row
+        missingRows = []
+        inverse = np.empty(size, dtype=int)
+        for start in range(0, size, self.HASH_CHUNK_SIZE):
+            rows = np.asarray(X[start:start + self.HASH_CHUNK_SIZE], dtype=float)
+            for j, row in enumerate(rows):
+                key = row.tobytes()
+                if key not in position :
+                    position[key] = len(keys)
+                    if key not in cache :
+                        missing.append(len(keys))
+                        missingRows.append(start + j)
+                    keys.append(key)
+                inverse[start + j] = position[key]
+        nUnique = len(keys)
+        instrumentation.addDuplicates(size - nUnique)
+        if self.__deduplication__['cache_size'] > 0 :
+            instrumentation.addCacheHits(hits=nUnique - len(missing),
+                                         misses=len(missing))
+        if len(missing) == size :
+            # all the rows are distinct and new
+            result, mask = self._exec_sample_rows(X)
+            if self.__deduplication__['cache_size'] > 0 :
+                self._storeRows(keys, result, mask)
+            return result, mask
+        uniqueMask = np.zeros(nUnique, dtype=bool)
+        parts = []
+        if len(missing) > 0 :
+            result, mask = self._exec_sample_rows(self._selectRows(X, np.array(missingRows)))
+            parts.append(self._storeRows([keys[u] for u in missing], result, mask))
+            uniqueMask[missing] = mask
+        missingSet = set(missing)
+        cached = [u for u in range(nUnique) if u not in missingSet]
+        for u in cached :
+            parts.append(cache[keys[u]])
+            cache.move_to_end(keys[u])
+        # the parts hold the evaluated unique rows first, then the cached ones
+        position = np.empty(nUnique, dtype=int)
+        position[missing + cached] = np.arange(nUnique)
+        rows = position[inverse]
+        result = []
+        for i, structure in enumerate(self.__outputStructure__):
+            if isinstance(parts[0][i], CompressedProcessSample):
+                element = takeRows(CompressedProcessSample.concatenate(
+                                        [part[i] for part in parts]), rows)
+            else :
+                element = outputLike(structure, np.concatenate([part[i] for part in parts])[rows])
+            result.append(element)
+        return result, uniqueMask[inverse]
+
+    def _selectRows(self, X, rows):
+        """Returns the rows of X, in increasing order, as an ot.Sample built
+        chunk by chunk
+        """
+        selected = None
+        bounds = np.searchsorted(rows, np.arange(0, X.__len__(), self.HASH_CHUNK_SIZE))
+        for start, low, high in zip(range(0, X.__len__(), self.HASH_CHUNK_SIZE),
+                                    bounds, list(bounds[1:]) + [len(rows)]):
+            if low == high :
+                continue
+            chunk = X[start:start + self.HASH_CHUNK_SIZE]
+            local = (rows[low:high] - start).tolist()
+            if isinstance(chunk, ot.Sample):
+                chunk = chunk.select(local)
+            else :
+                chunk = ot.Sample(np.asarray(chunk, dtype=float)[local])
+            if selected is None :
+                selected = chunk
+            else :
+                selected.add(chunk)
+        return selected
+
+    def _storeRows(self, keys, result, mask):
+        """Keeps the structure of the outputs, and adds the outputs of the
+        rows that did not fail to the row cache, removing the oldest rows
+        above its size.
+
+        Returns
+        -------
+        arrays : list
+            the outputs as arrays, one per output, the compressed outputs
+            being kept as CompressedProcessSample. The cache holds the rows
+            in the same form.
+        """
+        self.__outputStructure__ = getOutputStructure(result)
+        arrays = [element if isinstance(element, CompressedProcessSample) else np.array(element)
+                  for element in result]
+        cacheSize = self.__deduplication__['cache_size']
+        if cacheSize == 0 :
+            return arrays
+        cache = self.__rowCache__
+        for j, key in enumerate(keys):
+            if not mask[j] :
+                cache[key] = [array[j:j+1] for array in arrays]
+                cache.move_to_end(key)
+        while len(cache) > cacheSize :
+            cache.popitem(last=False)
+        return arrays
+
+    def _exec_sample_chunked(self, X, chunkSize=None):
+        """Evaluates the batch function chunk by chunk, of the chunk size of
+        the wrapper if none is passed. If a checkpoint is set, each finished
+        chunk is saved on disk and the chunks that were already evaluated for
+        the same design are loaded instead. With a memory budget as well, the
+        chunks of the checkpoint have to fit in the budget.
+        """
+        checkpoint = self.__checkpoint__
+        budget = self.__memoryBudget__ if checkpoint is not None else None
+        if budget is not None and budget['bytes_per_row'] is not None :
+            self._checkBudgetChunkSize(checkpoint.getChunkSize(), budget['bytes_per_row'])
+        bounds = self._getChunkBounds(X, chunkSize or self.__chunkSize__)
+        outputs = []
+        masks = []
+        for idx, (start, stop) in enumerate(bounds):
+            if checkpoint is not None and checkpoint.hasChunk(idx):
+                output, mask = checkpoint.loadChunkData(idx)
+                masks.append(mask)
+                outputs.append(self._compressOutputs(output, mask))
+                self.__instrumentation__.addCacheHits(hits=stop-start)
+            else :
+                before = self.__instrumentation__.getStatistics()
+                output, mask = self._evaluateRows(X[start:stop], start)
+                if checkpoint is not None :
+                    checkpoint.saveChunk(idx, output, mask)
+                    self.__instrumentation__.addCacheHits(misses=stop-start)
+                if budget is not None :
+                    # measured on the chunk, which is saved before failing
+                    budget['bytes_per_row'] = self._measureBytesPerRow(
+                            before, self.__instrumentation__.getStatistics(), stop - start)
+                    self._checkBudgetChunkSize(stop - start, budget['bytes_per_row'])
+                outputs.append(self._compressOutputs(output, mask))
+                masks.append(mask)
+        return concatenateOutputs(outputs), np.concatenate(masks)
+
+    def _exec_sample_budgeted(self, X):
+        """Evaluates the batch function chunk by chunk, with chunks as large
+        as the memory budget allows. The bytes per row of the lifted inputs
+        and of the outputs are measured on a first probe chunk. In adaptive
+        mode they are measured again on each chunk, and the chunk size grows
+        from the probe size towards the best measured throughput.
+        """
+        budget = self.__memoryBudget__
+        size = X.__len__()
+        chunkSize = min(budget['probe_size'], size)
+        self.__lastChunkSizes__ = list()
+        outputs = []
+        masks = []
+        throughputs = dict()
+        start = 0
+        while start < size :
+            stop = min(start + chunkSize, size)
+            before = self.__instrumentation__.getStatistics()
+            tic = time.perf_counter()
+            output, mask = self._evaluateRows(X[start:stop], start)
+            elapsed = time.perf_counter() - tic
+            after = self.__instrumentation__.getStatistics()
+            outputs.append(self._compressOutputs(output, mask))
+            masks.append(mask)
+            self.__lastChunkSizes__.append(stop - start)
+            rows = stop - start
+            if len(outputs) == 1 or budget['adaptive'] :
+                bytesPerRow = self._measureBytesPerRow(before, after, rows)
+                budget['bytes_per_row'] = bytesPerRow
+                maxSize = self._getBudgetChunkSize(bytesPerRow)
+                if budget['adaptive'] :
+                    # the last measure of each size is kept, to follow changes
+                    throughputs[rows] = rows / elapsed if elapsed > 0 else np.inf
+                    chunkSize = self._getAdaptiveChunkSize(rows, throughputs, maxSize)
+                else :
+                    chunkSize = maxSize
+                self._log('Measured {:.4g} bytes per row, next chunk of {} rows'.format(
+                                                            bytesPerRow, chunkSize))
+            start = stop
+        if len(outputs) == 1 :
+            return outputs[0], masks[0]
+        return concatenateOutputs(outputs), np.concatenate(masks)
+
+    def _measureBytesPerRow(self, before, after, rows):
+        """Returns the bytes per row of a chunk, from the statistics of the
+        instrumentation before and after its evaluation
+        """
+        return (after['bytes_lifted'] - before['bytes_lifted'] + \
+                after['bytes_output'] - before['bytes_output']) / rows
+
+    def _checkBudgetChunkSize(self, chunkSize, bytesPerRow):
+        """Checks that the chunks of the checkpoint fit in the memory budget.
+        Their size can not follow the budget, as it identifies the chunks
+        saved on disk.
+        """
+        maxSize = self._getBudgetChunkSize(bytesPerRow)
+        assert chunkSize <= maxSize, \
+            "Chunks of {} rows take {:.4g} bytes, above the memory budget of {} bytes. "\
+            "Set the checkpoint with a chunk size of at most {}".format(chunkSize,
+                    chunkSize * bytesPerRow, self.__memoryBudget__['budget'], maxSize)
+
+    def _getBudgetChunkSize(self, bytesPerRow):
+        """Returns the largest number of rows fitting in the memory budget
+        """
+        if bytesPerRow <= 0 :
+            return self.__memoryBudget__['max_chunk_size']
+        return int(max(1, min(self.__memoryBudget__['budget'] // bytesPerRow,
+                              self.__memoryBudget__['max_chunk_size'])))
+
+    def _getAdaptiveChunkSize(self, rows, throughputs, maxSize):
+        """Doubles the chunk size as long as the throughput increases, and
+        goes back to the best measured size once it stops increasing.
+        """
+        best = max(throughputs, key=throughputs.get)
+        if best == rows :
+            return min(2 * rows, maxSize)
+        return min(best, maxSize)
+
+    def _exec_sample_parallel(self, X):
+        """Evaluates the batch function on the chunks of X in parallel, and
+        puts the outputs back in the order of the rows.
+        """
+        outputs = dict()
+        masks = dict()
+        for start, stop, output, mask in self.iterateChunks(X):
+            outputs[start] = self._compressOutputs(output, mask)
+            masks[start] = mask
+        starts = sorted(outputs)
+        return concatenateOutputs([outputs[start] for start in starts]), \
+               np.concatenate([masks[start] for start in starts])
+
+    def _getChunkBounds(self, X, chunkSize):
+        """Returns the (start, stop) rows of the chunks of X, those of the
+        checkpoint if one is set.
+        """
+        checkpoint = self.__checkpoint__
+        if checkpoint is not None :
+            checkpoint.model_tag = self.getModelTag()
+            bounds = checkpoint.open(X)
+            self._log('Resuming from {} of {} chunks'.format(
+                len(checkpoint.getCompletedChunks()), len(bounds)))
+            return bounds
+        size = X.__len__()
+        return [(start, min(start + chunkSize, size))
+                                for start in range(0, size, chunkSize)]
+
+    def iterateChunks(self, X):
+        """Evaluates the batch function on the chunks of X with the parallel
+        executor, yielding the outputs of each chunk as soon as it is
+        finished, while the slower chunks are still running.
+
+        The chunks that raise or time out are handled with the failure
+        policy : the failing rows of a chunk that raised are isolated in the
+        main process, and a chunk that timed out is filled with the fill value
+        and masked as a whole. Without a failure policy, the error is raised.
+
+        Arguments
+        ---------
+        X : ot.Sample
+            the coefficients of the design
+
+        Yields
+        ------
+        start, stop : int
+            rows of the chunk in X
+        output : list
+            list of ot.Sample and ot.ProcessSample of the chunk
+        mask : numpy.ndarray of bool
+            True for the rows of the chunk that failed
+        """
+        assert self.__executor__ is not None, \
+            "Set a parallel executor first with setParallelExecutor"
+        executor = self.__executor__
+        checkpoint = self.__checkpoint__
+        instrumentation = self.__instrumentation__
+        bounds = self._getChunkBounds(X, executor.getChunkSize())
+        todo = []
+        template = None
+        for idx, (start, stop) in enumerate(bounds):
+            if checkpoint is not None and checkpoint.hasChunk(idx):
+                instrumentation.addCacheHits(hits=stop-start)
+                template, mask = checkpoint.loadChunkData(idx)
+                yield start, stop, template, mask
+            else :
+                todo.append(idx)
+
+        def getArguments(task):
+            start, stop = bounds[todo[task]]
+            with instrumentation.timeStage('lifting'):
+                if self.__useNumpy__ :
+                    inputs = self.__AKLR__.liftAsArrays(X[start:stop])
+                else :
+                    inputs = self.__AKLR__.liftAsProcessSample(X[start:stop])
+            instrumentation.addBytes('lifted', inputs)
+            return self.func_sample, inputs, self.__useNumpy__
+
+        timedOut = []
+        for task, result in executor.iterate(callBatchFunction, len(todo), getArguments):
+            idx = todo[task]
+            start, stop = bounds[idx]
+            if isinstance(result, TimeoutError) and self.__failurePolicy__ is not None :
+                self._log('Chunk {} timed out'.format(idx))
+                self.__failures__.append((start, repr(result)))
+                if template is None and self.__outputSchema__ is None :
+                    # filled once the structure of the outputs is known
+                    timedOut.append(idx)
+                    continue
+                output, mask = self._fillTimedOut(template, stop - start)
+            elif isinstance(result, Exception):
+                if self.__failurePolicy__ is None :
+                    raise result
+                output, mask = self._evaluateRows(X[start:stop], start)
+            else :
+                with instrumentation.timeStage('conversion'):
+                    output = self._convertBatchResult(result)
+                instrumentation.addBytes('output', output)
+                mask = np.zeros(stop - start, dtype=bool)
+            if checkpoint is not None :
+                checkpoint.saveChunk(idx, output, mask)
+                instrumentation.addCacheHits(misses=stop-start)
+            template = output
+            yield start, stop, output, mask
+            # the timed out chunks waiting for the structure of the outputs
+            for waiting in timedOut :
+                start, stop = bounds[waiting]
+                output, mask = self._fillTimedOut(template, stop - start)
+                if checkpoint is not None :
+                    checkpoint.saveChunk(waiting, output, mask)
+                yield start, stop, output, mask
+            timedOut = []
+        if len(timedOut) > 0 :
+            raise TimeoutError(
+                'All the chunks timed out, no output to build the fill values from. '\
+                'Declare an output schema or increase the timeout.')
+
+    def _compressOutputs(self, outputs, mask=None):
+        """Replaces the field outputs by their compressed version if the
+        output compression is set. The compressor of each output is kept
+        between the chunks and the calls, and refines its basis on each of
+        them.
+        """
+        settings = self.__outputCompression__
+        if settings is None :
+            return outputs
+        compressed = []
+        for i, element in enumerate(outputs):
+            if isinstance(element, ot.ProcessSample):
+                if i not in settings['compressors'] :
+                    settings['compressors'][i] = FieldOutputCompressor(
+                                        settings['tolerance'], settings['max_modes'])
+                with self.__instrumentation__.timeStage('conversion'):
+                    element = settings['compressors'][i].compress(element, mask)
+            compressed.append(element)
+        return compressed
+
+    def _fillTimedOut(self, template, size):
+        """Returns the filled outputs and the mask of a chunk that timed out
+        """
+        self.__instrumentation__.addFailures(size)
+        return self._fillOutputs(template, size, self.__failurePolicy__['fill_value']), \
+               np.ones(size, dtype=bool)
+
+    def _evaluateRows(self, X, offset=0):
+        """Evaluates a chunk of rows. If a failure policy is set, the rows
+        making the batch function fail are isolated by bisection, retried,
+        and finally replaced by the fill value.
+
+        Returns
+        -------
+        result : list of ot.Sample and ot.ProcessSample
+        mask : numpy.ndarray of bool
+            True for the rows that failed
+        """
+        size = X.__len__()
+        if self.__failurePolicy__ is None :
+            return self._evaluateChunk(X), np.zeros(size, dtype=bool)
+        pieces = self._bisectFailures(X, offset)
+        mask = np.concatenate([np.full(n, output is None) for output, n in pieces])
+        if mask.any():
+            self.__instrumentation__.addFailures(int(mask.sum()))
+            template = [output for output, n in pieces if output is not None]
+            if len(template) == 0 and self.__outputSchema__ is None :
+                raise RuntimeError(
+                    'All the rows {} to {} failed, no output to build the fill values from. '\
+                    'Declare an output schema or check the failures.'.format(offset, offset+size-1))
+            template = template[0] if len(template) > 0 else None
+            fillValue = self.__failurePolicy__['fill_value']
+            pieces = [(output if output is not None else
+                       self._fillOutputs(template, n, fillValue), n) for output, n in pieces]
+        if len(pieces) == 1 :
+            return pieces[0][0], mask
+        return concatenateOutputs([output for output, n in pieces]), mask
+
+    def _bisectFailures(self, X, offset):
+        """Evaluates the rows of X, splitting them in two halves each time
+        the batch function fails, down to single rows which are retried.
+
+        Returns
+        -------
+        pieces : list of tuples
+            (output or None if failed, number of rows), in the order of X
+        """
+        size = X.__len__()
         try :
-            result = self.func_sample(inputProcessSamples)
-        except :
+            return [(self._evaluateChunk(X), size)]
+        except Exception as e :
+            error = e
+        if size > 1 :
+            half = size // 2
+            return self._bisectFailures(X[:half], offset) + \
+                   self._bisectFailures(X[half:], offset + half)
+        for attempt in range(self.__failurePolicy__['max_retries']):
+            time.sleep(self.__failurePolicy__['retry_delay'])
             try :
-                result = self.func_sample(*inputProcessSamples)
-            except TypeError as te:
-                print('did not manage to evaluate batch function')
-                raise te
-        self.__output_backup__ = deepcopy(results)
-        # If the rest fails you can still get the data
-        result = CustomList.atLeastList(result)
-        result = self._convert_exec_sample_ot(result)
-        self.__calls__ += X.__len__()
+                return [(self._evaluateChunk(X), 1)]
+            except Exception as e :
+                error = e
+        self._log('Row {} failed : {}'.format(offset, repr(error)))
+        self.__failures__.append((offset, repr(error)))
+        return [(None, 1)]
+
+    def _fillOutputs(self, template, size, value):
+        """Returns outputs of size rows filled with value, with the structure
+        of the template outputs, or else of the declared output schema.
+        """
+        if template is not None :
+            return fillOutputs(template, size, value)
+        result = []
+        for spec in self.__outputSchema__ :
+            if spec['kind'] == 'scalar' :
+                result.append(np.full((size, spec['dimension']), value))
+            else :
+                result.append(np.full((size, spec['mesh'].getVerticesNumber(),
+                                       spec['dimension']), value))
+        return self._convert_exec_sample_schema(result)
+
+    def _evaluateChunk(self, X):
+        """Lifts a sample of coefficients, evaluates the batch function on it
+        and converts its outputs.
+        """
+        instrumentation = self.__instrumentation__
+        with instrumentation.timeStage('lifting'):
+            if self.__useNumpy__ :
+                inputs = self.__AKLR__.liftAsArrays(X)
+            else :
+                inputs = self.__AKLR__.liftAsProcessSample(X)
+        instrumentation.addBytes('lifted', inputs)
+        with instrumentation.timeStage('execution'):
+            result = self._callBatchFunction(inputs)
+        with instrumentation.timeStage('conversion'):
+            result = self._convertBatchResult(result)
+        instrumentation.addBytes('output', result)
         return result
 
+    def _callBatchFunction(self, inputs):
+        """Calls the batch function on the lifted inputs
+        """
+        return callBatchFunction(self.func_sample, inputs, self.__useNumpy__)
+
+    def _convertBatchResult(self, result):
+        """Converts the raw result of the batch function into a list of
+        Samples and ProcessSamples.
+        """
+        if self.__useNumpy__ :
+            return self._convertArrayResult(result)
+        # If the rest fails you can still get the data. Only a reference, a
+        # copy would double the memory of the outputs of each chunk
+        self.__output_backup__ = result
+        if isinstance(result, np.ndarray):
+            # a single output, whose first dimension is the size of the sample
+            result = [result]
+        else :
+            result = CustomList.atLeastList(result)
+        if self.__outputSchema__ is not None :
+            return self._convert_exec_sample_schema(result)
+        else :
+            return self._convert_exec_sample_ot(result)
+
+    def _convertArrayResult(self, result):
+        """Converts a numpy array, a list of numpy arrays, or a dictionary of
+        numpy arrays by output name, into a list of Samples and ProcessSamples.
+        """
+        self.__output_backup__ = result
+        if isinstance(result, dict):
+            assert self.__outputSchema__ is not None, \
+                "Declare an output schema to return the outputs by name"
+            result = [result[spec['name']] for spec in self.__outputSchema__]
+        elif isinstance(result, np.ndarray):
+            result = [result]
+        else :
+            result = list(result)
+        if self.__outputSchema__ is not None :
+            return self._convert_exec_sample_schema(result)
+        else :
+            return self._convert_exec_sample_ot(result)
+
+    async def callAsync(self, X):
+        """Asynchronous batch evaluation with the external simulator set with
+        setExternalSimulator. The coefficients are lifted as numpy arrays,
+        the simulator is launched once per row in its own work directory,
+        and its outputs are assembled into the usual Samples and
+        ProcessSamples.
+
+        Arguments
+        ---------
+        X : ot.Sample
+            sample of coefficients
+
+        Returns
+        -------
+        result : list of ot.Sample and ot.ProcessSample
+
+        Example
+        -------
+        >>> result = asyncio.run(wrapper.callAsync(X))
+        """
+        assert self.__simulator__ is not None, "Set the external simulator first"
+        assert len(X[0])==self.getInputDimension()
+        instrumentation = self.__instrumentation__
+        instrumentation.startCall()
+        size = X.__len__()
+        with instrumentation.timeStage('lifting'):
+            inputArrays = self.__AKLR__.liftAsArrays(X)
+        instrumentation.addBytes('lifted', inputArrays)
+        self.__failures__ = list()
+        with instrumentation.timeStage('execution'):
+            if self.__failurePolicy__ is None :
+                rows = await self.__simulator__.evaluate(inputArrays, size)
+            else :
+                rows = await self._evaluateAsyncWithRetries(inputArrays, size)
+        mask = np.array([isinstance(row, BaseException) for row in rows], dtype=bool)
+        if mask.all():
+            raise rows[0]
+        with instrumentation.timeStage('conversion'):
+            template = rows[int(np.argmin(mask))]
+            fillValue = self.__failurePolicy__['fill_value'] if mask.any() else None
+            result = [np.stack([np.asarray(row[k], dtype=float) if not failed else
+                                np.full(np.shape(template[k]), fillValue)
+                                for row, failed in zip(rows, mask)])
+                                                for k in range(len(template))]
+            result = self._convertArrayResult(result)
+        if mask.any():
+            instrumentation.addFailures(int(mask.sum()))
+        self.__failureMask__ = mask
+        instrumentation.addBytes('output', result)
+        self.__calls__ += size
+        instrumentation.stopCall(size)
+        return result
+
+    async def _evaluateAsyncWithRetries(self, inputArrays, size):
+        """Runs the external simulator on all the rows, then retries the
+        failed rows as many times as the failure policy allows.
+
+        Returns
+        -------
+        rows : list
+            outputs of each row, or the exception of its last attempt
+        """
+        rows = await self.__simulator__.evaluate(inputArrays, size,
+                                                 return_exceptions=True)
+        for attempt in range(self.__failurePolicy__['max_retries']):
+            failed = [j for j in range(size) if isinstance(rows[j], BaseException)]
+            if len(failed) == 0 :
+                break
+            await asyncio.sleep(self.__failurePolicy__['retry_delay'])
+            # through evaluate, so that the retries keep the concurrency limit
+            retried = await self.__simulator__.evaluate(inputArrays, size,
+                                                        return_exceptions=True, rows=failed)
+            for j, row in zip(failed, retried):
+                rows[j] = row
+        for j in range(size):
+            if isinstance(rows[j], BaseException):
+                self._log('Row {} failed : {}'.format(j, repr(rows[j])))
+                self.__failures__.append((j, repr(rows[j])))
+        return rows
+
+    def _log(self, *args):
+        """Prints the diagnostic messages, only if the wrapper is verbose
+        """
+        if self.__verbose__ :
+            print(*args)
 
     def _convert_exec_ot(self, output):
         """Converts the output of the function passed to the class into
@@ -121,7 +856,7 @@ class KarhunenLoeveGeneralizedFunctionWrapper(object):
         ----
         If the checks fail, the output can still be found under self.__output_backup__
         """
-        print(
+        self._log(
 '''Using the single evaluation function. Assumes that the outputs are in the
 same order than for the batch evaluation function. This one should only
 return Points, Fields, Lists or numpy arrays.''')
@@ -129,14 +864,14 @@ return Points, Fields, Lists or numpy arrays.''')
         if len(output) != len(self._outputDescription) :
             self.__nOutputs__ = len(output)
             self.setOutputDescription(ot.Description.BuildDefault(self.__nOutputs__, 'Y_'))
-            print("shapes mismatched")
+            self._log("shapes mismatched")
         for i, element in enumerate(output) :
             if isinstance(element, (ot.Point, ot.Field)):
                 element.setName(self._outputDescription[i])
                 outputList.append(element)
                 try : dim = element.getDimension()
                 except : dim = element.getMesh().getDimension()
-                print(
+                self._log(
 'Element {} of the output tuple returns elements of type {} of dimension {}'.format(
                       i, element.__class__.__name__ ,dim))
             elif isinstance(element, (Sequence, Iterable)):
@@ -147,7 +882,7 @@ return Points, Fields, Lists or numpy arrays.''')
                 if isinstance(dtype(), (Complex, Integral, Real, Rational, Number, str)):
                     intermElem.recurse2list()
                     if len(shape) >= 2 :
-                        print(
+                        self._log(
 'Element {} of the output tuple returns fields of dimension {}'.format(i,len(shape)))
                         intermElem.flatten()
                         element = ot.Field(self._buildMesh(self._getGridShape(shape)),
@@ -155,7 +890,7 @@ return Points, Fields, Lists or numpy arrays.''')
                         element.setName(self._outputDescription[i])
                         outputList.append(element)
                     if len(shape) == 1 :
-                        print(
+                        self._log(
 'Element {} of the output tuple returns points of dimension {}'.format(i,shape[0]))
                         intermElem.recurse2list()
                         intermElem.flatten()
@@ -166,7 +901,7 @@ return Points, Fields, Lists or numpy arrays.''')
                     print('Do not use non-numerical dtypes in your objects')
                     print('Wrong dtype is: ',dtype.__name__)
             elif isinstance(element, (Complex, Integral, Real, Rational, Number, str)):
-                print(
+                self._log(
 'Element {} of the output tuple returns unique {}'.format(i,type(element).__name__))
                 outputList.append(element)
             elif isinstance(element, (ot.Sample, ot.ProcessSample)):
@@ -187,7 +922,7 @@ return Points, Fields, Lists or numpy arrays.''')
         ----
         If the checks fail, the output can still be found under self.__output_backup__
         """
-        print(
+        self._log(
 '''Using the batch evaluation function. Assumes that the outputs are in the
 same order than for the single evaluation function. This one should only
 return ProcessSamples, Samples, Lists or numpy arrays.''')
@@ -199,23 +934,29 @@ return ProcessSamples, Samples, Lists or numpy arrays.''')
             if isinstance(element, (ot.Sample, ot.ProcessSample)):
                 element.setName(self._outputDescription[i])
                 outputList.append(element)
-                print(
+                self._log(
 'Element {} of the output tuple returns elements of type {} of dimension {}'.format(
                       i, element.__class__.__name__ ,element.getDimension()))
+            elif isinstance(element, np.ndarray) and element.dtype.kind in 'biuf':
+                self._log(
+'Element {} of the output tuple is a numpy array of shape {}'.format(i, element.shape))
+                element = self._convertArray2Sample(element)
+                element.setName(self._outputDescription[i])
+                outputList.append(element)
             elif isinstance(element, (Sequence, Iterable)):
-                print(
+                self._log(
 'Element is iterable, assumes that first dimension is size of sample')
                 intermElem = CustomList(element)
                 intermElem.recurse2list()
                 shape = intermElem.shape
                 dtype = intermElem.dtype
-                print('Shape is {} and dtype is {}'.format(shape,dtype))
+                self._log('Shape is {} and dtype is {}'.format(shape,dtype))
                 sampleSize = shape[0]
                 subSample = [CustomList(intermElem[j]) for j in range(sampleSize)]
                 assert dtype is not None, 'If None the list is not homogenous'
                 if isinstance(dtype(), (Complex, Integral, Real, Rational, Number, str)):
                     if len(shape) >= 2 :
-                        print(
+                        self._log(
 'Element {} of the output tuple returns process samples of dimension {}'.format(i,len(shape)-1))
                         mesh = self._buildMesh(self._getGridShape(shape[1:]))
                         subSample = [subSample[j].flatten() for j in range(sampleSize)]
@@ -225,7 +966,7 @@ return ProcessSamples, Samples, Lists or numpy arrays.''')
                         procsample.setName(self._outputDescription[i])
                         outputList.append(procsample)
                     elif len(shape) == 1 :
-                        print(
+                        self._log(
 'Element {} of the output tuple returns samples of dimension {}'.format(i,1))
                         element = ot.Sample([[dat] for dat in intermElem.data])
                         element.setName(self._outputDescription[i])
@@ -234,7 +975,7 @@ return ProcessSamples, Samples, Lists or numpy arrays.''')
                     print('Do not use non-numerical dtypes in your objects')
                     print('Wrong dtype is: ',dtype.__name__)
             elif isinstance(element, ot.Point):
-                print(
+                self._log(
 'Element {} of the output tuple returns samples of dimension 1'.format(i,type(element).__name__))
                 element = ot.Sample([[element[j]] for j in range(len(element))])
                 element.setName(self._outputDescription[i])
@@ -249,6 +990,87 @@ return ProcessSamples, Samples, Lists or numpy arrays.''')
                 raise NotImplementedError
         return outputList
 
+    def _convert_exec_schema(self, output):
+        """Converts the output of the single evaluation function using the
+        declared output schema, without any shape or type inference.
+        """
+        assert len(output) == len(self.__outputSchema__), \
+            "The function returned {} outputs, the schema declares {}".format(
+                len(output), len(self.__outputSchema__))
+        outputList = []
+        for spec, element in zip(self.__outputSchema__, output):
+            if not isinstance(element, (ot.Point, ot.Field)):
+                values = np.asarray(element, dtype=float)
+                if spec['kind'] == 'scalar' :
+                    element = ot.Point(values.reshape(spec['dimension']))
+                else :
+                    element = ot.Field(spec['mesh'],
+                        values.reshape(spec['mesh'].getVerticesNumber(), spec['dimension']))
+            element.setName(spec['name'])
+            outputList.append(element)
+        return outputList
+
+    def _convert_exec_sample_schema(self, output):
+        """Converts the output of the batch function using the declared
+        output schema, without any shape or type inference. The values are
+        written directly in containers of the declared size, on the meshes
+        built once in setOutputSchema.
+        """
+        assert len(output) == len(self.__outputSchema__), \
+            "The function returned {} outputs, the schema declares {}".format(
+                len(output), len(self.__outputSchema__))
+        outputList = []
+        for spec, element in zip(self.__outputSchema__, output):
+            if not isinstance(element, (ot.Sample, ot.ProcessSample)):
+                values = np.atleast_1d(np.asarray(element, dtype=float))
+                rowSize = spec['dimension'] * (spec['mesh'].getVerticesNumber()
+                                               if spec['kind'] == 'field' else 1)
+                assert values.size == len(values) * rowSize, \
+                    "Output {} has {} values per row, the schema declares {}".format(
+                        spec['name'], values[0].size, rowSize)
+                if spec['kind'] == 'scalar' :
+                    element = ot.Sample(values.reshape(values.shape[0], spec['dimension']))
+                else :
+                    element = self._convertArray2Sample(values, spec['mesh'],
+                                                        spec['dimension'])
+            element.setName(spec['name'])
+            outputList.append(element)
+        return outputList
+
+    def _convertArray2Sample(self, array, mesh=None, dimension=1):
+        """Converts in bulk a numerical numpy array, whose first dimension is
+        the size of the sample, into a Sample or a ProcessSample.
+
+        Arguments
+        ---------
+        array : numpy.ndarray
+            of shape (n,) or (n, 1) for scalar outputs, or (n, *grid_shape)
+            for fields defined on a regular grid
+        mesh : ot.Mesh
+            mesh of the fields, if None a regular grid is built from the shape
+        dimension : int
+            dimension of the values of the fields
+
+        Returns
+        -------
+        sample : ot.Sample or ot.ProcessSample
+        """
+        sampleSize = array.shape[0]
+        if mesh is None and array.shape[1:] in ((), (1,)):
+            return ot.Sample(np.asarray(array, dtype=float).reshape(sampleSize, 1))
+        if mesh is None :
+            mesh = self._getMesh(array.shape[1:])
+        # the grid is flattened in the same order than CustomList.flatten
+        return processSampleFromArray(mesh, array, dimension)
+
+    def _getMesh(self, shape):
+        """Returns the regular grid mesh of the passed shape, built only once
+        """
+        shape = tuple(int(n) for n in shape)
+        if shape not in self.__meshCache__ :
+            self.__meshCache__[shape] = self._buildMesh(self._getGridShape(shape))
+        return self.__meshCache__[shape]
+
     def _getGridShape(self, shape=()):
         """Builds a regular grid of unit size, based on the passed shape tuple,
 
@@ -310,6 +1132,27 @@ return ProcessSamples, Samples, Lists or numpy arrays.''')
         """
         return self.__class__.__name__
 
+    def getCheckpoint(self):
+        """Returns the checkpoint used for the batch evaluations
+
+        Returns
+        -------
+        checkpoint : EvaluationCheckpoint or None
+        """
+        return self.__checkpoint__
+
+    def getChunkSize(self):
+        """Returns the number of rows evaluated at once by the batch function
+
+        Returns
+        -------
+        chunkSize : int or None
+            None if the whole sample is passed at once
+        """
+        if self.__chunkSize__ is None and self.__checkpoint__ is not None :
+            return self.__checkpoint__.getChunkSize()
+        return self.__chunkSize__
+
     def getId(self):
         """Returns the Id of the object
         """
@@ -345,6 +1188,24 @@ return ProcessSamples, Samples, Lists or numpy arrays.''')
         print('custom implementation')
         return None
 
+    def getModelTag(self):
+        """Returns the identity of the model, part of the keys under which the
+        checkpoint and the work queue store the evaluated chunks : the tag set
+        with setModelTag, or else the module and qualified name of the batch
+        function (of the single evaluation function without one) followed by
+        the name of the wrapper.
+
+        Returns
+        -------
+        tag : str
+        """
+        if self.__modelTag__ is not None :
+            return self.__modelTag__
+        function = self.func_sample if self.func_sample is not None else self.func
+        return '{}.{}:{}'.format(getattr(function, '__module__', None),
+                                 getattr(function, '__qualname__', function.__class__.__name__),
+                                 self.__name__)
+
     def getName(self):
         """Returns the name of the object
         """
@@ -377,6 +1238,129 @@ return ProcessSamples, Samples, Lists or numpy arrays.''')
         """
         return self.__nOutputs__
 
+    def getDeduplication(self):
+        """Returns the settings of the elimination of the duplicated rows
+
+        Returns
+        -------
+        deduplication : dict or None
+            cache_size : number of rows kept from a call to the next
+        """
+        return self.__deduplication__
+
+    def getSurrogate(self):
+        """Returns the settings of the surrogate, or None
+
+        Returns
+        -------
+        surrogate : dict or None
+            predict, variance, score, threshold and tolerance
+        """
+        return self.__surrogate__
+
+    def isSurrogateActive(self):
+        """Checks if the batch evaluations are routed to the surrogate, that
+        is if its validation score reaches the quality threshold.
+        """
+        surrogate = self.__surrogate__
+        return surrogate is not None and surrogate['score'] >= surrogate['threshold']
+
+    def getWorkQueue(self):
+        """Returns the file work queue of the batch evaluations, or None
+        """
+        if self.__workQueue__ is None :
+            return None
+        return self.__workQueue__['queue']
+
+    def getExternalSimulator(self):
+        """Returns the external simulator used by callAsync
+
+        Returns
+        -------
+        simulator : ExternalSimulator or None
+        """
+        return self.__simulator__
+
+    def getParallelExecutor(self):
+        """Returns the parallel executor of the batch evaluations
+        """
+        return self.__executor__
+
+    def getFailureMask(self):
+        """Returns the mask of the rows that failed during the last batch
+        evaluation, and whose outputs were replaced by the fill value.
+
+        Returns
+        -------
+        mask : numpy.ndarray of bool or None
+        """
+        return self.__failureMask__
+
+    def getFailures(self):
+        """Returns the failures of the last batch evaluation
+
+        Returns
+        -------
+        failures : list of tuples
+            (index of the row, representation of the last exception raised)
+        """
+        return self.__failures__
+
+    def getInstrumentation(self):
+        """Returns the timers and counters of the evaluations
+
+        Returns
+        -------
+        instrumentation : EvaluationInstrumentation
+        """
+        return self.__instrumentation__
+
+    def getUseNumpyConvention(self):
+        """Returns if the batch function is called with numpy arrays
+
+        Returns
+        -------
+        useNumpy : bool
+        """
+        return self.__useNumpy__
+
+    def getLastChunkSizes(self):
+        """Returns the sizes of the chunks of the last batch evaluation done
+        with a memory budget
+        """
+        return self.__lastChunkSizes__
+
+    def getMemoryBudget(self):
+        """Returns the memory budget of the batch evaluations
+
+        Returns
+        -------
+        budget : dict or None
+            budget (bytes), adaptive, probe_size, max_chunk_size and
+            bytes_per_row, the last measure or None
+        """
+        return self.__memoryBudget__
+
+    def getOutputCompression(self):
+        """Returns the settings of the output compression
+
+        Returns
+        -------
+        compression : dict or None
+            tolerance, max_modes, and compressors (index of the output ->
+            FieldOutputCompressor)
+        """
+        return self.__outputCompression__
+
+    def getOutputSchema(self):
+        """Returns the declared output schema
+
+        Returns
+        -------
+        schema : list of dict or None
+        """
+        return self.__outputSchema__
+
     def getOutputDimension(self):
         """Returns the dimension of each output
 
@@ -386,6 +1370,91 @@ return ProcessSamples, Samples, Lists or numpy arrays.''')
         """
         return self.outputDim
 
+    def getSnapshot(self, directory=None):
+        """Returns a copy of the wrapper where the aggregation is replaced by
+        a KarhunenLoeveSnapshot, which is much lighter to pickle and to rebuild
+        in worker processes than the openturns Karhunen-Loeve results.
+
+        The functions, the output schema and the conversion, chunking,
+        failure and deduplication settings are kept. The parallel executor,
+        the work queue, the external simulator, the surrogate and the
+        checkpoint are not, as they belong to the process driving the study.
+
+        Arguments
+        ---------
+        directory : str, optional
+            if given, the snapshot is saved in this directory, and the wrapper
+            then pickles with the path of the snapshot only : the workers load
+            the modes memory-mapped from the directory.
+
+        Returns
+        -------
+        wrapper : KarhunenLoeveGeneralizedFunctionWrapper
+        """
+        assert self.__AKLR__ is not None, "The wrapper has no aggregation"
+        snapshot = self.__AKLR__
+        if not isinstance(snapshot, KarhunenLoeveSnapshot):
+            snapshot = KarhunenLoeveSnapshot(self.__AKLR__)
+        if directory is not None :
+            snapshot.save(directory)
+        wrapper = KarhunenLoeveGeneralizedFunctionWrapper(snapshot, self.func,
+                                            self.func_sample, self.__nOutputs__)
+        wrapper.setName(self.__name__)
+        wrapper.setModelTag(self.__modelTag__)
+        wrapper.setUseNumpyConvention(self.__useNumpy__)
+        if self.__outputSchema__ is not None :
+            wrapper.setOutputSchema(self.__outputSchema__)
+        wrapper.setInputDescription(self._inputDescription)
+        wrapper.setOutputDescription(self._outputDescription)
+        wrapper.setChunkSize(self.__chunkSize__ if self.__checkpoint__ is None else None)
+        if self.__failurePolicy__ is not None :
+            wrapper.__failurePolicy__ = dict(self.__failurePolicy__)
+        if self.__memoryBudget__ is not None :
+            wrapper.__memoryBudget__ = dict(self.__memoryBudget__)
+        if self.__deduplication__ is not None :
+            wrapper.setDeduplication(True, self.__deduplication__['cache_size'])
+        if self.__outputCompression__ is not None :
+            wrapper.setOutputCompression(self.__outputCompression__['tolerance'],
+                                         self.__outputCompression__['max_modes'],
+                                         self.__outputCompression__['chunk_size'])
+        return wrapper
+
+    def setCheckpoint(self, directory=None, chunkSize=1000, modelTag=None):
+        """Sets a directory where the chunks of the batch evaluations are
+        saved as soon as they are finished. A later call with the same design
+        and the same model (even after a crash or a restart) only evaluates
+        the missing chunks.
+
+        Arguments
+        ---------
+        directory : str or None
+            directory of the on-disk store, None to remove the checkpoint
+        chunkSize : int
+            number of rows per chunk
+        modelTag : str, optional
+            identity of the model, see setModelTag
+        """
+        if modelTag is not None :
+            self.setModelTag(modelTag)
+        if directory is None :
+            self.__checkpoint__ = None
+        else :
+            self.__checkpoint__ = EvaluationCheckpoint(directory, chunkSize, self.getModelTag())
+            self.__chunkSize__ = int(chunkSize)
+
+    def setChunkSize(self, chunkSize=None):
+        """Sets the number of rows evaluated at once by the batch function
+
+        Arguments
+        ---------
+        chunkSize : int or None
+            None to pass the whole sample at once
+        """
+        assert chunkSize is None or (isinstance(chunkSize, Integral) and chunkSize > 0)
+        self.__chunkSize__ = chunkSize
+        if self.__checkpoint__ is not None and chunkSize is not None :
+            self.__checkpoint__.chunk_size = int(chunkSize)
+
     def setInputDescription(self, description):
         """Sets the input description
 
@@ -397,6 +1466,20 @@ return ProcessSamples, Samples, Lists or numpy arrays.''')
         self._inputDescription = ot.Description(list(description))
 
 
+    def setModelTag(self, tag=None):
+        """Sets the identity of the model, so that the chunks stored by the
+        checkpoint or the work queue for a design are only reused by the same
+        model. To be set when the default tag (see getModelTag) does not tell
+        the models apart, as for lambdas or for a function whose parameters
+        change between the studies.
+
+        Arguments
+        ---------
+        tag : str or None
+            None to go back to the default tag
+        """
+        self.__modelTag__ = tag
+
     def setName(self, name):
         """Sets the name of the object
 
@@ -415,6 +1498,314 @@ return ProcessSamples, Samples, Lists or numpy arrays.''')
         """
         self.__nOutputs__ = N
 
+    def setDeduplication(self, deduplicate=True, cacheSize=0):
+        """Evaluates only once the identical rows of the coefficients passed
+        to a batch evaluation, and scatters their outputs back to all of them.
+
+        Arguments
+        ---------
+        deduplicate : bool
+            False to evaluate all the rows, as by default
+        cacheSize : int
+            number of rows whose outputs are kept from a call to the next, so
+            that the rows sent again by a rerun are not evaluated again. The
+            rows that failed are not kept.
+        """
+        self.__rowCache__ = OrderedDict()
+        if not deduplicate :
+            self.__deduplication__ = None
+        else :
+            assert isinstance(cacheSize, Integral) and cacheSize >= 0
+            self.__deduplication__ = {'cache_size' : int(cacheSize)}
+
+    def setSurrogate(self, surrogate=None, validationScore=0., threshold=0.95,
+                     variance=None, varianceTolerance=None):
+        """Sets a metamodel of the function on the coefficients, to which the
+        batch evaluations are routed once its validation score reaches the
+        threshold. The rows where the predicted variance exceeds the
+        tolerance are still evaluated with the true model.
+
+        The surrogate predicts all the values of the outputs of a row,
+        flattened and side by side in the order of the outputs (a field output
+        taking vertices times dimension values). The outputs are rebuilt with
+        the output schema, or with the outputs of the last true evaluation.
+
+        Arguments
+        ---------
+        surrogate : ot.Function, ot.KrigingResult, list of them or callable
+            a list is taken as one metamodel per output value, as built by
+            the metamodeling_kriging class of the examples. A callable takes
+            and returns numpy arrays. None to remove the surrogate.
+        validationScore : float
+            score of the surrogate on a validation sample, for example the
+            predictivity factor Q2 of ot.MetaModelValidation
+        threshold : float
+            score from which the surrogate is used
+        variance : callable, optional
+            variance(coefficients) returns the predicted variances, of shape
+            (n,) or (n, values). Taken from getConditionalMarginalVariance for
+            kriging results.
+        varianceTolerance : float, optional
+            variance above which a row is evaluated with the true model
+        """
+        if surrogate is None :
+            self.__surrogate__ = None
+            return None
+        metamodels = surrogate if isinstance(surrogate, (list, tuple)) else [surrogate]
+        if variance is None and all(hasattr(metamodel, 'getConditionalMarginalVariance')
+                                    for metamodel in metamodels):
+            variance = lambda array : np.hstack([np.array(
+                    metamodel.getConditionalMarginalVariance(ot.Sample(array))).reshape(len(array), -1)
+                                                 for metamodel in metamodels])
+        predictors = []
+        for metamodel in metamodels :
+            if hasattr(metamodel, 'getMetaModel'):
+                metamodel = metamodel.getMetaModel()
+            if isinstance(metamodel, ot.Function):
+                predictors.append(lambda array, function=metamodel :
+                                        np.array(function(ot.Sample(array))))
+            else :
+                assert callable(metamodel), "The surrogate has to be callable"
+                predictors.append(metamodel)
+        predict = lambda array : np.hstack([np.array(predictor(array)).reshape(len(array), -1)
+                                            for predictor in predictors])
+        self.__surrogate__ = {'predict'   : predict,
+                              'variance'  : variance,
+                              'score'     : float(validationScore),
+                              'threshold' : float(threshold),
+                              'tolerance' : varianceTolerance}
+
+    def setSurrogateValidationScore(self, validationScore):
+        """Updates the validation score of the surrogate, for example after
+        it was trained again on more points.
+        """
+        assert self.__surrogate__ is not None, "Set a surrogate first"
+        self.__surrogate__['score'] = float(validationScore)
+
+    def setWorkQueue(self, queue=None, participate=True, timeout=None, poll=1.):
+        """Evaluates the batches through a file work queue shared with other
+        processes or machines, which run the worker entry point
+        (see runWorker). The coordinator merges the results in order.
+
+        Arguments
+        ---------
+        queue : FileWorkQueue or None
+            None to evaluate the batches locally
+        participate : bool
+            if True, this process evaluates queued chunks too while waiting
+        timeout : float, optional
+            maximal time to wait for the whole design, in seconds
+        poll : float
+            time between two checks of the results, in seconds
+        """
+        if queue is None :
+            self.__workQueue__ = None
+        else :
+            self.__workQueue__ = {'queue' : queue, 'participate' : participate,
+                                  'timeout' : timeout, 'poll' : poll}
+
+    def setExternalSimulator(self, simulator=None):
+        """Sets the external simulator launched per realization by callAsync
+
+        Arguments
+        ---------
+        simulator : ExternalSimulator or None
+        """
+        self.__simulator__ = simulator
+
+    def setParallelExecutor(self, executor=None):
+        """Sets the executor evaluating the chunks of the batch evaluations in
+        parallel, None to evaluate them sequentially.
+
+        Arguments
+        ---------
+        executor : ParallelEvaluator
+            pool of workers, with its chunk size, per chunk timeout and
+            re-execution of the stragglers
+        """
+        assert executor is None or isinstance(executor, ParallelEvaluator), \
+            "The executor has to be a ParallelEvaluator"
+        self.__executor__ = executor
+
+    def setFailurePolicy(self, isolateFailures=True, maxRetries=0,
+                         fillValue=float('nan'), retryDelay=0.):
+        """Sets how the failures of the batch function are handled.
+
+        When a chunk fails, it is split in two halves which are evaluated
+        again, down to the single rows making the function fail. These rows
+        are retried, and if they still fail their outputs are replaced by the
+        fill value and they are marked in the failure mask (getFailureMask),
+        instead of the whole batch being lost.
+
+        Arguments
+        ---------
+        isolateFailures : bool
+            False to raise the exception of the function, as by default
+        maxRetries : int
+            number of times a failing row is evaluated again
+        fillValue : float
+            value of the outputs of the failed rows
+        retryDelay : float
+            time in seconds waited before each retry
+        """
+        if not isolateFailures :
+            self.__failurePolicy__ = None
+        else :
+            self.__failurePolicy__ = {'max_retries' : int(maxRetries),
+                                      'fill_value'  : float(fillValue),
+                                      'retry_delay' : float(retryDelay)}
+
+    def setInstrumentationLog(self, log_file=None):
+        """Sets a json lines file where the timers and counters of each call
+        are appended.
+
+        Arguments
+        ---------
+        log_file : str or None
+            path of the file, None to stop logging
+        """
+        self.__instrumentation__.setLogFile(log_file)
+
+    def setVerbose(self, verbose=True):
+        """Flag to print the diagnostic messages during the evaluations
+
+        Arguments
+        ---------
+        verbose : bool
+        """
+        self.__verbose__ = bool(verbose)
+        if self.__AKLR__ is not None :
+            self.__AKLR__.setVerbose(self.__verbose__)
+
+    def setUseNumpyConvention(self, useNumpy=True):
+        """Flag to call the batch function with numpy arrays instead of
+        lists of ProcessSamples.
+
+        The batch function then receives a dictionary, with the name of each
+        process or distribution of the aggregation as key, and as value an
+        array of shape (n, vertices) or (n, vertices, dim) for the fields and
+        (n,) for the scalars. It must return a numpy array or a list of
+        numpy arrays (a dictionary by output name if an output schema is
+        declared), whose first dimension is the size of the sample.
+
+        Arguments
+        ---------
+        useNumpy : bool
+        """
+        self.__useNumpy__ = bool(useNumpy)
+
+    def setMemoryBudget(self, budget=None, adaptive=False, probeSize=16,
+                        maxChunkSize=1000000):
+        """Sets the memory that one chunk of a batch evaluation may use, so
+        that the chunk size is chosen automatically.
+
+        A first probe chunk is evaluated to measure the bytes per row of the
+        lifted inputs and of the outputs, and the following chunks take the
+        largest size fitting in the budget. The fixed chunk size is then
+        ignored. A checkpoint keeps its own chunk size, as the chunks saved
+        on disk are identified by it : the evaluation raises an
+        AssertionError, giving the largest chunk size fitting in the budget,
+        once a chunk of the checkpoint is measured above the budget.
+
+        Arguments
+        ---------
+        budget : int or None
+            bytes per chunk, None to remove the budget
+        adaptive : bool
+            if True, the bytes per row are measured on each chunk and the
+            chunk size follows the measured throughput, within the budget
+        probeSize : int
+            number of rows of the probe chunk
+        maxChunkSize : int
+            upper bound on the chunk size
+        """
+        if budget is None :
+            self.__memoryBudget__ = None
+            return None
+        assert budget > 0 and probeSize > 0 and maxChunkSize > 0, \
+            "The budget, the probe size and the maximal chunk size have to be positive"
+        self.__memoryBudget__ = {'budget'         : int(budget),
+                                 'adaptive'       : bool(adaptive),
+                                 'probe_size'     : int(probeSize),
+                                 'max_chunk_size' : int(maxChunkSize),
+                                 'bytes_per_row'  : None}
+
+    def setOutputCompression(self, tolerance=None, maxModes=None, chunkSize=1000):
+        """Stores the field outputs of the batch evaluations as their
+        coefficients on a PCA basis (see CompressedProcessSample), learned on
+        the first chunk evaluated and refined on each following chunk, so
+        that the full fields of a large design never have to be held at once.
+        Each chunk is compressed once, as soon as it is evaluated, and the
+        outputs stay compressed through the deduplication and the row cache.
+
+        Arguments
+        ---------
+        tolerance : float or None
+            maximal L2 norm of the reconstruction error of a field, relative
+            to the root mean square norm of the centered fields of the first
+            chunk. None to store the full fields again.
+        maxModes : int, optional
+            maximal number of modes of the basis of each output
+        chunkSize : int
+            number of rows per chunk when no chunk size, memory budget or
+            checkpoint is set
+        """
+        # the cached rows are in the form of the previous compression
+        self.__rowCache__.clear()
+        if tolerance is None :
+            self.__outputCompression__ = None
+        else :
+            assert tolerance >= 0, "The tolerance can only be positive"
+            assert isinstance(chunkSize, Integral) and chunkSize > 0, \
+                "Chunk size can only be positive integer"
+            self.__outputCompression__ = {'tolerance'   : float(tolerance),
+                                          'max_modes'   : maxModes,
+                                          'chunk_size'  : int(chunkSize),
+                                          'compressors' : dict()}
+
+    def setOutputSchema(self, schema=None):
+        """Declares once the structure of the outputs of the function, so
+        that the outputs are converted without inferring their shapes and
+        types at each call.
+
+        Arguments
+        ---------
+        schema : list of dict or None
+            one dictionary per output, in the order of the output tuple, with
+            the keys :
+                'name' : str
+                'kind' : 'scalar' or 'field'
+                'dimension' : int, dimension of the values (default : 1)
+                'shape' : tuple of ints, shape of the regular grid (fields only)
+                'mesh' : ot.Mesh, instead of 'shape' (fields only)
+            None to go back to the inference of the outputs.
+
+        Example
+        -------
+        >>> schema = [{'name':'VM', 'kind':'field', 'shape':(100,)},
+        ...           {'name':'MD', 'kind':'scalar'}]
+        """
+        if schema is None :
+            self.__outputSchema__ = None
+            return None
+        outputSchema = []
+        for i, spec in enumerate(schema):
+            assert spec.get('kind') in ('scalar', 'field'), \
+                "The kind of output {} must be 'scalar' or 'field'".format(i)
+            spec = dict(spec)
+            spec.setdefault('name', 'Y_'+str(i))
+            spec['dimension'] = int(spec.get('dimension', 1))
+            if spec['kind'] == 'field' :
+                if spec.get('mesh') is None :
+                    assert 'shape' in spec, \
+                        "Give the mesh or the grid shape of output {}".format(i)
+                    spec['mesh'] = self._getMesh(spec['shape'])
+            outputSchema.append(spec)
+        self.__outputSchema__ = outputSchema
+        self.__nOutputs__ = len(outputSchema)
+        self.outputDim = [spec['dimension'] for spec in outputSchema]
+        self.setOutputDescription([spec['name'] for spec in outputSchema])
+
     def setOutputDescription(self, description):
         """Sets the description of each separate outputs
 
@@ -428,6 +1819,160 @@ return ProcessSamples, Samples, Lists or numpy arrays.''')
         self._outputDescription = ot.Description(description)
 
 
+def callBatchFunction(function, inputs, useNumpy=False):
+    """Calls the batch function on the lifted inputs, either as a whole or
+    unpacked as one argument per input (module level, so that it can be sent
+    to a process pool).
+    """
+    if useNumpy :
+        return function(inputs)
+    try :
+        result = function(inputs)
+    except :
+        try :
+            result = function(*inputs)
+        except TypeError as te:
+            print('did not manage to evaluate batch function')
+            raise te
+    return result
+
+
+def concatenateOutputs(chunkOutputs):
+    """Concatenates output by output the converted results of several chunks
+
+    Arguments
+    ---------
+    chunkOutputs : list of lists
+        for each chunk, the list of ot.Sample and ot.ProcessSample returned
+        by the batch evaluation
+
+    Returns
+    -------
+    outputList : list
+        list of ot.Sample and ot.ProcessSample covering all the chunks
+    """
+    outputList = []
+    for i in range(len(chunkOutputs[0])):
+        first = chunkOutputs[0][i]
+        if isinstance(first, CompressedProcessSample):
+            element = CompressedProcessSample.concatenate([chunk[i] for chunk in chunkOutputs])
+        elif isinstance(first, ot.ProcessSample):
+            element = processSampleFromArray(first.getMesh(),
+                            np.concatenate([np.array(chunk[i]).reshape(chunk[i].getSize(),
+                                            -1, first.getDimension()) for chunk in chunkOutputs]),
+                            first.getDimension())
+        elif isinstance(first, ot.Sample):
+            element = ot.Sample(first)
+            for chunk in chunkOutputs[1:] :
+                element.add(chunk[i])
+        else :
+            print('Cannot concatenate elements of type', first.__class__.__name__)
+            raise NotImplementedError
+        element.setName(first.getName())
+        outputList.append(element)
+    return outputList
+
+
+def getOutputStructure(outputs):
+    """Returns what is needed to rebuild outputs from their values : the name
+    of each output, and the mesh and dimension of its fields.
+
+    Returns
+    -------
+    structure : list of dicts
+        name, mesh (None for ot.Sample) and dimension of each output
+    """
+    structure = []
+    for element in outputs :
+        mesh = element.getMesh() if isinstance(element, (ot.ProcessSample,
+                                    CompressedProcessSample)) else None
+        structure.append({'name'      : element.getName(),
+                          'mesh'      : mesh,
+                          'dimension' : element.getDimension()})
+    return structure
+
+
+def outputLike(structure, values):
+    """Builds an output from its values
+
+    Arguments
+    ---------
+    structure : dict
+        name, mesh and dimension of the output, see getOutputStructure
+    values : numpy.ndarray
+        of shape (n, dimension) for a ot.Sample, or (n, vertices, dimension)
+        for a ot.ProcessSample
+
+    Returns
+    -------
+    output : ot.Sample or ot.ProcessSample
+    """
+    size = values.shape[0]
+    if structure['mesh'] is None :
+        output = ot.Sample(np.asarray(values, dtype=float).reshape(size, structure['dimension']))
+    else :
+        output = processSampleFromArray(structure['mesh'], values, structure['dimension'])
+    output.setName(structure['name'])
+    return output
+
+
+def takeRows(element, rows):
+    """Returns the rows of an output in the given order, in the same form
+
+    Arguments
+    ---------
+    element : ot.Sample, ot.ProcessSample or CompressedProcessSample
+    rows : sequence of int
+
+    Returns
+    -------
+    taken : ot.Sample, ot.ProcessSample or CompressedProcessSample
+    """
+    rows = np.asarray(rows, dtype=int)
+    if isinstance(element, CompressedProcessSample):
+        taken = element[rows]
+    elif isinstance(element, ot.ProcessSample):
+        taken = processSampleFromArray(element.getMesh(), np.array(element)[rows],
+                                       element.getDimension())
+    else :
+        taken = element.select(rows.tolist())
+    taken.setName(element.getName())
+    return taken
+
+
+def fillOutputs(template, size, value):
+    """Builds outputs of the same structure than the template outputs, with
+    size rows all equal to value.
+
+    Arguments
+    ---------
+    template : list
+        list of ot.Sample and ot.ProcessSample
+    size : int
+        number of rows of the outputs
+    value : float
+
+    Returns
+    -------
+    outputList : list
+        list of ot.Sample and ot.ProcessSample
+    """
+    outputList = []
+    for element in template :
+        if isinstance(element, ot.ProcessSample):
+            filled = processSampleFromArray(element.getMesh(),
+                        np.full((size, element.getMesh().getVerticesNumber(),
+                                 element.getDimension()), value), element.getDimension())
+        elif isinstance(element, ot.Sample):
+            filled = ot.Sample(np.full((size, element.getDimension()), value))
+        else :
+            print('Cannot fill elements of type', element.__class__.__name__)
+            raise NotImplementedError
+        filled.setName(element.getName())
+        outputList.append(filled)
+    return outputList
+
+
 ##############################################################################
 ##############################################################################
 ##############################################################################
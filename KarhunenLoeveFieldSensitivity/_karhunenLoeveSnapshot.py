@@ -0,0 +1,266 @@
+__author__ = 'Kristof Attila S.'
+__version__ = '0.1'
+__date__  = '19.10.26'
+
+__all__ = ['KarhunenLoeveSnapshot']
+
+import os
+import json
+import pickle
+import numpy as np
+import openturns as ot
+try :
+    from ._aggregatedKarhunenLoeveResults import processSampleFromArray
+except ImportError :
+    from _aggregatedKarhunenLoeveResults import processSampleFromArray
+
+
+class KarhunenLoeveSnapshot(object):
+    '''Compact and picklable copy of an AggregatedKarhunenLoeveResults,
+    holding only what is needed to lift coefficients : the scaled modes of
+    the processes as arrays, the vertices and simplices of their meshes, and
+    the class and parameters of the distributions.
+
+    It lifts the coefficients like the aggregation it was taken from
+    (liftAsArrays, liftAsProcessSample, liftAsField), so it can replace it in
+    a KarhunenLoeveGeneralizedFunctionWrapper sent to worker processes.
+
+    Once saved in a directory, the snapshot pickles as the path of that
+    directory only, and the modes are memory-mapped when it is loaded back :
+    the workers of one machine then share the same pages of the mode files
+    instead of each receiving a copy.
+
+    Parameters
+    ----------
+    aggregation : AggregatedKarhunenLoeveResults
+        the aggregation to take the snapshot of
+    '''
+    def __init__(self, aggregation=None):
+        self.directory = None
+        self.__meshes__ = dict()
+        self.__lifting__ = dict()
+        self.__verbose__ = False
+        if aggregation is not None :
+            self._extract(aggregation)
+
+    def __repr__(self):
+        return ', '.join(['KarhunenLoeveSnapshot',
+                          'elements : {}'.format(self.__process_distribution_description__),
+                          'modes : {}'.format(self.__mode_count__),
+                          'directory : {}'.format(self.directory)])
+
+    def __getstate__(self):
+        meta = self._getMeta()
+        if self.directory is not None :
+            return {'directory' : self.directory}
+        return {'meta' : meta, 'arrays' : self.__arrays__,
+                'distributions' : self.__distributions__}
+
+    def __setstate__(self, state):
+        self.__init__()
+        if 'directory' in state :
+            self._loadDirectory(state['directory'], mmap=True)
+        else :
+            self._setMeta(state['meta'])
+            self.__arrays__ = state['arrays']
+            self.__distributions__ = state['distributions']
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        '''Loads a snapshot saved in a directory
+
+        Arguments
+        ---------
+        directory : str
+        mmap : bool
+            if True, the mode files are memory-mapped instead of read
+        '''
+        snapshot = cls()
+        snapshot._loadDirectory(directory, mmap)
+        return snapshot
+
+    def save(self, directory):
+        '''Saves the snapshot in a directory : a json file with the
+        description of the elements, one .npy file per array, and a pickle of
+        the distributions that can not be rebuilt from their parameters.
+        '''
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for name, array in self.__arrays__.items():
+            np.save(os.path.join(directory, name + '.npy'), np.asarray(array))
+        objects = {i : distribution for i, distribution in self.__distributions__.items()
+                                    if not isinstance(distribution, dict)}
+        parameters = {str(i) : distribution for i, distribution in self.__distributions__.items()
+                                    if isinstance(distribution, dict)}
+        with open(os.path.join(directory, 'distributions.pkl'), 'wb') as fic:
+            pickle.dump(objects, fic, protocol=pickle.HIGHEST_PROTOCOL)
+        meta = self._getMeta()
+        meta['distributions'] = parameters
+        with open(os.path.join(directory, 'snapshot.json'), 'w') as fic:
+            json.dump(meta, fic)
+        self.directory = directory
+
+    def getSizeModes(self):
+        '''Gets the total number of coefficients used to represent the aggregation
+        '''
+        return sum(self.__mode_count__)
+
+    def getAggregationOrder(self):
+        '''Gets the number of processes and distributions in the aggregation
+        '''
+        return len(self.__mode_count__)
+
+    def getMesh(self, i):
+        '''Returns the mesh of the element at index i, rebuilt once from its
+        vertices and simplices
+        '''
+        if i not in self.__meshes__ :
+            if self.__isProcess__[i] :
+                self.__meshes__[i] = ot.Mesh(
+                    ot.Sample(np.asarray(self.__arrays__['vertices_{:02d}'.format(i)])),
+                    ot.IndicesCollection(np.asarray(self.__arrays__['simplices_{:02d}'.format(i)])))
+            else :
+                self.__meshes__[i] = ot.Mesh()
+        return self.__meshes__[i]
+
+    def setVerbose(self, verbose):
+        self.__verbose__ = verbose
+
+    def liftAsArrays(self, coefficients):
+        '''Lifts a sample of coefficients into numpy arrays, as
+        AggregatedKarhunenLoeveResults.liftAsArrays
+
+        Returns
+        -------
+        arrays : dict
+            name of the process or distribution -> numpy array of shape
+            (n, vertices) for processes of dimension 1, (n, vertices, dim)
+            for processes of higher dimension and (n,) for the scalars
+        '''
+        coefficients = np.asarray(coefficients, dtype=float)
+        assert coefficients.ndim == 2 and coefficients.shape[1] == self.getSizeModes(), \
+            'DimensionError : the sample of coefficients has the wrong shape'
+        arrays = dict()
+        jumpDim = 0
+        for i, nModes in enumerate(self.__mode_count__):
+            coeffs = coefficients[:, jumpDim : jumpDim + nModes]
+            if self.__isProcess__[i] :
+                values = np.tensordot(coeffs, self.__arrays__['modes_{:02d}'.format(i)], axes=1)
+                if values.shape[2] == 1 :
+                    values = values[:, :, 0]
+            else :
+                values = np.array(self._getLifting(i)(ot.Sample(coeffs)))[:, 0]
+            if self.__liftWithMean__ :
+                values = values + self.__means__[i]
+            arrays[self.__process_distribution_description__[i]] = values
+            jumpDim += nModes
+        return arrays
+
+    def liftAsProcessSample(self, coefficients):
+        '''Lifts a sample of coefficients into the ordered list of process
+        samples, as AggregatedKarhunenLoeveResults.liftAsProcessSample
+        '''
+        if self.__verbose__ : print('Lifting as process sample')
+        arrays = self.liftAsArrays(coefficients)
+        size = len(coefficients)
+        processes = []
+        for i, name in enumerate(self.__process_distribution_description__):
+            values = arrays[name].reshape(size, self.getMesh(i).getVerticesNumber(), -1)
+            processes.append(processSampleFromArray(self.getMesh(i), values, values.shape[2]))
+        return processes
+
+    def liftAsField(self, coefficients):
+        '''Lifts a vector of coefficients into the ordered list of fields, as
+        AggregatedKarhunenLoeveResults.liftAsField
+        '''
+        assert isinstance(coefficients, (ot.Point)), 'function only lifts points'
+        if self.__verbose__ : print('Lifting as field')
+        processes = self.liftAsProcessSample(ot.Sample([coefficients]))
+        return [ot.Field(processSample.getMesh(), processSample[0]) for processSample in processes]
+
+    def _extract(self, aggregation):
+        elements = aggregation.__KLResultsAndDistributions__
+        self.__process_distribution_description__ = list(aggregation.__process_distribution_description__)
+        self.__mode_description__ = list(aggregation.__mode_description__)
+        self.__mode_count__ = [int(count) for count in aggregation.__mode_count__]
+        self.__isProcess__ = [bool(isProcess) for isProcess in aggregation.__isProcess__]
+        self.__means__ = [float(mean) for mean in aggregation.__means__]
+        self.__liftWithMean__ = bool(aggregation.__liftWithMean__)
+        self.__arrays__ = dict()
+        self.__distributions__ = dict()
+        for i, element in enumerate(elements):
+            if self.__isProcess__[i] :
+                mesh = element.getMesh()
+                self.__arrays__['modes_{:02d}'.format(i)] = aggregation._getScaledModesArray(i)
+                self.__arrays__['vertices_{:02d}'.format(i)] = np.array(mesh.getVertices())
+                self.__arrays__['simplices_{:02d}'.format(i)] = np.array(mesh.getSimplices())
+            else :
+                self.__distributions__[i] = _describeDistribution(element)
+
+    def _getMeta(self):
+        return {'description'      : self.__process_distribution_description__,
+                'mode_description' : self.__mode_description__,
+                'mode_count'       : self.__mode_count__,
+                'is_process'       : self.__isProcess__,
+                'means'            : self.__means__,
+                'lift_with_mean'   : self.__liftWithMean__}
+
+    def _setMeta(self, meta):
+        self.__process_distribution_description__ = meta['description']
+        self.__mode_description__ = meta['mode_description']
+        self.__mode_count__ = meta['mode_count']
+        self.__isProcess__ = meta['is_process']
+        self.__means__ = meta['means']
+        self.__liftWithMean__ = meta['lift_with_mean']
+
+    def _loadDirectory(self, directory, mmap=True):
+        with open(os.path.join(directory, 'snapshot.json'), 'r') as fic:
+            meta = json.load(fic)
+        self._setMeta(meta)
+        self.__arrays__ = dict()
+        for i, isProcess in enumerate(self.__isProcess__):
+            if isProcess :
+                for name in ('modes', 'vertices', 'simplices'):
+                    key = '{}_{:02d}'.format(name, i)
+                    self.__arrays__[key] = np.load(os.path.join(directory, key + '.npy'),
+                                                   mmap_mode='r' if mmap else None)
+        with open(os.path.join(directory, 'distributions.pkl'), 'rb') as fic:
+            self.__distributions__ = pickle.load(fic)
+        for i, parameters in meta['distributions'].items():
+            self.__distributions__[int(i)] = parameters
+        self.directory = directory
+
+    def _getLifting(self, i):
+        '''Returns the inverse iso probabilistic transformation of the
+        distribution at index i, built once
+        '''
+        if i not in self.__lifting__ :
+            distribution = self.__distributions__[i]
+            if isinstance(distribution, dict):
+                distribution = _buildDistribution(distribution)
+            self.__lifting__[i] = distribution.getInverseIsoProbabilisticTransformation()
+        return self.__lifting__[i]
+
+
+def _describeDistribution(distribution):
+    '''Returns the class name and the parameters of a distribution if it can
+    be rebuilt from them, else the distribution itself.
+    '''
+    try :
+        description = {'class'     : distribution.getImplementation().getClassName(),
+                       'parameter' : list(distribution.getParameter()),
+                       'name'      : distribution.getName()}
+        rebuilt = _buildDistribution(description)
+        if np.allclose(rebuilt.getMean(), distribution.getMean()) and \
+           np.allclose(rebuilt.getStandardDeviation(), distribution.getStandardDeviation()):
+            return description
+    except Exception :
+        pass
+    return distribution
+
+
+def _buildDistribution(description):
+    distribution = ot.Distribution(getattr(ot, description['class'])())
+    distribution.setParameter(description['parameter'])
+    distribution.setName(description['name'])
+    return distribution
@@ -5,9 +5,28 @@ __date__  = '17.09.20'
 __all__ = ['KarhunenLoeveSobolIndicesExperiment']
 
 from copy import deepcopy
+import numpy as np
 import openturns as ot
+try :
+    from ._virtualSobolDesign import VirtualSobolDesign, arrayToSample, parseGroups
+    from ._karhunenLoeveGeneralizedFunctionWrapper import concatenateOutputs
+except ImportError :
+    from _virtualSobolDesign import VirtualSobolDesign, arrayToSample, parseGroups
+    from _karhunenLoeveGeneralizedFunctionWrapper import concatenateOutputs
+
+SEQUENCES = {'Faure'         : ot.FaureSequence,
+             'Halton'        : ot.HaltonSequence,
+             'ReverseHalton' : ot.ReverseHaltonSequence,
+             'Haselgrove'    : ot.HaselgroveSequence,
+             'Sobol'         : ot.SobolSequence}
+
 
 class KarhunenLoeveSobolIndicesExperiment(ot.SobolIndicesExperiment):
+    # layout of the design, see SobolDesignMetadata
+    LAYOUT = 'Saltelli'
+    # number of rows of each independent random stream of the seeded Monte Carlo
+    STREAM_BLOCK_SIZE = 1024
+
     def __init__(self, AggregatedKarhunenLoeveResults=None, size=None,
                                                         second_order=False):
         self.__AKLR__ = AggregatedKarhunenLoeveResults
@@ -21,6 +40,8 @@ class KarhunenLoeveSobolIndicesExperiment(ot.SobolIndicesExperiment):
         self.inputVarNames = list()
         self.inputVarNamesKL = list()
         self.__mode_count__ = list()
+        self.__groups__ = None
+        self.__groupNames__ = None
 
         if size is not None:
             self.setSize(size)
@@ -31,6 +52,116 @@ class KarhunenLoeveSobolIndicesExperiment(ot.SobolIndicesExperiment):
         self._sample_A = None
         self._sample_B = None
         self._experimentSample = None
+        self.__method__ = None
+        self.__randomized__ = False
+        self.__sequence__ = None
+        self.__shift__ = None
+        self.__replicated__ = False
+        self.__previousSize__ = None
+        self.__stream__ = None
+        # sequence of the QMC streams, kept with its position between the calls
+        self.__streamSequence__ = None
+
+    def extend(self, size, **kwargs):
+        """Increases the size N of the samples A and B, keeping their rows.
+
+        The new rows continue the low discrepancy sequence for the 'QMC'
+        method (with the same random shift if randomized), and are new random
+        draws for the 'MonteCarlo' method. As the row j of A and B is the
+        point j of the sequence, A and B stay the first points of their
+        halves of the sequence, and keep their net structure at the sizes
+        where the sequence has it (powers of two for 'Sobol'). Only
+        the rows of the blocks A, B and A_B^i that are new are returned, so
+        that only them have to be evaluated. Their outputs are then merged
+        with the ones of the previous design with mergeOutputs.
+
+        Arguments
+        ---------
+        size : int
+            the new size N, larger than the current one
+
+        Keyword Arguments
+        -----------------
+        see generate, only used if no sample was generated yet
+
+        Returns
+        -------
+        increment : VirtualSobolDesign
+            the new rows of each block, as a design of size N - N_previous
+
+        Example
+        -------
+        >>> design = experiment.generate(method='QMC', sequence='Sobol')
+        >>> outputs = wrapper(design)
+        >>> increment = experiment.extend(2 * experiment.size)
+        >>> outputs = experiment.mergeOutputs(outputs, wrapper(increment))
+        """
+        assert isinstance(size,int) and size>0, \
+                "Sample size can only be positive integer"
+        if self._sample_A is None :
+            self.size = size
+            self._generateSample(**kwargs)
+            self.__previousSize__ = 0
+            return self._getVirtualDesign()
+        assert size > self.size, \
+                "The new size must be larger than the current one ({})".format(self.size)
+        assert self.__method__ in ('MonteCarlo', 'QMC'), \
+                "Only the 'MonteCarlo' and 'QMC' samples can be extended"
+        assert not self.__replicated__, \
+                "The replicates cannot be extended, generate them at the new size"
+        increment = size - self.size
+        if self.__stream__ is not None :
+            # the new rows of the seeded streams
+            sample_A, sample_B = [arrayToSample(rows) for rows in
+                                  self._generateStreamRows(self.__stream__, self.size, size)]
+            self._sample_A.add(sample_A)
+            self._sample_B.add(sample_B)
+            self.__previousSize__ = self.size
+            self.size = size
+            self._experimentSample = None
+            return self._getVirtualDesign(sample_A, sample_B)
+        if self.__method__ == 'QMC':
+            sample_A, sample_B = [arrayToSample(rows) for rows in
+                                  self._generateSequenceRows(increment)]
+        else :
+            sample = ot.Sample(self.composedDistribution.getSample(2 * increment))
+            sample_A, sample_B = sample[:increment, :], sample[increment:, :]
+        self._sample_A.add(sample_A)
+        self._sample_B.add(sample_B)
+        self.__previousSize__ = self.size
+        self.size = size
+        self._experimentSample = None
+        return self._getVirtualDesign(sample_A, sample_B)
+
+    def mergeOutputs(self, previousOutputs, incrementOutputs):
+        """Merges the outputs of the design before the last extension with
+        the outputs of the increment returned by extend, block by block, into
+        the outputs of the whole extended design.
+
+        Arguments
+        ---------
+        previousOutputs, incrementOutputs : list
+            ot.Sample and ot.ProcessSample returned by the function wrapper
+
+        Returns
+        -------
+        outputs : list
+            outputs in the order of the rows of generate() at the new size
+        """
+        assert self.__previousSize__ is not None, \
+                "The experiment was not extended"
+        previous, increment = self.__previousSize__, self.size - self.__previousSize__
+        nBlocks = self._getVirtualDesign().getBlocksNumber()
+        assert len(previousOutputs[0]) == nBlocks * previous and \
+               len(incrementOutputs[0]) == nBlocks * increment, \
+                "The outputs do not match the sizes of the last extension"
+        chunks = []
+        for k in range(nBlocks):
+            chunks.append([_sliceOutput(output, k * previous, (k + 1) * previous)
+                           for output in previousOutputs])
+            chunks.append([_sliceOutput(output, k * increment, (k + 1) * increment)
+                           for output in incrementOutputs])
+        return concatenateOutputs(chunks)
 
     def generate(self, **kwargs):
         """Generates and returns the final mixture matrix.
@@ -42,6 +173,14 @@ class KarhunenLoeveSobolIndicesExperiment(ot.SobolIndicesExperiment):
         sequence : str
             Only if using QMC
             Can be : 'Faure', 'Halton', 'ReverseHalton', 'Haselgrove', 'Sobol'
+        randomize : bool
+            Only if using QMC, applies a random shift to the sequence
+            (randomized QMC). False by default.
+            With QMC, the row j of A and B is the point j of a sequence of
+            dimension 2 * modes, A its first half and B its second half.
+        seed : int
+            If given, the samples are generated from seeded streams instead
+            of the global random generator of openturns, see generateRows.
         """
         assert (self.__AKLR__ is not None) and \
                (self.size is not None), \
@@ -52,6 +191,147 @@ class KarhunenLoeveSobolIndicesExperiment(ot.SobolIndicesExperiment):
         self._experimentSample.setDescription(self.inputVarNamesKL)
         return self._experimentSample
 
+    def generateWithMetadata(self, **kwargs):
+        """Generates the mixture matrix, like generate, and returns it with
+        its SobolDesignMetadata, to be passed with the design to the
+        SobolKarhunenLoeveFieldSensitivityAlgorithm. An ot.Sample cannot
+        carry its layout, which is only assumed to be Saltelli without the
+        metadata.
+
+        Keyword Arguments
+        -----------------
+        see generate
+
+        Returns
+        -------
+        design : ot.Sample
+        metadata : SobolDesignMetadata
+        """
+        design = self.generate(**kwargs)
+        return design, self.getMetadata()
+
+    def generateVirtual(self, **kwargs):
+        """Generates the samples A and B and returns the mixture matrix as a
+        VirtualSobolDesign, which only stores A and B and mixes the rows when
+        they are accessed. It can be evaluated by the function wrapper and
+        passed to the sensitivity algorithm like the generated sample.
+
+        Keyword Arguments
+        -----------------
+        see generate
+        """
+        assert (self.__AKLR__ is not None) and \
+               (self.size is not None), \
+                    "Please intialise sample size and PythonFunction wrapper"
+        self._generateSample(**kwargs)
+        return self._getVirtualDesign()
+
+    def generateReplicates(self, replicates, **kwargs):
+        """Generates independent replicates of the design, to estimate the
+        error of the indices from their spread, see
+        ReplicatedSobolSensitivityAlgorithm.
+
+        By default the replicates are randomized QMC designs : the same
+        low discrepancy sequence with an independent random shift for each
+        replicate. Each replicate keeps the convergence rate of QMC, and the
+        replicates are independent and identically distributed.
+
+        Arguments
+        ---------
+        replicates : int
+            number of replicates R, at least 2
+
+        Keyword Arguments
+        -----------------
+        see generate, with method='QMC' and randomize=True by default
+
+        Returns
+        -------
+        designs : list of VirtualSobolDesign
+            the R designs, each of size N * (2 + d)
+        """
+        assert isinstance(replicates, int) and replicates > 1, \
+                "At least two replicates are needed"
+        assert (self.__AKLR__ is not None) and \
+               (self.size is not None), \
+                    "Please intialise sample size and PythonFunction wrapper"
+        kwargs.setdefault('method', 'QMC')
+        kwargs.setdefault('randomize', True)
+        if kwargs['method'] == 'QMC':
+            kwargs.setdefault('sequence', 'Sobol')
+            assert kwargs['randomize'], \
+                "The replicates of a QMC design must be randomized to differ"
+        seeds = [None] * replicates
+        if kwargs.get('seed') is not None :
+            # one independent seed per replicate, derived from the seed
+            seeds = [int(child.generate_state(1)[0]) for child in
+                     np.random.SeedSequence(kwargs['seed']).spawn(replicates)]
+        designs = []
+        for r in range(replicates):
+            kwargs['seed'] = seeds[r]
+            self._generateSample(**kwargs)
+            designs.append(self._getVirtualDesign())
+        self.__replicated__ = True
+        return designs
+
+    def generateRows(self, start, stop, **kwargs):
+        """Generates the rows start to stop of the samples A and B from
+        seeded streams, without generating the other rows.
+
+        The rows do not depend on how the samples are split, so chunks of a
+        huge design can be generated in parallel by several workers, or
+        generated again on demand, and are identical to the rows of
+        generate(seed=...) and of its extensions.
+
+        - 'MonteCarlo' : the rows are cut in blocks of STREAM_BLOCK_SIZE, each
+          drawn from an independent counter-based (Philox) stream keyed by
+          the seed and the index of the block.
+        - 'QMC' : the row j of A and B is the point j of a sequence of
+          dimension 2 * modes (A its first half, B its second half). The
+          sequences of openturns cannot jump : the experiment keeps the
+          sequence between the calls, so consecutive chunks continue it, and
+          the first points are only skipped when a chunk starts before the
+          last one stopped. With randomize=True, the random shift is drawn
+          from the seed.
+
+        The settings of the streams of generate are not changed.
+
+        Arguments
+        ---------
+        start, stop : int
+            rows of A and B to generate
+
+        Keyword Arguments
+        -----------------
+        method : str
+            'MonteCarlo' or 'QMC'
+        sequence : str
+            Only if using QMC, see generate
+        randomize : bool
+            Only if using QMC, see generate
+        seed : int
+            seed of the streams, only optional if the samples were already
+            generated with a seed
+
+        Returns
+        -------
+        rows : VirtualSobolDesign
+            the design of the rows start to stop of A and B, of block size
+            stop - start
+
+        Example
+        -------
+        >>> parts = [experiment.generateRows(s, s + 1000, seed=42)
+        ...          for s in range(0, 10000, 1000)]
+        """
+        assert self.__AKLR__ is not None, "Please intialise the aggregated results"
+        assert 0 <= start <= stop, "Rows out of the samples"
+        stream = self.__stream__
+        if 'seed' in kwargs or stream is None :
+            stream = self._getStreamSettings(**kwargs)
+        sample_A, sample_B = self._generateStreamRows(stream, start, stop)
+        return self._getVirtualDesign(sample_A, sample_B, stream)
+
     def generateWithWeights(self, **kwargs):
         """Not implemented, for coherence with openturns library
         """
@@ -93,6 +373,20 @@ class KarhunenLoeveSobolIndicesExperiment(ot.SobolIndicesExperiment):
         else :
             return len(self._experimentSample)
 
+    def getVirtualDesign(self):
+        """Returns the current design as a VirtualSobolDesign, without
+        generating new samples, for instance after an extension.
+        """
+        assert self._sample_A is not None, "Please generate the samples first"
+        return self._getVirtualDesign()
+
+    def getMetadata(self):
+        """Returns the SobolDesignMetadata of the current design : layout,
+        N, modes and groups, second order flag, method and seed.
+        """
+        assert self._sample_A is not None, "Please generate the samples first"
+        return self._getVirtualDesign().getMetadata(self.LAYOUT)
+
     def getVisibility(self):
         """Returns the visibility
         """
@@ -130,6 +424,39 @@ class KarhunenLoeveSobolIndicesExperiment(ot.SobolIndicesExperiment):
         self.composedDistribution.setDescription(self.inputVarNamesKL)
         self.__mode_count__ = self.__AKLR__.__mode_count__
 
+    def setGroups(self, groups=None):
+        """Sets groups of variables whose modes are swapped together.
+
+        There is then one block A_B^i per group instead of one per variable of
+        the aggregation, so the design has N * (2 + groups) rows, and the
+        indices computed are the ones of the groups. The variables in no
+        group are never swapped and get no index.
+
+        Arguments
+        ---------
+        groups : dict or list, optional
+            dict of the name of each group and the list of its variables, or
+            list of lists of variables, the variables given by their name or
+            index in the aggregation. None to get back to one block per
+            variable.
+
+        Example
+        -------
+        >>> experiment.setGroups({'loads' : ['F_', 'P_'], 'material' : ['E_']})
+        """
+        self._sample_A = self._sample_B = self._experimentSample = None
+        if groups is None :
+            self.__groups__ = self.__groupNames__ = None
+            return None
+        assert self.__AKLR__ is not None, "Please set the aggregated results first"
+        self.__groups__, self.__groupNames__ = parseGroups(groups, self.inputVarNames)
+
+    def getGroups(self):
+        """Returns the indices of the variables of each group, None if the
+        variables are not grouped
+        """
+        return self.__groups__
+
     def setName(self, name):
         """Sets the name of the object
         """
@@ -153,62 +480,121 @@ class KarhunenLoeveSobolIndicesExperiment(ot.SobolIndicesExperiment):
 
     def _mixSamples(self):
         '''Mixes the samples together with the altered method presented in the paper
+
+        The experiment is assembled block by block in a single preallocated
+        sample, see VirtualSobolDesign.
         '''
+        self._experimentSample = self._getVirtualDesign().asSample()
+
+    def _getVirtualDesign(self, sample_A=None, sample_B=None, stream=None):
+        if sample_A is None :
+            sample_A, sample_B = self._sample_A, self._sample_B
+        if stream is None :
+            stream = self.__stream__
         n_vars = self.__AKLR__.__field_distribution_count__
-        n_modes = self.__AKLR__.getSizeModes()
-        N = self.size
-        if self.__computeSecondOrder__ == False or n_vars<=2 :
-            N_tot = int(N*(2+n_vars))
-            self._experimentSample = ot.Sample(N_tot, n_modes)
-            self._experimentSample[:N,:] = self._sample_A[:,:]
-            print('Samples A and B of size {} and dimension {}'.format(
-                                                self._sample_A.getSize(),
-                                                self._sample_A.getDimension()))
-            self._experimentSample[N:2 * N,:] = self._sample_B[:,:]
-            jmp = 2 * N # As the first two blocks are sample A and B
-            jmpDim = 0
-            for i in range(n_vars):
-                self._experimentSample[jmp + N*i : jmp + N*(i+1), :] = self._sample_A[:, :]
-                self._experimentSample[jmp + N*i : jmp + N*(i+1),
-                             jmpDim : jmpDim+self.__mode_count__[i]] = self._sample_B[:, jmpDim : jmpDim + self.__mode_count__[i]]
-                jmpDim += self.__mode_count__[i]
-
-        elif self.__computeSecondOrder__ == True and n_vars>2 :
-            print('Generating samples for the second order indices')
-            # when cxomputing second order indices we add n_vars*size elements to
-            # the experiment sample.
-            # Here we mix columns of A into B
-            N_tot = int(N*(2+2*n_vars))
-            self._experimentSample = ot.Sample(N_tot, n_modes)
-            self._experimentSample[:N,:] = self._sample_A[:,:]
-            print('Samples A and B of size {} and dimension {}'.format(
-                                                self._sample_A.getSize(),
-                                                self._sample_A.getDimension()))
-            self._experimentSample[N:2 * N,:] = self._sample_B[:,:]
-            jmp = 2 * N # As the first two blocks are sample A and B
-            jmpDim = 0
-            for i in range(n_vars):
-                self._experimentSample[jmp + N*i : jmp + N*(i+1), :] = self._sample_A[:,:]
-                self._experimentSample[jmp + N*i : jmp + N*(i+1),
-                                       jmpDim : jmpDim+self.__mode_count__[i]] = \
-                        self._sample_B[: , jmpDim : jmpDim + self.__mode_count__[i]]
-                jmpDim += self.__mode_count__[i]
-            jmp = int(N*(2+n_vars))
-            jmpDim = 0
-            for i in range(n_vars):
-                self._experimentSample[jmp + N*i : jmp + N*(i+1), :] = self._sample_B[:,:]
-                self._experimentSample[jmp + N*i : jmp + N*(i+1),
-                  jmpDim:jmpDim+self.__mode_count__[i]] = \
-                        self._sample_A[:,jmpDim:jmpDim + self.__mode_count__[i]]
-                jmpDim += self.__mode_count__[i]
-            print('Experiment for second order generated')
-        print('Experiment of size {} and dimension {}'.format(
-                                                self._experimentSample.getSize(),
-                                                self._experimentSample.getDimension()))
+        if self.__groups__ is not None :
+            n_vars = len(self.__groups__)
+        design = self._buildVirtualDesign(sample_A, sample_B,
+                                    self.__computeSecondOrder__ == True and n_vars > 2)
+        if stream is not None :
+            design.generation = {key : stream[key] for key in
+                                 ('method', 'sequence', 'randomize', 'seed')}
+        else :
+            design.generation = {'method' : self.__method__, 'randomize' : self.__randomized__}
+        return design
+
+    def _buildVirtualDesign(self, sample_A, sample_B, second_order):
+        '''Returns the design of the layout of the experiment on the samples
+        '''
+        return VirtualSobolDesign(sample_A, sample_B, self.__mode_count__, second_order,
+                                  self.inputVarNamesKL, self.__groups__, self.__groupNames__)
+
+    def _getStreamSettings(self, **kwargs):
+        assert kwargs.get('seed') is not None, "A seed is needed for the streams"
+        settings = {'seed'      : int(kwargs['seed']),
+                    'method'    : kwargs.get('method', 'MonteCarlo'),
+                    'sequence'  : kwargs.get('sequence', 'Sobol'),
+                    'randomize' : bool(kwargs.get('randomize', False))}
+        assert settings['method'] in ('MonteCarlo', 'QMC'), \
+                "Only the 'MonteCarlo' and 'QMC' samples can be generated from streams"
+        assert settings['sequence'] in SEQUENCES, \
+                "The sequence can only be one of {}".format(list(SEQUENCES))
+        return settings
+
+    def _generateStreamRows(self, stream, start, stop):
+        """Returns the rows start to stop of A and B of the streams of the
+        given settings as numpy arrays, see generateRows
+        """
+        dimension = self.__AKLR__.getSizeModes()
+        if stream['method'] == 'MonteCarlo':
+            block = self.STREAM_BLOCK_SIZE
+            rows = [np.empty((0, 2 * dimension))]
+            for c in range(start // block, -(-stop // block)):
+                generator = np.random.Generator(np.random.Philox(
+                                np.random.SeedSequence(stream['seed'], spawn_key=(0, c))))
+                values = generator.standard_normal((block, 2 * dimension))
+                rows.append(values[max(start, c * block) - c * block :
+                                   min(stop, (c + 1) * block) - c * block])
+            values = np.vstack(rows)
+        else :
+            uniforms = self._generateStreamSequence(stream['sequence'], 2 * dimension,
+                                                    start, stop)
+            shift = None
+            if stream['randomize']:
+                generator = np.random.Generator(np.random.Philox(
+                                np.random.SeedSequence(stream['seed'], spawn_key=(1,))))
+                shift = generator.random(2 * dimension)
+            return self._splitUniforms(uniforms, shift)
+        return values[:, :dimension], values[:, dimension:]
+
+    def _generateStreamSequence(self, name, dimension, start, stop):
+        """Returns the points start to stop of the sequence, continuing the
+        kept sequence if it stopped at or before start
+        """
+        kept = self.__streamSequence__
+        if kept is None or kept['key'] != (name, dimension) or kept['position'] > start :
+            kept = {'key'      : (name, dimension),
+                    'sequence' : SEQUENCES[name](dimension),
+                    'position' : 0}
+            self.__streamSequence__ = kept
+        # the sequences of openturns cannot jump, the points in between are skipped
+        for skip in range(kept['position'], start, 65536):
+            kept['sequence'].generate(min(65536, start - skip))
+        kept['position'] = stop
+        if stop == start :
+            return np.empty((0, dimension))
+        return np.array(kept['sequence'].generate(stop - start))
+
+    def _generateSequenceRows(self, size):
+        """Returns the next size rows of A and B of the QMC samples, from the
+        sequence kept by the experiment
+        """
+        uniforms = np.array(self.__sequence__.generate(size))
+        return self._splitUniforms(uniforms, self.__shift__)
+
+    def _splitUniforms(self, uniforms, shift=None):
+        """Maps points of the unit hypercube of dimension 2 * modes, shifted
+        if a shift is given, to the rows of A (first half) and B (second half)
+        """
+        dimension = self.__AKLR__.getSizeModes()
+        if shift is not None :
+            uniforms = np.mod(uniforms + shift, 1.)
+        values = np.array(ot.DistFunc.qNormal(ot.Point(uniforms.reshape(-1)))).reshape(
+                                                                    uniforms.shape)
+        return values[:, :dimension], values[:, dimension:]
 
     def _generateSample(self, **kwargs):
         """Generation of two samples A and B using diverse methods
         """
+        self.__replicated__ = False
+        if kwargs.get('seed') is not None :
+            self.__stream__ = self._getStreamSettings(**kwargs)
+            self._sample_A, self._sample_B = [arrayToSample(rows) for rows in
+                                self._generateStreamRows(self.__stream__, 0, self.size)]
+            self.__method__ = self.__stream__['method']
+            self.__randomized__ = self.__stream__['randomize']
+            return None
+        self.__stream__ = None
         distribution = self.composedDistribution
         if 'method' in kwargs :
             method = kwargs['method']
@@ -224,30 +610,43 @@ class KarhunenLoeveSobolIndicesExperiment(ot.SobolIndicesExperiment):
                                              True)  # randomShift
             sample = lhsExp.generate()
         elif method == 'QMC':
-            restart = True
             if 'sequence' in kwargs:
-                if kwargs['sequence'] == 'Faure':
-                    seq = ot.FaureSequence
-                if kwargs['sequence'] == 'Halton':
-                    seq = ot.HaltonSequence
-                if kwargs['sequence'] == 'ReverseHalton':
-                    seq = ot.ReverseHaltonSequence
-                if kwargs['sequence'] == 'Haselgrove':
-                    seq = ot.HaselgroveSequence
-                if kwargs['sequence'] == 'Sobol':
-                    seq = ot.SobolSequence
+                assert kwargs['sequence'] in SEQUENCES, \
+                    "The sequence can only be one of {}".format(list(SEQUENCES))
+                seq = SEQUENCES[kwargs['sequence']]
             else:
                 print(
 'sequence undefined for low discrepancy experiment, default: SobolSequence')
                 print(
 "'sequence' arguments: 'Faure','Halton','ReverseHalton','Haselgrove','Sobol'")
                 seq = ot.SobolSequence
-            LDExperiment = ot.LowDiscrepancyExperiment(seq(),
-                                                       distribution,
-                                                       N2,
-                                                       True)
-            LDExperiment.setRandomize(False)
-            sample = LDExperiment.generate()
+            # A and B are the two halves of a sequence of twice the dimension,
+            # kept with its shift so that extend continues both
+            dimension = self.__AKLR__.getSizeModes()
+            self.__sequence__ = seq(2 * dimension)
+            self.__shift__ = None
+            if kwargs.get('randomize', False):
+                self.__shift__ = np.array(ot.RandomGenerator.Generate(2 * dimension))
+            self._sample_A, self._sample_B = [arrayToSample(rows) for rows in
+                                              self._generateSequenceRows(self.size)]
+            self.__method__ = method
+            self.__randomized__ = bool(kwargs.get('randomize', False))
+            return None
+        self.__method__ = method
+        self.__randomized__ = False
         sample = ot.Sample(sample)
         self._sample_A = sample[:self.size, :]
         self._sample_B = sample[self.size:, :]
+
+
+def _sliceOutput(output, start, stop):
+    """Returns the rows start to stop of an output of the function wrapper
+    """
+    if isinstance(output, ot.ProcessSample):
+        sliced = ot.ProcessSample(output.getMesh(), 0, output.getDimension())
+        for j in range(start, stop):
+            sliced.add(output[j])
+    else :
+        sliced = output[start:stop]
+    sliced.setName(output.getName())
+    return sliced
@@ -0,0 +1,312 @@
+__author__ = 'Kristof Attila S.'
+__version__ = '0.1'
+__date__  = '19.10.26'
+
+__all__ = ['FieldOutputCompressor', 'CompressedProcessSample']
+
+import itertools
+import numpy as np
+import openturns as ot
+try :
+    from ._aggregatedKarhunenLoeveResults import processSampleFromArray
+except ImportError :
+    from _aggregatedKarhunenLoeveResults import processSampleFromArray
+
+
+class FieldOutputCompressor(object):
+    '''Incremental PCA of the field outputs of a batch evaluation.
+
+    The first chunk of fields compressed fixes the mean and the scale of the
+    output, and the basis is learned on it. Each following chunk is projected
+    on the basis, and the basis is extended with the principal directions of
+    the residuals of the rows that are not represented within the tolerance.
+    The new directions are orthogonal to the previous ones, so the
+    coefficients of the chunks already compressed stay valid : they are only
+    completed with zeros.
+
+    Parameters
+    ----------
+    tolerance : float
+        maximal L2 norm of the reconstruction error of a field, relative to
+        the root mean square norm of the centered fields of the first chunk
+    max_modes : int, optional
+        maximal size of the basis. Once reached, the rows are still
+        compressed, with an error bound above the tolerance.
+
+    Note
+    ----
+    The rows with non finite values (failed rows filled with nan) and the
+    masked rows are not used to learn the basis. The rows with non finite
+    values get nan coefficients and errors.
+    '''
+    __ids__ = itertools.count()
+
+    def __init__(self, tolerance=1e-3, max_modes=None):
+        assert tolerance >= 0, "The tolerance can only be positive"
+        self.tolerance = float(tolerance)
+        self.max_modes = int(max_modes) if max_modes is not None else None
+        self.reset()
+
+    def __repr__(self):
+        return ', '.join(['FieldOutputCompressor',
+                          'tolerance : {}'.format(self.tolerance),
+                          'modes : {}'.format(self.getModesNumber())])
+
+    def reset(self):
+        '''Forgets the mean and the basis
+        '''
+        self.__id__ = next(FieldOutputCompressor.__ids__)
+        self.__mean__ = None
+        self.__basis__ = None
+        self.__threshold__ = None
+
+    def getModesNumber(self):
+        '''Returns the current size of the basis
+        '''
+        return 0 if self.__basis__ is None else self.__basis__.shape[0]
+
+    def getBasis(self):
+        '''Returns the basis as an array of shape (modes, vertices * dimension)
+        '''
+        return self.__basis__
+
+    def getMean(self):
+        '''Returns the mean of the first chunk, of shape (vertices * dimension,)
+        '''
+        return self.__mean__
+
+    def compress(self, processSample, mask=None):
+        '''Compresses a sample of fields, refining the basis if needed
+
+        Arguments
+        ---------
+        processSample : ot.ProcessSample
+        mask : numpy.ndarray of bool, optional
+            rows not to learn the basis from
+
+        Returns
+        -------
+        compressed : CompressedProcessSample
+        '''
+        values = np.array(processSample, dtype=float)
+        size = values.shape[0]
+        values = values.reshape(size, -1)
+        valid = np.isfinite(values).all(axis=1)
+        learn = valid if mask is None else valid & ~np.asarray(mask, dtype=bool)
+        if self.__mean__ is None :
+            self._initialize(values[learn] if learn.any() else values[valid])
+        centered = np.where(valid[:, None], values - self.__mean__, 0.)
+        self._refine(centered[learn])
+        coefficients = centered @ self.__basis__.T
+        residual = centered - coefficients @ self.__basis__
+        errors = np.sqrt(np.sum(residual**2, axis=1))
+        coefficients[~valid] = np.nan
+        errors[~valid] = np.nan
+        compressed = CompressedProcessSample(processSample.getMesh(),
+                    processSample.getDimension(), self.__mean__, self.__basis__,
+                    coefficients, errors, self.__id__)
+        compressed.setName(processSample.getName())
+        return compressed
+
+    def _initialize(self, values):
+        dimension = values.shape[1]
+        if values.shape[0] == 0 :
+            self.__mean__ = np.zeros(dimension)
+            scale = 0.
+        else :
+            self.__mean__ = values.mean(axis=0)
+            scale = np.sqrt(np.mean(np.sum((values - self.__mean__)**2, axis=1)))
+        self.__threshold__ = self.tolerance * scale
+        self.__basis__ = np.zeros((0, dimension))
+
+    def _refine(self, centered):
+        '''Adds to the basis the fewest principal directions of the residuals
+        bringing all the rows within the threshold
+        '''
+        room = np.inf if self.max_modes is None else self.max_modes - self.getModesNumber()
+        if centered.shape[0] == 0 or room <= 0 :
+            return None
+        residual = centered - (centered @ self.__basis__.T) @ self.__basis__
+        errors = np.sum(residual**2, axis=1)
+        bad = errors > self.__threshold__**2
+        if not bad.any():
+            return None
+        U, S, Vt = np.linalg.svd(residual[bad], full_matrices=False)
+        Vt = Vt[S > 0]
+        if Vt.shape[0] == 0 :
+            return None
+        projections = (residual[bad] @ Vt.T)**2
+        remaining = errors[bad][:, None] - np.cumsum(projections, axis=1)
+        fits = np.nonzero(remaining.max(axis=0) <= self.__threshold__**2)[0]
+        nModes = fits[0] + 1 if len(fits) > 0 else Vt.shape[0]
+        nModes = int(min(nModes, room))
+        # one more orthogonalization against the basis, lost to rounding
+        modes = Vt[:nModes] - (Vt[:nModes] @ self.__basis__.T) @ self.__basis__
+        modes, _ = np.linalg.qr(modes.T)
+        self.__basis__ = np.vstack([self.__basis__, modes.T])
+
+
+class CompressedProcessSample(object):
+    '''Sample of fields stored as their coefficients on a PCA basis, with the
+    L2 norm of the reconstruction error of each field. The fields are only
+    rebuilt when they are accessed.
+
+    It behaves as a read-only ot.ProcessSample : getSize, getMesh,
+    getDimension, indexing (an ot.Field for an integer, a
+    CompressedProcessSample for a slice or an array of rows), computeMean,
+    and numpy.array of shape (size, vertices, dimension).
+
+    Parameters
+    ----------
+    mesh : ot.Mesh
+    dimension : int
+        dimension of the values of the fields
+    mean : numpy.ndarray
+        of shape (vertices * dimension,)
+    basis : numpy.ndarray
+        of shape (modes, vertices * dimension), orthonormal rows
+    coefficients : numpy.ndarray
+        of shape (size, modes)
+    errors : numpy.ndarray
+        of shape (size,), the norm of the reconstruction error of each field
+    lineage : int, optional
+        identifies the compressor the basis comes from. The bases of the same
+        lineage extend one another.
+    '''
+    def __init__(self, mesh, dimension, mean, basis, coefficients, errors, lineage=None):
+        self.mesh = mesh
+        self.dimension = int(dimension)
+        self.mean = mean
+        self.basis = basis
+        self.coefficients = np.asarray(coefficients, dtype=float)
+        self.errors = np.asarray(errors, dtype=float)
+        self.lineage = lineage
+        self.__name__ = 'Unnamed'
+
+    def __repr__(self):
+        return ', '.join(['CompressedProcessSample',
+                          'size : {}'.format(self.getSize()),
+                          'modes : {}'.format(self.coefficients.shape[1]),
+                          'error bound : {:.4g}'.format(self.getErrorBound()),
+                          'compression ratio : {:.4g}'.format(self.getCompressionRatio())])
+
+    def __len__(self):
+        return self.getSize()
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (slice, list, np.ndarray)):
+            return self._subset(idx)
+        idx = range(self.getSize())[idx]
+        return ot.Field(self.mesh, self._reconstruct(self.coefficients[idx:idx+1])[0])
+
+    def __iter__(self):
+        for j in range(self.getSize()):
+            yield self[j]
+
+    def __array__(self, dtype=None, copy=None):
+        values = self._reconstruct(self.coefficients)
+        return values if dtype is None else values.astype(dtype)
+
+    @property
+    def nbytes(self):
+        return int(self.coefficients.nbytes + self.errors.nbytes)
+
+    def getName(self):
+        return self.__name__
+
+    def setName(self, name):
+        self.__name__ = name
+
+    def getClassName(self):
+        return self.__class__.__name__
+
+    def getSize(self):
+        return self.coefficients.shape[0]
+
+    def getMesh(self):
+        return self.mesh
+
+    def getDimension(self):
+        return self.dimension
+
+    def getCoefficients(self):
+        '''Returns the coefficients of the fields, of shape (size, modes)
+        '''
+        return self.coefficients
+
+    def getErrors(self):
+        '''Returns the L2 norm of the reconstruction error of each field
+        '''
+        return self.errors
+
+    def getErrorBound(self):
+        '''Returns the largest reconstruction error of the fields
+        '''
+        if self.getSize() == 0 or np.isnan(self.errors).all():
+            return 0.
+        return float(np.nanmax(self.errors))
+
+    def getCompressionRatio(self):
+        '''Returns the ratio of the bytes of the full fields to the bytes of
+        the coefficients and errors
+        '''
+        full = 8 * self.getSize() * self.mean.shape[0]
+        return full / max(self.nbytes, 1)
+
+    def computeMean(self):
+        '''Returns the mean field, computed from the coefficients
+        '''
+        return ot.Field(self.mesh, self._reconstruct(
+                                np.nanmean(self.coefficients, axis=0)[None, :])[0])
+
+    def asProcessSample(self):
+        '''Returns the rebuilt fields as an ot.ProcessSample
+        '''
+        processSample = processSampleFromArray(self.mesh, np.array(self), self.dimension)
+        processSample.setName(self.__name__)
+        return processSample
+
+    def asSample(self):
+        '''Returns the rebuilt fields flattened into an ot.Sample of dimension
+        vertices * dimension, as used by the sensitivity algorithms
+        '''
+        return ot.Sample(self._reconstruct(self.coefficients).reshape(self.getSize(), -1))
+
+    def _reconstruct(self, coefficients):
+        values = self.mean + coefficients @ self.basis[:coefficients.shape[1]]
+        return values.reshape(coefficients.shape[0], -1, self.dimension)
+
+    def _subset(self, rows):
+        subset = CompressedProcessSample(self.mesh, self.dimension, self.mean,
+                                         self.basis, self.coefficients[rows],
+                                         self.errors[rows], self.lineage)
+        subset.setName(self.__name__)
+        return subset
+
+    @staticmethod
+    def concatenate(samples):
+        '''Concatenates compressed samples of the same compressor, completing
+        the coefficients of the samples compressed on a smaller basis with
+        zeros. The samples of different compressors are rebuilt and
+        concatenated as an ot.ProcessSample.
+        '''
+        first = samples[0]
+        if not all(sample.lineage is not None and sample.lineage == first.lineage
+                                                            for sample in samples):
+            processSample = ot.ProcessSample(first.getMesh(), 0, first.getDimension())
+            for sample in samples :
+                for j in range(sample.getSize()):
+                    processSample.add(sample[j])
+            processSample.setName(first.getName())
+            return processSample
+        largest = max(samples, key=lambda sample : sample.basis.shape[0])
+        nModes = largest.basis.shape[0]
+        coefficients = np.vstack([np.pad(sample.coefficients,
+                        ((0, 0), (0, nModes - sample.coefficients.shape[1])))
+                        for sample in samples])
+        concatenated = CompressedProcessSample(first.mesh, first.dimension,
+                        first.mean, largest.basis, coefficients,
+                        np.concatenate([sample.errors for sample in samples]),
+                        first.lineage)
+        concatenated.setName(first.getName())
+        return concatenated
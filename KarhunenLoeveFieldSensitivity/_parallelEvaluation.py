@@ -0,0 +1,285 @@
+__author__ = 'Kristof Attila S.'
+__version__ = '0.1'
+__date__  = '19.10.26'
+
+__all__ = ['ParallelEvaluator']
+
+import os
+import queue
+import signal
+import time
+import itertools
+import multiprocessing
+from concurrent import futures
+from numbers import Integral
+import numpy as np
+
+# queue of the start signals of the tasks, in the worker processes
+_started = None
+
+
+def _registerWorker(workers, started):
+    ## Initializer of the worker processes, so that they can be terminated
+    ## and signal the start of their tasks
+    global _started
+    _started = started
+    workers.put(os.getpid())
+
+
+def _runTask(started, token, function, *args):
+    ## Signals to the evaluator that a worker took the task, then runs it.
+    ## time.monotonic is a system-wide clock, shared with the evaluator.
+    (started if started is not None else _started).put((token, time.monotonic()))
+    return function(*args)
+
+
+class ParallelEvaluator(object):
+    '''Executor of the chunks of a batch evaluation on a pool of workers.
+
+    The chunks are submitted to the pool as workers become free, and their
+    results are yielded as soon as they are finished, in the order in which
+    they finish. Two mechanisms keep a few slow realizations from holding up
+    the whole batch :
+
+    - a chunk running for longer than timeout seconds is abandoned, and a
+      TimeoutError is yielded in place of its result
+    - once no chunk is left to submit, a chunk running for longer than
+      straggler_factor times the median duration of the finished chunks is
+      submitted a second time on a free worker, and the first of the two
+      copies to finish is kept
+
+    Parameters
+    ----------
+    max_workers : int
+        number of chunks evaluated at the same time
+    kind : str
+        'thread' or 'process'. With processes, the function and the lifted
+        inputs have to be picklable.
+    chunk_size : int
+        number of rows per chunk
+    timeout : float, optional
+        time in seconds after which a chunk is abandoned
+    speculative : bool
+        if True, the stragglers are executed a second time
+    straggler_factor : float
+        ratio to the median duration above which a chunk is a straggler
+    min_finished : int
+        number of finished chunks needed before detecting stragglers
+
+    Note
+    ----
+    A running task can not be interrupted by the pool : an abandoned chunk
+    keeps its worker until it returns. The abandoned chunks still running
+    are counted among the max_workers chunks evaluated at the same time, so
+    no chunk is submitted to wait for their workers. The timeout and the
+    durations count from the moment a worker takes the task, signalled by
+    the worker itself, not from its submission. With processes, the workers
+    are terminated at the end of the iteration if an abandoned chunk is
+    still running.
+    '''
+    POLL_TIME = 0.05
+
+    def __init__(self, max_workers=4, kind='thread', chunk_size=100,
+                 timeout=None, speculative=True, straggler_factor=3.,
+                 min_finished=3):
+        assert kind in ('thread', 'process'), \
+            "The kind of pool can only be 'thread' or 'process'"
+        assert isinstance(chunk_size, Integral) and chunk_size > 0, \
+            "Chunk size can only be positive integer"
+        self.max_workers = int(max_workers)
+        self.kind = kind
+        self.chunk_size = int(chunk_size)
+        self.timeout = timeout
+        self.speculative = speculative
+        self.straggler_factor = float(straggler_factor)
+        self.min_finished = int(min_finished)
+        self.__statistics__ = dict()
+        self.__workers__ = None
+        self.__started__ = None
+        self.__tokens__ = itertools.count()
+
+    def __repr__(self):
+        return ', '.join(['ParallelEvaluator',
+                          'kind : {}'.format(self.kind),
+                          'max workers : {}'.format(self.max_workers),
+                          'chunk size : {}'.format(self.chunk_size),
+                          'timeout : {}'.format(self.timeout)])
+
+    def getChunkSize(self):
+        '''Returns the number of rows per chunk
+        '''
+        return self.chunk_size
+
+    def getStatistics(self):
+        '''Returns the counters of the last iteration
+
+        Returns
+        -------
+        statistics : dict
+            tasks, speculative (copies submitted), speculative_wins (copies
+            finished first), timeouts, and durations of the finished tasks
+        '''
+        return self.__statistics__
+
+    def iterate(self, function, n_tasks, getArguments):
+        '''Evaluates function on the arguments of each task in the pool.
+
+        Arguments
+        ---------
+        function : callable
+            called as function(*getArguments(idx))
+        n_tasks : int
+            number of tasks
+        getArguments : callable
+            getArguments(idx) returns the tuple of arguments of the task idx.
+            It is called when the task is submitted, so that the arguments of
+            all the tasks do not have to be in memory at once.
+
+        Yields
+        ------
+        idx : int
+            index of the task
+        result : object
+            result of the function, or the exception it raised, or a
+            TimeoutError if the task was abandoned
+        '''
+        stats = {'tasks' : n_tasks, 'speculative' : 0, 'speculative_wins' : 0,
+                 'timeouts' : 0, 'durations' : []}
+        self.__statistics__ = stats
+        pending = list(range(n_tasks))[::-1]
+        running = dict()   # future -> (idx, start time or None until it runs, is a copy)
+        arguments = dict() # idx -> arguments, while the task is running
+        tokens = dict()    # token of the start signal -> future
+        finished = set()
+        abandoned = list() # futures dropped while running
+        executor = self._buildExecutor()
+        try :
+            while len(finished) < n_tasks :
+                while len(pending) > 0 and \
+                        len(running) + self._countBusy(abandoned) < self.max_workers :
+                    idx = pending.pop()
+                    arguments[idx] = getArguments(idx)
+                    running[self._submit(executor, function, arguments[idx], tokens)] = \
+                                            (idx, None, False)
+                self._markStarted(running, tokens)
+                if len(pending) == 0 and self.speculative :
+                    self._submitCopies(executor, function, running, arguments, stats,
+                                       tokens, self._countBusy(abandoned))
+                done, _ = futures.wait(list(running), timeout=self.POLL_TIME,
+                                       return_when=futures.FIRST_COMPLETED)
+                # the tasks finished signalled their start before running
+                self._markStarted(running, tokens)
+                now = time.monotonic()
+                for future in done :
+                    idx, start, isCopy = running.pop(future)
+                    if idx in finished :
+                        continue
+                    finished.add(idx)
+                    arguments.pop(idx, None)
+                    stats['durations'].append(now - (start if start is not None else now))
+                    stats['speculative_wins'] += int(isCopy)
+                    abandoned.extend(self._dropTask(running, idx))
+                    try :
+                        result = future.result()
+                    except Exception as e :
+                        result = e
+                    yield idx, result
+                if self.timeout is not None :
+                    for future, (idx, start, isCopy) in list(running.items()):
+                        if idx in finished or start is None or now - start < self.timeout :
+                            continue
+                        finished.add(idx)
+                        arguments.pop(idx, None)
+                        stats['timeouts'] += 1
+                        abandoned.extend(self._dropTask(running, idx))
+                        yield idx, TimeoutError(
+                            'Task {} did not finish in {} seconds'.format(idx, self.timeout))
+        finally :
+            self._shutdown(executor, abandoned)
+
+    def _buildExecutor(self):
+        if self.kind == 'thread' :
+            self.__started__ = queue.Queue()
+            return futures.ThreadPoolExecutor(self.max_workers)
+        # the workers give their pid, to be terminated with the abandoned tasks
+        self.__workers__ = multiprocessing.SimpleQueue()
+        self.__started__ = multiprocessing.SimpleQueue()
+        return futures.ProcessPoolExecutor(self.max_workers, initializer=_registerWorker,
+                                           initargs=(self.__workers__, self.__started__))
+
+    def _submit(self, executor, function, arguments, tokens):
+        '''Submits a task whose worker signals the start, and returns its future
+        '''
+        token = next(self.__tokens__)
+        # the queue of the processes is passed by their initializer
+        started = self.__started__ if self.kind == 'thread' else None
+        future = executor.submit(_runTask, started, token, function, *arguments)
+        tokens[token] = future
+        return future
+
+    def _markStarted(self, running, tokens):
+        '''Sets the start time of the tasks whose worker signalled the start
+        '''
+        started = self.__started__
+        while not started.empty():
+            token, start = started.get()
+            future = tokens.pop(token, None)
+            if future in running :
+                idx, _, isCopy = running[future]
+                running[future] = (idx, start, isCopy)
+
+    @staticmethod
+    def _countBusy(abandoned):
+        '''Returns the number of abandoned tasks still holding a worker
+        '''
+        return sum(not future.done() for future in abandoned)
+
+    def _submitCopies(self, executor, function, running, arguments, stats, tokens, busy=0):
+        '''Submits a copy of the stragglers on the free workers
+        '''
+        durations = stats['durations']
+        if len(durations) < self.min_finished :
+            return None
+        threshold = self.straggler_factor * np.median(durations)
+        now = time.monotonic()
+        copied = [idx for idx, start, isCopy in running.values() if isCopy]
+        started = [task for task in running.values() if task[1] is not None]
+        for idx, start, isCopy in sorted(started, key=lambda task : task[1]):
+            if len(running) + busy >= self.max_workers :
+                break
+            if now - start > threshold and idx not in copied :
+                running[self._submit(executor, function, arguments[idx], tokens)] = \
+                                            (idx, None, True)
+                copied.append(idx)
+                stats['speculative'] += 1
+
+    def _dropTask(self, running, idx):
+        '''Stops tracking all the copies of a task. The copies that did not
+        start yet are cancelled, the others are left to finish on their own and
+        are returned.
+        '''
+        left = list()
+        for future, task in list(running.items()):
+            if task[0] == idx :
+                if not future.cancel():
+                    left.append(future)
+                del running[future]
+        return left
+
+    def _shutdown(self, executor, abandoned=()):
+        executor.shutdown(wait=False, cancel_futures=True)
+        started, self.__started__ = self.__started__, None
+        if self.kind != 'process' :
+            return None
+        started.close()
+        busy = any(not future.done() for future in abandoned)
+        while not self.__workers__.empty():
+            pid = self.__workers__.get()
+            if busy :
+                # the abandoned tasks would otherwise keep their process alive
+                try :
+                    os.kill(pid, signal.SIGTERM)
+                except OSError :
+                    pass
+        self.__workers__.close()
+        self.__workers__ = None
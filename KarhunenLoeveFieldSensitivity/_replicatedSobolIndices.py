@@ -0,0 +1,222 @@
+__author__ = 'Kristof Attila S.'
+__version__ = '0.1'
+__date__  = '19.10.26'
+
+__all__ = ['ReplicatedSobolSensitivityAlgorithm']
+
+import numpy as np
+import openturns as ot
+try :
+    from ._sobolIndicesFactory import SobolKarhunenLoeveFieldSensitivityAlgorithm
+except ImportError :
+    from _sobolIndicesFactory import SobolKarhunenLoeveFieldSensitivityAlgorithm
+
+
+class ReplicatedSobolSensitivityAlgorithm(object):
+    '''Sobol' indices estimated on R independent replicates of a design, with
+    confidence intervals computed from the spread of the replicates.
+
+    The replicates are typically randomized QMC designs (see
+    KarhunenLoeveSobolIndicesExperiment.generateReplicates) : the indices of
+    each replicate converge at the QMC rate, and as the replicates are
+    independent, the mean of the R estimates has a standard error estimated
+    by s / sqrt(R). The intervals are mean +/- t_{R-1} s / sqrt(R), with t the
+    quantile of the Student distribution. No bootstrap is needed.
+
+    Parameters
+    ----------
+    inputDesigns : list of ot.Sample or VirtualSobolDesign
+        the R designs
+    outputDesigns : list of lists
+        for each design, the outputs of the function wrapper
+    N : int
+        size of the samples A and B of each design, only needed for the
+        designs given as ot.Sample
+    estimator : openturns sensitivity algorithm
+        the estimator used on each replicate
+    confidenceLevel : float
+        level of the confidence intervals
+    '''
+    def __init__(self, inputDesigns=None, outputDesigns=None, N=0,
+                 estimator=ot.SaltelliSensitivityAlgorithm(), confidenceLevel=0.95):
+        self.N = int(N)
+        self.estimator = estimator
+        self.ConfidenceLevel = confidenceLevel
+        self.inputDesigns = list()
+        self.outputDesigns = list()
+        self.__indices__ = dict()
+        self.__templates__ = dict()
+        self.__name__ = 'Unnamed'
+        if inputDesigns is not None and outputDesigns is not None :
+            self.setDesigns(inputDesigns, outputDesigns, N)
+
+    def __repr__(self):
+        return ', '.join(['ReplicatedSobolSensitivityAlgorithm',
+                          'with estimator : {}'.format(self.estimator.__class__.__name__),
+                          'replicates : {}'.format(self.getReplicatesNumber()),
+                          'confidence level : {}'.format(self.ConfidenceLevel)])
+
+    def getClassName(self):
+        return self.__class__.__name__
+
+    def getName(self):
+        return self.__name__
+
+    def setName(self, name):
+        self.__name__ = name
+
+    def getConfidenceLevel(self):
+        return self.ConfidenceLevel
+
+    def setConfidenceLevel(self, confidenceLevel):
+        assert 0 < confidenceLevel < 1, "The confidence level must be in ]0, 1["
+        self.ConfidenceLevel = confidenceLevel
+
+    def setEstimator(self, estimator):
+        self.estimator = estimator
+        self.__indices__.clear()
+
+    def getReplicatesNumber(self):
+        return len(self.inputDesigns)
+
+    def setDesigns(self, inputDesigns, outputDesigns, N=0):
+        '''Sets the replicates
+
+        Arguments
+        ---------
+        inputDesigns : list of ot.Sample or VirtualSobolDesign
+        outputDesigns : list of lists
+            for each design, the list of ot.Sample and ot.ProcessSample
+            returned by the function wrapper
+        N : int
+            size of the samples A and B, for the designs given as ot.Sample
+        '''
+        assert len(inputDesigns) == len(outputDesigns), \
+            "Give the outputs of each input design"
+        assert len(inputDesigns) > 1, "At least two replicates are needed"
+        self.inputDesigns = list(inputDesigns)
+        self.N = int(N)
+        self.outputDesigns = [list(outputs) if isinstance(outputs, (list, tuple))
+                              else [outputs] for outputs in outputDesigns]
+        self.__indices__.clear()
+
+    def getFirstOrderIndices(self):
+        '''Returns the mean over the replicates of the first order indices, in
+        the format of SobolKarhunenLoeveFieldSensitivityAlgorithm
+        '''
+        return self._formatIndices('FirstOrder', [replicates.mean(axis=0)
+                            for replicates in self._getReplicates('FirstOrder')])
+
+    def getTotalOrderIndices(self):
+        '''Returns the mean over the replicates of the total order indices
+        '''
+        return self._formatIndices('TotalOrder', [replicates.mean(axis=0)
+                            for replicates in self._getReplicates('TotalOrder')])
+
+    def getFirstOrderIndicesReplicates(self):
+        '''Returns the first order indices of each replicate
+
+        Returns
+        -------
+        FO_indices : list of numpy.ndarray
+            for each output, an array of shape (replicates, variables, marginals)
+        '''
+        return self._getReplicates('FirstOrder')
+
+    def getTotalOrderIndicesReplicates(self):
+        '''Returns the total order indices of each replicate, see
+        getFirstOrderIndicesReplicates
+        '''
+        return self._getReplicates('TotalOrder')
+
+    def getFirstOrderIndicesStandardError(self):
+        '''Returns the standard error s / sqrt(R) of the mean first order
+        indices, in the format of getFirstOrderIndices
+        '''
+        return self._formatIndices('FirstOrder', self._getStandardError('FirstOrder'))
+
+    def getTotalOrderIndicesStandardError(self):
+        '''Returns the standard error of the mean total order indices
+        '''
+        return self._formatIndices('TotalOrder', self._getStandardError('TotalOrder'))
+
+    def getFirstOrderIndicesInterval(self):
+        '''Returns the confidence intervals of the mean first order indices
+
+        Returns
+        -------
+        FO_indices_interval : list
+            for each output, the interval of each variable, as ot.Interval
+            for the scalar outputs and as a tuple of the lower and upper
+            bound ot.Field for the field outputs
+        '''
+        return self._getInterval('FirstOrder', 'Bounds_Sobol_')
+
+    def getTotalOrderIndicesInterval(self):
+        '''Returns the confidence intervals of the mean total order indices,
+        see getFirstOrderIndicesInterval
+        '''
+        return self._getInterval('TotalOrder', 'BoundsTotalOrderSobol_')
+
+    def _solve(self):
+        assert self.getReplicatesNumber() > 1, "Set the designs of the replicates first"
+        indices = {'FirstOrder' : [], 'TotalOrder' : []}
+        for inputDesign, outputDesign in zip(self.inputDesigns, self.outputDesigns):
+            algorithm = SobolKarhunenLoeveFieldSensitivityAlgorithm(
+                                        estimator=self.estimator.__class__())
+            algorithm.setDesign(inputDesign, outputDesign, self.N)
+            for kind, result in (('FirstOrder', algorithm.getFirstOrderIndices()),
+                                 ('TotalOrder', algorithm.getTotalOrderIndices())):
+                self.__templates__[kind] = result
+                indices[kind].append([np.array([np.array(element).reshape(-1)
+                                        for element in output]) for output in result])
+        # for each output, an array (replicates, variables, marginals)
+        for kind in indices :
+            self.__indices__[kind] = [np.array(values) for values in zip(*indices[kind])]
+
+    def _getReplicates(self, kind):
+        if kind not in self.__indices__ :
+            self._solve()
+        return self.__indices__[kind]
+
+    def _getStandardError(self, kind):
+        return [replicates.std(axis=0, ddof=1) / np.sqrt(replicates.shape[0])
+                for replicates in self._getReplicates(kind)]
+
+    def _getInterval(self, kind, prefix):
+        quantile = ot.Student(self.getReplicatesNumber() - 1).computeQuantile(
+                                        (1 + self.ConfidenceLevel) / 2)[0]
+        # solves the replicates before the templates are read
+        allReplicates = self._getReplicates(kind)
+        intervals = []
+        for template, replicates, error in zip(self.__templates__[kind],
+                        allReplicates, self._getStandardError(kind)):
+            perVariable = []
+            for element, center, halfWidth in zip(template, replicates.mean(axis=0),
+                                                  quantile * error):
+                lower, upper = center - halfWidth, center + halfWidth
+                name = prefix + element.getName().split('Sobol_', 1)[-1]
+                if isinstance(element, ot.Field):
+                    bounds = (ot.Field(element.getMesh(), lower.reshape(-1, 1)),
+                              ot.Field(element.getMesh(), upper.reshape(-1, 1)))
+                    [bound.setName(name) for bound in bounds]
+                else :
+                    bounds = ot.Interval(lower, upper)
+                    bounds.setName(name)
+                perVariable.append(bounds)
+            intervals.append(perVariable)
+        return intervals
+
+    def _formatIndices(self, kind, values):
+        formatted = []
+        for template, output in zip(self.__templates__[kind], values):
+            perVariable = []
+            for element, value in zip(template, output):
+                if isinstance(element, ot.Field):
+                    index = ot.Field(element.getMesh(), value.reshape(-1, 1))
+                else :
+                    index = ot.Point(value)
+                index.setName(element.getName())
+                perVariable.append(index)
+            formatted.append(perVariable)
+        return formatted
@@ -0,0 +1,154 @@
+__author__ = 'Kristof Attila S.'
+__version__ = '0.1'
+__date__  = '19.10.26'
+
+__all__ = ['SobolDesignMetadata', 'getSobolDesignMetadata']
+
+import json
+
+
+class SobolDesignMetadata(object):
+    '''Description of the structure of a Sobol design : its layout, the size N
+    of the samples A and B, the blocks, the modes and groups of the variables,
+    the second order flag and how the samples were generated.
+
+    It is returned by the experiments with the designs they generate (see
+    generateWithMetadata, getMetadata of the experiment and of the
+    VirtualSobolDesign), so that the consistency of a design and of its
+    outputs can be checked without looking at the values. An ot.Sample
+    carries no metadata, it is passed along with the sample.
+
+    Parameters
+    ----------
+    layout : str
+        'Saltelli' (blocks A, B, A_B^i), 'Radial' (rows by base point) or
+        'WindingStairs' (a single chain)
+    size : int
+        N, the number of rows of A and B, of base points, or of stairs
+    mode_count : list of int
+        number of modes of each variable
+    groups : list of lists of int
+        variables of each group, one index per group
+    group_names : list of str
+    second_order : bool
+        True if the blocks of the second order indices are in the design
+    method, sequence, randomize, seed : optional
+        generation of the samples, see KarhunenLoeveSobolIndicesExperiment
+    '''
+    LAYOUTS = ('Saltelli', 'Radial', 'WindingStairs')
+
+    def __init__(self, layout, size, mode_count, groups, group_names,
+                 second_order=False, method=None, sequence=None, randomize=False,
+                 seed=None):
+        assert layout in self.LAYOUTS, \
+            "The layout can only be one of {}".format(self.LAYOUTS)
+        self.layout = layout
+        self.size = int(size)
+        self.mode_count = [int(count) for count in mode_count]
+        self.groups = [[int(i) for i in group] for group in groups]
+        self.group_names = list(group_names)
+        self.second_order = bool(second_order)
+        self.method = method
+        self.sequence = sequence
+        self.randomize = bool(randomize)
+        self.seed = seed
+
+    def __repr__(self):
+        return ', '.join(['SobolDesignMetadata',
+                          'layout : {}'.format(self.layout),
+                          'N : {}'.format(self.size),
+                          'rows : {}'.format(self.getDesignSize()),
+                          'indices : {}'.format(self.group_names),
+                          'second order : {}'.format(self.second_order),
+                          'seed : {}'.format(self.seed)])
+
+    def __eq__(self, other):
+        return isinstance(other, SobolDesignMetadata) and self.asDict() == other.asDict()
+
+    def getClassName(self):
+        return self.__class__.__name__
+
+    def getIndicesNumber(self):
+        '''Returns the number of indices, one per group of variables
+        '''
+        return len(self.groups)
+
+    def getDimension(self):
+        '''Returns the number of modes, the columns of the design
+        '''
+        return sum(self.mode_count)
+
+    def getBlocksNumber(self):
+        '''Returns the number of rows per base point : 2 + d or 2 + 2d for the
+        Saltelli and radial layouts, d for the winding stairs
+        '''
+        d = self.getIndicesNumber()
+        if self.layout == 'WindingStairs':
+            return d
+        return 2 + d * (2 if self.second_order else 1)
+
+    def getDesignSize(self):
+        '''Returns the number of rows of the design
+        '''
+        if self.layout == 'WindingStairs':
+            return self.size * self.getIndicesNumber() + 1
+        return self.size * self.getBlocksNumber()
+
+    def check(self, design=None, outputSize=None, N=None, secondOrder=None):
+        '''Checks that a design, the size of its outputs, the size N and the
+        second order flag given to an algorithm agree with the metadata,
+        without looking at the values. Raises an AssertionError otherwise.
+        '''
+        designSize = self.getDesignSize()
+        if design is not None :
+            assert len(design) == designSize, \
+                "The design has {} rows instead of the {} of its {} layout".format(
+                                                len(design), designSize, self.layout)
+            assert design.getDimension() == self.getDimension(), \
+                "The design has {} columns instead of {} modes".format(
+                                        design.getDimension(), self.getDimension())
+        if outputSize is not None :
+            assert outputSize == designSize, \
+                "The outputs have {} rows, the design {}".format(outputSize, designSize)
+        if N is not None and N != 0 :
+            assert N == self.size, \
+                "N is {}, the design was generated with N = {}".format(N, self.size)
+        if secondOrder is not None :
+            assert bool(secondOrder) == self.second_order, \
+                "The second order flag is {}, the design was generated with {}".format(
+                                                        secondOrder, self.second_order)
+        return True
+
+    def asDict(self):
+        return {'layout'       : self.layout,
+                'size'         : self.size,
+                'mode_count'   : self.mode_count,
+                'groups'       : self.groups,
+                'group_names'  : self.group_names,
+                'second_order' : self.second_order,
+                'method'       : self.method,
+                'sequence'     : self.sequence,
+                'randomize'    : self.randomize,
+                'seed'         : self.seed}
+
+    def toJSON(self):
+        return json.dumps(self.asDict())
+
+    @classmethod
+    def fromJSON(cls, text):
+        return cls(**json.loads(text))
+
+
+def getSobolDesignMetadata(design):
+    '''Returns the SobolDesignMetadata of a design, or None if it has none,
+    as an ot.Sample
+
+    Arguments
+    ---------
+    design : ot.Sample, VirtualSobolDesign or SobolDesignMetadata
+    '''
+    if isinstance(design, SobolDesignMetadata):
+        return design
+    if hasattr(design, 'getMetadata'):
+        return design.getMetadata()
+    return None
@@ -1,13 +1,25 @@
+import numpy as np
 import openturns as ot
 from collections import Iterable, UserList, Sequence
 from copy import copy, deepcopy
 from numbers import Complex, Integral, Real, Rational, Number
 from math import isnan
 import re
+try :
+    from ._outputCompression import CompressedProcessSample
+    from ._virtualSobolDesign import VirtualSobolDesign
+    from ._sobolDesignMetadata import getSobolDesignMetadata
+except ImportError :
+    from _outputCompression import CompressedProcessSample
+    from _virtualSobolDesign import VirtualSobolDesign
+    from _sobolDesignMetadata import getSobolDesignMetadata
 
 __all__ = ['SobolKarhunenLoeveFieldSensitivityAlgorithm']
 
 
+# estimators of the layouts other than Saltelli, see _trajectorySobolExperiments
+TRAJECTORY_ESTIMATORS = ('RadialSensitivityAlgorithm', 'WindingStairsSensitivityAlgorithm')
+
 def all_same(items=None):
     #Checks if all items of a list are the same
     return all(x == items[0] for x in items)
@@ -40,7 +52,8 @@ class SobolKarhunenLoeveFieldSensitivityAlgorithm(object):
     raises an error if the dimensions don't match.
     '''
     def __init__(self, inputDesign=None, outputDesign=None, N=0,
-            estimator = ot.SaltelliSensitivityAlgorithm(), computeSecondOrder=False):
+            estimator = ot.SaltelliSensitivityAlgorithm(), computeSecondOrder=False,
+            metadata=None):
         self.inputDesign = inputDesign
         self.outputDesign = atLeastList(outputDesign)
         self.N = int(N)
@@ -55,20 +68,27 @@ class SobolKarhunenLoeveFieldSensitivityAlgorithm(object):
         self.__Meshes__ = list()
         self.__Classes__ = list()
         self.__BootstrapSize__ = None
+        self.ConfidenceLevel = None
         self.flatOutputDesign = list()
         self.__centeredOutputDesign__ = list()
         self.__results__ = list()
         self.estimator = estimator
+        self.__failureMask__ = None
+        self.__validN__ = self.N
+        self.__metadata__ = metadata
+        if metadata is None and inputDesign is not None :
+            self.__metadata__ = getSobolDesignMetadata(inputDesign)
         if len(self.outputDesign) > 0 and self.outputDesign[0] is not None:
             assert all_same([len(
                 self.outputDesign[i]) for i in range(len(self.outputDesign))])
         if inputDesign is not None and outputDesign is not None :
             try :
-                assert isinstance(inputDesign, ot.Sample), 'The input design can only be a Sample'
-                assert any([isinstance(outputDesign[i], (ot.Sample, ot.ProcessSample)) for i in range(len(outputDesign))])
+                assert isinstance(inputDesign, (ot.Sample, VirtualSobolDesign)), 'The input design can only be a Sample or a VirtualSobolDesign'
+                assert any([isinstance(outputDesign[i], (ot.Sample, ot.ProcessSample, CompressedProcessSample)) for i in range(len(outputDesign))])
             except AssertionError:
                 print('\n\n\n\n\n\n\nThe error\n\n\n\n\n\n\n')
                 return None
+            self.__checkLayout__(self.__metadata__)
         self.__setDefaultState__()
 
     def __repr__(self):
@@ -287,18 +307,72 @@ class SobolKarhunenLoeveFieldSensitivityAlgorithm(object):
     def setConfidenceLevel(self, confidenceLevel):
         self.ConfidenceLevel = confidenceLevel
 
-    def setDesign(self, inputDesign=None, outputDesign=None, N=0):
+    def setDesign(self, inputDesign=None, outputDesign=None, N=0, failureMask=None,
+                  metadata=None):
+        '''Sets the design and its outputs
+
+        Arguments
+        ---------
+        inputDesign : ot.Sample or VirtualSobolDesign
+        outputDesign : list of ot.Sample, ot.ProcessSample or CompressedProcessSample
+        N : int
+            size of the samples A and B, read from the metadata of the design
+            if it is 0
+        failureMask : numpy.ndarray of bool, optional
+            rows whose evaluation failed, as returned by getFailureMask of the
+            function wrapper, see setFailureMask
+        metadata : SobolDesignMetadata, optional
+            structure of the design, as returned by generateWithMetadata or
+            getMetadata of the experiment. The VirtualSobolDesign carries its
+            own. Without metadata, the design is assumed to have the Saltelli
+            layout, and the estimators of the other layouts are refused.
+        '''
         outputDesign = atLeastList(outputDesign)
         assert all_same([len(outputDesign[i]) for i in range(len(outputDesign))])
         assert (isinstance(N,(int, Integral)) and N>=0)
-        assert isinstance(inputDesign, ot.Sample), 'The input design can only be a Sample'
-        assert any([isinstance(outputDesign[i], (ot.Sample, ot.ProcessSample)) for i in range(len(outputDesign))])
+        assert isinstance(inputDesign, (ot.Sample, VirtualSobolDesign)), 'The input design can only be a Sample or a VirtualSobolDesign'
+        assert any([isinstance(outputDesign[i], (ot.Sample, ot.ProcessSample, CompressedProcessSample)) for i in range(len(outputDesign))])
+        if metadata is None :
+            metadata = getSobolDesignMetadata(inputDesign)
+        self.__checkLayout__(metadata)
+        if metadata is not None :
+            # the structure of the design is known, checked without the values
+            if N == 0 :
+                N = metadata.size
+            metadata.check(inputDesign, len(outputDesign[0]), N, self.computeSecondOrder)
+        self.__metadata__ = metadata
         self.inputDesign = inputDesign
         self.outputDesign = atLeastList(outputDesign)
         self.N = int(N)
+        self.__failureMask__ = None if failureMask is None else np.asarray(failureMask, dtype=bool)
         if self.outputDesign is not None and self.N > 0:
             self.__setDefaultState__()
 
+    def setFailureMask(self, failureMask=None):
+        '''Sets the rows of the design whose evaluation failed. The N-tuples
+        of rows holding a failed row (a row of each block for the Saltelli
+        design, a base point for the radial design) are dropped before the
+        estimation, the indices are estimated on the remaining ones.
+
+        Arguments
+        ---------
+        failureMask : numpy.ndarray of bool or None
+            one value per row of the design, as returned by getFailureMask of
+            the function wrapper
+        '''
+        self.__failureMask__ = None if failureMask is None else np.asarray(failureMask, dtype=bool)
+        if len(self.outputDesign) > 0 and self.outputDesign[0] is not None and self.N > 0 :
+            self.__setDefaultState__()
+
+    def getFailureMask(self):
+        return self.__failureMask__
+
+    def getValidSize(self):
+        """Returns the number of N-tuples used by the estimation, N minus
+        the ones dropped because of a failed row
+        """
+        return self.__validN__
+
     def setEstimator(self, estimator):
         self.estimator = estimator
 
@@ -337,7 +411,9 @@ class SobolKarhunenLoeveFieldSensitivityAlgorithm(object):
                 self.size = len(self.outputDesign[0])
                 print('size initialized',self.size)
                 self.__nOutputs__ = len(self.outputDesign)
-                if self.computeSecondOrder== True :
+                if self.__metadata__ is not None :
+                    self.__nSobolIndices__ = self.__metadata__.getIndicesNumber()
+                elif self.computeSecondOrder== True :
                     self.__nSobolIndices__ = int((int(self.size / self.N) - 2)/2)
                     try :
                         assert (int(self.size / self.N) - 2) % 2 == 0
@@ -346,8 +422,10 @@ class SobolKarhunenLoeveFieldSensitivityAlgorithm(object):
                 else :
                     self.__nSobolIndices__ = int(int(self.size / self.N) - 2)
                     print(MSG_2)
+                self.__results__.clear()
                 self.__getDataOutputDesign__()
                 self.__flattenOutputDesign__()
+                self.__dropFailedTuples__()
                 self.__centerOutputDesign__()
                 self.__confirmationMessage__()
                 self.__setDefaultName__()
@@ -375,6 +453,54 @@ class SobolKarhunenLoeveFieldSensitivityAlgorithm(object):
             if isinstance(outputDes, ot.ProcessSample):
                 sample, mesh = self.__splitProcessSample__(outputDes)
                 self.flatOutputDesign.append(sample)
+            if isinstance(outputDes, CompressedProcessSample):
+                # the fields are rebuilt from their coefficients at once
+                self.flatOutputDesign.append(outputDes.asSample())
+
+    def __getLayout__(self):
+        if self.__metadata__ is not None :
+            return self.__metadata__.layout
+        return 'Saltelli'
+
+    def __checkLayout__(self, metadata):
+        '''Checks that the estimator fits the layout of the design, which is
+        only assumed to be Saltelli when the design has no metadata
+        '''
+        layout = 'Saltelli' if metadata is None else metadata.layout
+        estimator = self.estimator.getClassName()
+        if layout == 'Saltelli' :
+            assert estimator not in TRAJECTORY_ESTIMATORS, \
+                "The {} estimator needs the metadata of its design, see generateWithMetadata".format(
+                                                                                    estimator)
+        else :
+            assert estimator == layout + 'SensitivityAlgorithm', \
+                "The {} design needs the {}SensitivityAlgorithm estimator".format(layout, layout)
+
+    def __dropFailedTuples__(self):
+        '''Removes from the flat outputs the N-tuples holding a failed row
+        '''
+        self.__validN__ = self.N
+        mask = self.__failureMask__
+        if mask is None or not mask.any():
+            return
+        assert len(mask) == self.size, \
+            "The failure mask has {} rows, the outputs {}".format(len(mask), self.size)
+        layout = self.__getLayout__()
+        assert layout != 'WindingStairs', \
+            "The rows of a winding stairs chain cannot be dropped, evaluate the failed rows again"
+        nBlocks = self.size // self.N
+        rows = np.arange(self.size)
+        if layout == 'Radial':
+            rows = rows.reshape(self.N, nBlocks)
+        else :
+            # the row k of each block forms the N-tuple k
+            rows = rows.reshape(nBlocks, self.N).T
+        keep = ~mask[rows].any(axis=1)
+        assert keep.sum() > 1, "Less than two N-tuples are left without a failed row"
+        kept = rows[keep] if layout == 'Radial' else rows[keep].T
+        kept = kept.reshape(-1).tolist()
+        self.flatOutputDesign[:] = [output.select(kept) for output in self.flatOutputDesign]
+        self.__validN__ = int(keep.sum())
 
     def __splitProcessSample__(self, processSample):
         '''Function to split a process sample into a 1D sample and a mesh.
@@ -418,6 +544,9 @@ class SobolKarhunenLoeveFieldSensitivityAlgorithm(object):
         if self.inputDesign is None :
             desc = ot.Description.BuildDefault(self.__nSobolIndices__, 'X')
             self.inputDescription = desc
+        elif self.__metadata__ is not None :
+            # the design knows its variables, or groups of variables
+            self.inputDescription = self.__metadata__.group_names
         elif all_same(self.inputDesign.getDescription()) == True:
             desc = ot.Description.BuildDefault(self.__nSobolIndices__, 'X')
             self.inputDescription = desc
@@ -431,6 +560,9 @@ class SobolKarhunenLoeveFieldSensitivityAlgorithm(object):
                 if x not in SobolIndicesName:
                     SobolIndicesName.append(x)
             print('SobolIndicesName',SobolIndicesName)
+            if len(SobolIndicesName) != self.__nSobolIndices__ :
+                # grouped variables, pass the VirtualSobolDesign to get their names
+                SobolIndicesName = ot.Description.BuildDefault(self.__nSobolIndices__, 'G')
             self.inputDescription = SobolIndicesName
         print('Input Description is,',self.inputDescription)
 
@@ -449,20 +581,25 @@ class SobolKarhunenLoeveFieldSensitivityAlgorithm(object):
         print('Solving...')
         print(' size of samples: ', self.size)
         print(' number of indices to get', self.__nSobolIndices__)
-        dummyInputSample = ot.Sample(self.size, self.__nSobolIndices__)
+        dummyInputSample = ot.Sample(self.__centeredOutputDesign__[0].getSize(), self.__nSobolIndices__)
         dummyInputSample.setDescription(self.inputDescription)
         self.__results__.clear()
         outputDesigns = self.__centeredOutputDesign__
         for i in range(len(outputDesigns)):
             estimator = self.estimator.__class__()
+            if self.__BootstrapSize__ is not None :
+                estimator.setBootstrapSize(int(self.__BootstrapSize__))
+            if self.ConfidenceLevel is not None :
+                estimator.setConfidenceLevel(self.ConfidenceLevel)
             _input = deepcopy(dummyInputSample)
             self.__results__.append(estimator)
             if not checkIfNanInSample(outputDesigns[i]):
-                self.__results__[i].setDesign(_input, outputDesigns[i], self.N)
+                self.__results__[i].setDesign(_input, outputDesigns[i], self.__validN__)
                 self.__results__[i].setName(self.inputDescription[i])
             else :
                 print('One of your outputs at idx {} contains Nans'.format(i))
-                print('Please recheck your ouput samples and correct them')
+                print('Please recheck your ouput samples and correct them,')
+                print('or pass the failure mask of the wrapper to setFailureMask')
                 raise TypeError
 
     def __toBaseDataFormat__(self, data, idx):
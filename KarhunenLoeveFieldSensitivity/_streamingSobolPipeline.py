@@ -0,0 +1,288 @@
+__author__ = 'Kristof Attila S.'
+__version__ = '0.1'
+__date__  = '19.10.26'
+
+__all__ = ['OnlineSobolEstimator', 'StreamingSobolPipeline']
+
+import numpy as np
+import openturns as ot
+try :
+    from ._virtualSobolDesign import VirtualSobolDesign, arrayToSample
+    from ._outputCompression import CompressedProcessSample
+except ImportError :
+    from _virtualSobolDesign import VirtualSobolDesign, arrayToSample
+    from _outputCompression import CompressedProcessSample
+
+
+class OnlineSobolEstimator(object):
+    '''First and total order Sobol' indices updated block by block.
+
+    Only sums over the rows are kept, so the outputs of a block can be
+    discarded once it is added. The Jansen indices are the ones of the
+    JansenSensitivityAlgorithm of openturns on the same design, for any
+    number of blocks. The Saltelli indices follow the formulas of the
+    SaltelliSensitivityAlgorithm, with the outputs centered on the mean of
+    the design.
+
+    Parameters
+    ----------
+    n_vars : int
+        number of variables (blocks A_B^i of the design)
+    estimator : str
+        'Saltelli' or 'Jansen'
+
+    Note
+    ----
+    The sums are taken on the outputs shifted by the mean of the first block,
+    to limit the cancellations when the outputs have a large mean.
+    '''
+    ESTIMATORS = ('Saltelli', 'Jansen')
+
+    def __init__(self, n_vars, estimator='Saltelli'):
+        assert estimator in self.ESTIMATORS, \
+            "The estimator can only be one of {}".format(self.ESTIMATORS)
+        self.n_vars = int(n_vars)
+        self.estimator = estimator
+        self.reset()
+
+    def __repr__(self):
+        return ', '.join(['OnlineSobolEstimator',
+                          'estimator : {}'.format(self.estimator),
+                          'variables : {}'.format(self.n_vars),
+                          'size : {}'.format(self.getSize())])
+
+    def reset(self):
+        '''Forgets all the blocks added
+        '''
+        self.__size__ = 0
+        self.__shift__ = None
+        self.__sums__ = dict()
+
+    def getSize(self):
+        '''Returns the number of rows N added so far
+        '''
+        return self.__size__
+
+    def update(self, yA, yB, yE):
+        '''Adds a block of rows
+
+        Arguments
+        ---------
+        yA, yB : numpy.ndarray
+            outputs of the rows of A and B, of shape (m, outputs)
+        yE : numpy.ndarray
+            outputs of the same rows of the blocks A_B^i, of shape
+            (n_vars, m, outputs)
+        '''
+        yA = np.asarray(yA, dtype=float)
+        yA = yA.reshape(yA.shape[0], -1)
+        yB = np.asarray(yB, dtype=float).reshape(yA.shape)
+        yE = np.asarray(yE, dtype=float).reshape((self.n_vars,) + yA.shape)
+        if yA.shape[0] == 0 :
+            return None
+        if self.__shift__ is None :
+            self.__shift__ = yA.mean(axis=0)
+        a, b, e = yA - self.__shift__, yB - self.__shift__, yE - self.__shift__
+        blockSums = {'A'     : a.sum(axis=0),
+                     'B'     : b.sum(axis=0),
+                     'E'     : e.sum(axis=1),
+                     'AA'    : (a * a).sum(axis=0),
+                     'AE'    : (a * e).sum(axis=1),
+                     'BE'    : (b * e).sum(axis=1),
+                     'A-E^2' : ((a - e)**2).sum(axis=1),
+                     'B-E^2' : ((b - e)**2).sum(axis=1)}
+        for key, value in blockSums.items():
+            self.__sums__[key] = self.__sums__.get(key, 0.) + value
+        self.__size__ += yA.shape[0]
+
+    def getVariance(self):
+        '''Returns the variance of the outputs of A, of shape (outputs,)
+        '''
+        n, sums = self.__size__, self.__sums__
+        assert n > 1, "At least two rows are needed"
+        return (sums['AA'] - sums['A']**2 / n) / (n - 1)
+
+    def getFirstOrderIndices(self):
+        '''Returns the first order indices, of shape (n_vars, outputs)
+        '''
+        return self._computeVariances()[0] / self.getVariance()
+
+    def getTotalOrderIndices(self):
+        '''Returns the total order indices, of shape (n_vars, outputs)
+        '''
+        return self._computeVariances()[1] / self.getVariance()
+
+    def _computeVariances(self):
+        n, sums = self.__size__, self.__sums__
+        variance = self.getVariance()
+        if self.estimator == 'Jansen' :
+            return variance - sums['B-E^2'] / (2 * n - 1), sums['A-E^2'] / (2 * n - 1)
+        # the outputs are centered on the mean of the whole design
+        c = (sums['A'] + sums['B'] + sums['E'].sum(axis=0)) / (n * (2 + self.n_vars))
+        muA, muB = sums['A'] / n - c, sums['B'] / n - c
+        crossBE = sums['BE'] - c * (sums['B'] + sums['E']) + n * c**2
+        crossAE = sums['AE'] - c * (sums['A'] + sums['E']) + n * c**2
+        return crossBE / (n - 1) - muA * muB, variance - crossAE / (n - 1) + muA**2
+
+
+class StreamingSobolPipeline(object):
+    '''Sensitivity analysis of a function wrapper on a Sobol design without
+    holding the outputs of the whole design.
+
+    The design is walked in blocks of rows aligned across its blocks : the
+    rows start to stop of A, of B and of each A_B^i are evaluated together by
+    the wrapper, and their outputs are added to an OnlineSobolEstimator per
+    output, then discarded. The memory used is the one of the samples A and
+    B, and of the outputs of one block of rows, whatever the size of the
+    design. The indices are available after each block.
+
+    Parameters
+    ----------
+    function : KarhunenLoeveGeneralizedFunctionWrapper
+        the function to analyse, or any callable taking an ot.Sample of
+        coefficients and returning a list of ot.Sample and ot.ProcessSample
+    design : VirtualSobolDesign
+        the design, see KarhunenLoeveSobolIndicesExperiment.generateVirtual.
+        Only its blocks for the first and total order indices are evaluated.
+    block_size : int
+        number of rows of each of A, B and A_B^i evaluated at once
+    estimator : str or openturns sensitivity algorithm
+        'Saltelli' or 'Jansen'
+    variable_names : list of str, optional
+        names of the variables (or groups of variables), by default the
+        ones of the design, see VirtualSobolDesign.getGroupNames
+
+    Example
+    -------
+    >>> design = experiment.generateVirtual()
+    >>> pipeline = StreamingSobolPipeline(wrapper, design, block_size=500)
+    >>> for rows in pipeline.iterate():
+    ...     print(rows, pipeline.getFirstOrderIndices()[0][0])
+    '''
+    def __init__(self, function, design, block_size=1000, estimator='Saltelli',
+                 variable_names=None):
+        assert isinstance(design, VirtualSobolDesign), \
+            "The design can only be a VirtualSobolDesign"
+        assert isinstance(block_size, int) and block_size > 0, \
+            "Block size can only be positive integer"
+        self.function = function
+        self.design = design
+        self.block_size = block_size
+        if not isinstance(estimator, str):
+            estimator = estimator.getClassName().replace('SensitivityAlgorithm', '')
+        self.estimator = estimator
+        n_vars = len(design.getGroups())
+        if variable_names is None :
+            variable_names = design.getGroupNames()
+        assert len(variable_names) == n_vars, "Give one name per variable"
+        self.variable_names = list(variable_names)
+        self.__estimators__ = list()
+        self.__structure__ = list()
+        self.__position__ = 0
+        self.__failedRows__ = 0
+
+    def __repr__(self):
+        return ', '.join(['StreamingSobolPipeline',
+                          'estimator : {}'.format(self.estimator),
+                          'rows : {} of {}'.format(self.__position__,
+                                                   self.design.getBlockSize()),
+                          'block size : {}'.format(self.block_size)])
+
+    def getPosition(self):
+        '''Returns the number of rows of A already evaluated
+        '''
+        return self.__position__
+
+    def getFailedRows(self):
+        '''Returns the number of rows of A left out because the evaluation of
+        one of their aligned rows failed
+        '''
+        return self.__failedRows__
+
+    def getEstimators(self):
+        '''Returns the OnlineSobolEstimator of each output
+        '''
+        return self.__estimators__
+
+    def iterate(self):
+        '''Evaluates the design block by block, yielding after each block the
+        number of rows of A evaluated so far, so that the indices can be
+        looked at (or the loop stopped) during the evaluation.
+        '''
+        size = self.design.getBlockSize()
+        while self.__position__ < size :
+            start = self.__position__
+            stop = min(start + self.block_size, size)
+            self._addBlock(start, stop)
+            self.__position__ = stop
+            yield stop
+
+    def run(self):
+        '''Evaluates the rest of the design
+        '''
+        for rows in self.iterate():
+            pass
+        return self
+
+    def getFirstOrderIndices(self):
+        '''Returns the first order indices of the rows evaluated so far
+
+        Returns
+        -------
+        FO_indices : list
+            for each output, the list of the indices of each variable, as
+            ot.Point for the scalar outputs and ot.Field for the field outputs
+        '''
+        return self._formatIndices([estimator.getFirstOrderIndices()
+                                    for estimator in self.__estimators__], 'Sobol_')
+
+    def getTotalOrderIndices(self):
+        '''Returns the total order indices of the rows evaluated so far, in
+        the format of getFirstOrderIndices
+        '''
+        return self._formatIndices([estimator.getTotalOrderIndices()
+                                    for estimator in self.__estimators__], 'TotalOrderSobol_')
+
+    def _addBlock(self, start, stop):
+        '''Evaluates the rows start to stop of A, B and each A_B^i in one call
+        and adds their outputs to the estimators
+        '''
+        design = self.design
+        size = design.getBlockSize()
+        n_vars = len(design.getGroups())
+        m = stop - start
+        coefficients = np.empty(((2 + n_vars) * m, design.getDimension()))
+        for k in range(2 + n_vars):
+            design.getRows(k * size + start, k * size + stop, out=coefficients[k * m : (k + 1) * m])
+        outputs = self.function(arrayToSample(coefficients))
+        valid = np.ones(m, dtype=bool)
+        getFailureMask = getattr(self.function, 'getFailureMask', None)
+        mask = getFailureMask() if getFailureMask is not None else None
+        if mask is not None :
+            valid = ~np.asarray(mask, dtype=bool).reshape(2 + n_vars, m).any(axis=0)
+            self.__failedRows__ += int(m - valid.sum())
+        if len(self.__estimators__) == 0 :
+            self.__estimators__ = [OnlineSobolEstimator(n_vars, self.estimator)
+                                                        for output in outputs]
+            self.__structure__ = [{'name' : output.getName(),
+                                   'mesh' : output.getMesh() if isinstance(output,
+                                        (ot.ProcessSample, CompressedProcessSample)) else None,
+                                   'dimension' : output.getDimension()} for output in outputs]
+        for estimator, output in zip(self.__estimators__, outputs):
+            values = np.asarray(np.array(output), dtype=float).reshape(2 + n_vars, m, -1)
+            values = values[:, valid]
+            estimator.update(values[0], values[1], values[2:])
+
+    def _formatIndices(self, indices, prefix):
+        formatted = []
+        for structure, values in zip(self.__structure__, indices):
+            perVariable = []
+            for name, value in zip(self.variable_names, values):
+                if structure['mesh'] is not None :
+                    element = ot.Field(structure['mesh'], value.reshape(-1, structure['dimension']))
+                else :
+                    element = ot.Point(value)
+                element.setName(prefix + structure['name'] + '_' + name)
+                perVariable.append(element)
+            formatted.append(perVariable)
+        return formatted
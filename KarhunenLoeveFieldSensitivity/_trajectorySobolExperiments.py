@@ -0,0 +1,380 @@
+__author__ = 'Kristof Attila S.'
+__version__ = '0.1'
+__date__  = '19.10.26'
+
+__all__ = ['RadialSobolIndicesExperiment', 'WindingStairsSobolIndicesExperiment',
+           'RadialSensitivityAlgorithm', 'WindingStairsSensitivityAlgorithm']
+
+import numpy as np
+import openturns as ot
+try :
+    from ._karhunenLoeveSobolIndicesExperiment import KarhunenLoeveSobolIndicesExperiment
+    from ._virtualSobolDesign import VirtualSobolDesign
+    from ._karhunenLoeveGeneralizedFunctionWrapper import concatenateOutputs
+except ImportError :
+    from _karhunenLoeveSobolIndicesExperiment import KarhunenLoeveSobolIndicesExperiment
+    from _virtualSobolDesign import VirtualSobolDesign
+    from _karhunenLoeveGeneralizedFunctionWrapper import concatenateOutputs
+
+
+class RadialVirtualSobolDesign(VirtualSobolDesign):
+    '''Radial design of RadialSobolIndicesExperiment, mixed on demand like
+    the VirtualSobolDesign : the rows of its blocks are ordered by base
+    point, the row j * (2 + d) + k being the row j of the block k.
+    '''
+    def getBlock(self, k):
+        '''Returns the rows of the block k, one per base point
+        '''
+        return self.getRows(0, self.getSize())[k::self.getBlocksNumber()]
+
+    def getRows(self, start, stop, out=None):
+        assert 0 <= start <= stop <= self.getSize(), "Rows out of the design"
+        nBlocks, size = self.getBlocksNumber(), self.getBlockSize()
+        first, last = start // nBlocks, -(-stop // nBlocks)
+        # the rows of the base points first to last, in each block
+        blocks = np.stack([VirtualSobolDesign.getRows(self, k * size + first, k * size + last)
+                           for k in range(nBlocks)], axis=1)
+        rows = blocks.reshape(-1, self.getDimension())[start - first * nBlocks :
+                                                       stop - first * nBlocks]
+        if out is None :
+            return rows
+        out[:] = rows
+        return out
+
+    def getMetadata(self, layout='Radial'):
+        return super(RadialVirtualSobolDesign, self).getMetadata(layout)
+
+
+class WindingStairsVirtualSobolDesign(VirtualSobolDesign):
+    '''Chain of WindingStairsSobolIndicesExperiment, mixed on demand from the
+    point it starts from and the rows of B : the step k of the chain (k >= 1)
+    takes the modes of the group (k - 1) mod d from the row (k - 1) // d of B.
+
+    The chain starts from the first row of A and has N * d + 1 rows, or
+    continues a previous chain (see setOrigin) and has N * d rows.
+    '''
+    def __init__(self, sample_A, sample_B, mode_count, description=None,
+                 groups=None, group_names=None):
+        super(WindingStairsVirtualSobolDesign, self).__init__(sample_A, sample_B,
+                            mode_count, False, description, groups, group_names)
+        self.origin = self.sample_A[0] if self.sample_A.shape[0] > 0 \
+                      else np.zeros(self.getDimension())
+        self.continued = False
+
+    def setOrigin(self, origin):
+        '''Continues a previous chain from its last row, which is not a row
+        of the design
+        '''
+        self.origin = np.array(origin, dtype=float).reshape(-1)
+        self.continued = True
+
+    def getSize(self):
+        return self.getBlockSize() * self.getBlocksNumber() + (0 if self.continued else 1)
+
+    def getBlocksNumber(self):
+        '''Returns the number of steps of a stair, d
+        '''
+        return len(self.groups)
+
+    def getBlock(self, k):
+        '''Returns the rows of the steps changing the group k, one per stair
+        '''
+        steps = np.arange(self.getSize()) + int(self.continued)
+        return self.getRows(0, self.getSize())[(steps >= 1)
+                                               & ((steps - 1) % self.getBlocksNumber() == k)]
+
+    def getRows(self, start, stop, out=None):
+        assert 0 <= start <= stop <= self.getSize(), "Rows out of the design"
+        if out is None :
+            out = np.empty((stop - start, self.getDimension()))
+        d = self.getBlocksNumber()
+        steps = np.arange(start, stop) + int(self.continued)
+        out[:] = self.origin
+        for g in range(d):
+            # last step changing the group g, the origin if there is none yet
+            last = steps - np.mod(steps - 1 - g, d)
+            changed = last >= 1
+            out[np.ix_(changed, self.__fromSource__[g])] = \
+                        self.sample_B[(last[changed] - 1) // d][:, self.__fromSource__[g]]
+        return out
+
+    def getMetadata(self, layout='WindingStairs'):
+        return super(WindingStairsVirtualSobolDesign, self).getMetadata(layout)
+
+
+class _TrajectorySobolIndicesExperiment(KarhunenLoeveSobolIndicesExperiment):
+    '''Common part of the experiments of the trajectory designs, where the
+    rows of the new points of extend follow the previous ones
+    '''
+    def __init__(self, AggregatedKarhunenLoeveResults=None, size=None):
+        super(_TrajectorySobolIndicesExperiment, self).__init__(
+                                    AggregatedKarhunenLoeveResults, size, False)
+
+    def mergeOutputs(self, previousOutputs, incrementOutputs):
+        '''Merges the outputs of the design before the last extension with
+        the outputs of the increment returned by extend, see
+        KarhunenLoeveSobolIndicesExperiment.mergeOutputs
+        '''
+        assert self.__previousSize__ is not None, \
+                "The experiment was not extended"
+        assert len(previousOutputs[0]) + len(incrementOutputs[0]) == \
+               len(self._getVirtualDesign()), \
+                "The outputs do not match the sizes of the last extension"
+        return concatenateOutputs([previousOutputs, incrementOutputs])
+
+
+class RadialSobolIndicesExperiment(_TrajectorySobolIndicesExperiment):
+    '''Radial design of the Sobol' indices : for each base point a_j, the
+    point itself, an auxiliary point b_j, and for each variable (or group of
+    variables, see setGroups) the base point with the modes of the variable
+    taken from b_j.
+
+    The design has the N * (2 + d) rows of the Saltelli design, its blocks
+    being reordered by base point : it costs as many runs, but it can be
+    evaluated and analysed for any number of complete base points, and
+    extend adds new base points after the previous ones.
+    To be analysed with the RadialSensitivityAlgorithm estimator.
+
+    Parameters
+    ----------
+    AggregatedKarhunenLoeveResults : AggregatedKarhunenLoeveResults
+    size : int
+        number of base points N
+    '''
+    LAYOUT = 'Radial'
+
+    def _buildVirtualDesign(self, sample_A, sample_B, second_order):
+        return RadialVirtualSobolDesign(sample_A, sample_B, self.__mode_count__, False,
+                            self.inputVarNamesKL, self.__groups__, self.__groupNames__)
+
+
+class WindingStairsSobolIndicesExperiment(_TrajectorySobolIndicesExperiment):
+    '''Winding stairs design of the Sobol' indices (Jansen) : a single chain
+    of points, starting at a_0, where each step draws new values for the
+    modes of one variable (or group of variables, see setGroups), the
+    variables being changed in turn.
+
+    With N stairs of d steps, the chain has N * d + 1 rows instead of the
+    N * (2 + d) of the Saltelli design. Two consecutive points differ by one
+    variable only (total order indices), and two points d - 1 steps apart
+    share one variable only (first order indices). The pairs are correlated
+    along the chain, so the estimates have a larger variance than with the
+    Saltelli design for the same N. The new stairs of extend continue the
+    chain from its last point. To be analysed with the
+    WindingStairsSensitivityAlgorithm estimator.
+
+    Parameters
+    ----------
+    AggregatedKarhunenLoeveResults : AggregatedKarhunenLoeveResults
+    size : int
+        number of stairs N
+    '''
+    LAYOUT = 'WindingStairs'
+
+    def extend(self, size, **kwargs):
+        previous = None if self._sample_A is None else self._getVirtualDesign()
+        increment = super(WindingStairsSobolIndicesExperiment, self).extend(size, **kwargs)
+        if previous is not None :
+            increment.setOrigin(previous.getRows(len(previous) - 1, len(previous))[0])
+        return increment
+
+    def generateRows(self, start, stop, **kwargs):
+        assert start == 0, \
+            "The stairs depend on the previous ones, the chain can only be generated from 0"
+        return super(WindingStairsSobolIndicesExperiment, self).generateRows(
+                                                                start, stop, **kwargs)
+
+    def _buildVirtualDesign(self, sample_A, sample_B, second_order):
+        return WindingStairsVirtualSobolDesign(sample_A, sample_B, self.__mode_count__,
+                            self.inputVarNamesKL, self.__groups__, self.__groupNames__)
+
+
+class _TrajectorySensitivityAlgorithm(object):
+    '''Common part of the estimators of the trajectory designs. They can be
+    passed as estimator to the SobolKarhunenLoeveFieldSensitivityAlgorithm,
+    like the openturns estimators.
+
+    The estimators are sums of terms over independent units, the base points
+    of the radial design or the stairs of the winding stairs design. The
+    confidence intervals are bootstrapped by drawing the units with
+    replacement.
+    '''
+    def __init__(self, inputDesign=None, outputDesign=None, N=0):
+        self.__name__ = 'Unnamed'
+        self.__terms__ = None
+        self.__variances__ = None
+        self.__bootstrapSize__ = ot.ResourceMap.GetAsUnsignedInteger(
+                                        'SobolIndicesAlgorithm-DefaultBootstrapSize')
+        self.__confidenceLevel__ = ot.ResourceMap.GetAsScalar(
+                                        'SobolIndicesAlgorithm-DefaultBootstrapConfidenceLevel')
+        if inputDesign is not None and outputDesign is not None :
+            self.setDesign(inputDesign, outputDesign, N)
+
+    def getClassName(self):
+        return self.__class__.__name__
+
+    def getName(self):
+        return self.__name__
+
+    def setName(self, name):
+        self.__name__ = name
+
+    def getBootstrapSize(self):
+        return self.__bootstrapSize__
+
+    def setBootstrapSize(self, bootstrapSize):
+        assert int(bootstrapSize) > 0, "The bootstrap size can only be positive"
+        self.__bootstrapSize__ = int(bootstrapSize)
+
+    def getConfidenceLevel(self):
+        return self.__confidenceLevel__
+
+    def setConfidenceLevel(self, confidenceLevel):
+        assert 0 < confidenceLevel < 1, "The confidence level must be in ]0, 1["
+        self.__confidenceLevel__ = confidenceLevel
+
+    def setDesign(self, inputDesign, outputDesign, N):
+        '''Computes the partial variances from the outputs of the design
+
+        Arguments
+        ---------
+        inputDesign : ot.Sample
+            only its dimension, the number of indices, is used
+        outputDesign : ot.Sample
+            the outputs, in the order of the rows of the design
+        N : int
+            number of base points or stairs of the design
+        '''
+        values = np.array(outputDesign, dtype=float).reshape(len(outputDesign), -1)
+        n_indices = self.getIndicesNumber(values.shape[0], N)
+        assert inputDesign.getDimension() == n_indices, \
+            "The input design must have one column per index"
+        self.__terms__ = self._computeTerms(values, int(N), n_indices)
+        self.__variances__ = self._sumTerms(self.__terms__, np.ones(int(N)))
+
+    def getFirstOrderIndices(self, marginal=0):
+        variance, firstOrder, totalOrder = self._getVariances()
+        return ot.Point(firstOrder[:, marginal] / variance[marginal])
+
+    def getTotalOrderIndices(self, marginal=0):
+        variance, firstOrder, totalOrder = self._getVariances()
+        return ot.Point(totalOrder[:, marginal] / variance[marginal])
+
+    def getAggregatedFirstOrderIndices(self):
+        variance, firstOrder, totalOrder = self._getVariances()
+        return ot.Point(firstOrder.sum(axis=1) / variance.sum())
+
+    def getAggregatedTotalOrderIndices(self):
+        variance, firstOrder, totalOrder = self._getVariances()
+        return ot.Point(totalOrder.sum(axis=1) / variance.sum())
+
+    def getFirstOrderIndicesInterval(self):
+        '''Returns the bootstrap interval of the aggregated first order
+        indices, as ot.Interval
+        '''
+        return self._getInterval(1)
+
+    def getTotalOrderIndicesInterval(self):
+        '''Returns the bootstrap interval of the aggregated total order
+        indices, as ot.Interval
+        '''
+        return self._getInterval(2)
+
+    def _getVariances(self):
+        assert self.__variances__ is not None, "Set the design first"
+        return self.__variances__
+
+    def _getInterval(self, order):
+        self._getVariances()
+        nUnits = self.__terms__['count'].shape[0]
+        indices = []
+        for b in range(self.__bootstrapSize__):
+            draws = np.array(ot.RandomGenerator.IntegerGenerate(nUnits, nUnits), dtype=int)
+            variances = self._sumTerms(self.__terms__,
+                                       np.bincount(draws, minlength=nUnits).astype(float))
+            indices.append(variances[order].sum(axis=1) / variances[0].sum())
+        alpha = (1 - self.__confidenceLevel__) / 2
+        lower, upper = np.nanquantile(np.array(indices), [alpha, 1 - alpha], axis=0)
+        return ot.Interval(lower, upper)
+
+    @staticmethod
+    def _sumTerms(terms, weights):
+        '''Returns the variance and the first and total order partial
+        variances, with the terms of each unit counted weights times
+        '''
+        count = weights @ terms['count']
+        variance = (weights @ terms['squares'] - (weights @ terms['sum'])**2 / count) / (count - 1)
+        firstOrder = variance - np.einsum('u,uim->im', weights, terms['first']) \
+                                / (weights @ terms['firstCount'])[:, None] / 2
+        totalOrder = np.einsum('u,uim->im', weights, terms['total']) \
+                                / (weights @ terms['totalCount'])[:, None] / 2
+        return variance, firstOrder, totalOrder
+
+
+class RadialSensitivityAlgorithm(_TrajectorySensitivityAlgorithm):
+    '''Jansen estimators on the radial design of RadialSobolIndicesExperiment :
+
+        V_i  = V - 1/(2N) sum_j (f(b_j) - f(a_j^i))^2
+        VT_i = 1/(2N) sum_j (f(a_j) - f(a_j^i))^2
+
+    with V the variance of the outputs of the base and auxiliary points. The
+    intervals are bootstrapped over the base points.
+    '''
+    @staticmethod
+    def getIndicesNumber(size, N):
+        '''Returns the number of indices of a radial design of size rows
+        '''
+        return size // N - 2
+
+    def _computeTerms(self, values, N, n_indices):
+        values = values.reshape(N, n_indices + 2, -1)
+        a, b, e = values[:, :1], values[:, 1:2], values[:, 2:]
+        return {'sum'        : (a + b)[:, 0],
+                'squares'    : (a**2 + b**2)[:, 0],
+                'count'      : np.full(N, 2.),
+                'first'      : (b - e)**2,
+                'firstCount' : np.ones((N, n_indices)),
+                'total'      : (a - e)**2,
+                'totalCount' : np.ones((N, n_indices))}
+
+
+class WindingStairsSensitivityAlgorithm(_TrajectorySensitivityAlgorithm):
+    '''Jansen estimators on the chain of WindingStairsSobolIndicesExperiment,
+    with x_k the k-th point and g(k) = (k - 1) mod d the group changed at the
+    step k :
+
+        V_i  = V - 1/2 mean_{g(k) = i} (f(x_k) - f(x_{k+d-1}))^2
+        VT_i = 1/2 mean_{g(k) = i} (f(x_k) - f(x_{k-1}))^2
+
+    with V the variance of the outputs of the chain. The intervals are
+    bootstrapped over the stairs, the step k being in the stair (k - 1) // d.
+    '''
+    @staticmethod
+    def getIndicesNumber(size, N):
+        '''Returns the number of indices of a chain of size rows
+        '''
+        return (size - 1) // N
+
+    def _computeTerms(self, values, N, n_indices):
+        d, size, dimension = n_indices, values.shape[0], values.shape[1]
+        # the first point goes with the first stair
+        stair = np.maximum(np.arange(size) - 1, 0) // d
+        terms = {'sum'        : np.zeros((N, dimension)),
+                 'squares'    : np.zeros((N, dimension)),
+                 'count'      : np.bincount(stair, minlength=N).astype(float),
+                 'first'      : np.zeros((N, d, dimension)),
+                 'firstCount' : np.zeros((N, d)),
+                 'total'      : np.zeros((N, d, dimension)),
+                 'totalCount' : np.zeros((N, d))}
+        np.add.at(terms['sum'], stair, values)
+        np.add.at(terms['squares'], stair, values**2)
+        steps = np.arange(1, size)
+        np.add.at(terms['total'], (stair[steps], (steps - 1) % d),
+                  (values[steps] - values[steps - 1])**2)
+        np.add.at(terms['totalCount'], (stair[steps], (steps - 1) % d), 1.)
+        # x_k and x_{k+d-1} only share the group (k - 1) mod d
+        starts = np.arange(0, size - d + 1)
+        np.add.at(terms['first'], (stair[starts], (starts - 1) % d),
+                  (values[starts] - values[starts + d - 1])**2)
+        np.add.at(terms['firstCount'], (stair[starts], (starts - 1) % d), 1.)
+        return terms
@@ -0,0 +1,288 @@
+__author__ = 'Kristof Attila S.'
+__version__ = '0.1'
+__date__  = '19.10.26'
+
+__all__ = ['VirtualSobolDesign']
+
+import re
+import ctypes
+from numbers import Integral
+import numpy as np
+import openturns as ot
+try :
+    from ._sobolDesignMetadata import SobolDesignMetadata
+except ImportError :
+    from _sobolDesignMetadata import SobolDesignMetadata
+
+
+def getWritableArray(sample):
+    '''Returns a numpy array sharing the memory of an ot.Sample, to fill the
+    sample without converting the values one by one. numpy.asarray only gives
+    a read-only view, so the array is built on the address of the values.
+    If the sample does not expose its memory, a new array is returned.
+    '''
+    size, dimension = sample.getSize(), sample.getDimension()
+    interface = getattr(sample, '__array_interface__', None)
+    if interface is None or size * dimension == 0 or interface.get('strides') is not None \
+                        or interface['typestr'][1:] != 'f8':
+        return np.empty((size, dimension))
+    values = (ctypes.c_double * (size * dimension)).from_address(interface['data'][0])
+    return np.frombuffer(values, dtype=float).reshape(size, dimension)
+
+
+def parseGroups(groups, variableNames):
+    '''Returns the indices of the variables of each group, and the names of
+    the groups or None if they are not named, from the groups given as in
+    KarhunenLoeveSobolIndicesExperiment.setGroups
+
+    Arguments
+    ---------
+    groups : dict or list
+        dict of the name of each group and the list of its variables, or
+        list of lists of variables, the variables given by their name or
+        index
+    variableNames : list of str
+        names of the variables, in the order of their indices
+    '''
+    variableNames = list(variableNames)
+    if isinstance(groups, dict):
+        names, groups = list(groups.keys()), list(groups.values())
+    else :
+        names = None
+    indices = []
+    for group in groups :
+        group = [group] if isinstance(group, (str, Integral)) else list(group)
+        for variable in group :
+            assert (variable in variableNames) if isinstance(variable, str) else \
+                   (isinstance(variable, Integral) and 0 <= variable < len(variableNames)), \
+                "Unknown variable {} in the groups".format(variable)
+        indices.append([variableNames.index(variable) if isinstance(variable, str)
+                        else int(variable) for variable in group])
+    grouped = sum(indices, [])
+    assert all(len(group) > 0 for group in indices), "The groups cannot be empty"
+    assert len(set(grouped)) == len(grouped), "Each variable can only be in one group"
+    return indices, names
+
+
+def arrayToSample(array):
+    '''Converts a 2D numpy array into an ot.Sample, writing in the memory of
+    the sample when possible.
+    '''
+    sample = ot.Sample(array.shape[0], array.shape[1])
+    values = getWritableArray(sample)
+    if not np.shares_memory(values, np.asarray(sample)):
+        return ot.Sample(np.ascontiguousarray(array, dtype=float))
+    values[:] = array
+    return sample
+
+
+class VirtualSobolDesign(object):
+    '''Sobol design of experiment of the KarhunenLoeveSobolIndicesExperiment
+    that is never built as a whole.
+
+    The design is made of blocks of N rows : A, B, then for each variable a
+    copy of A where the modes of the variable are taken from B, and for the
+    second order indices, a copy of B where the modes of the variable are
+    taken from A. Only A, B and the number of modes of each variable are
+    stored, and the rows are mixed on demand.
+
+    If groups of variables are given, the modes of all the variables of a
+    group are swapped together, and there is one block per group instead of
+    one per variable. The variables in no group are never swapped.
+
+    It can be passed instead of an ot.Sample to the
+    KarhunenLoeveGeneralizedFunctionWrapper, which evaluates it block by
+    block if no chunk size is set, and to the
+    SobolKarhunenLoeveFieldSensitivityAlgorithm.
+
+    Parameters
+    ----------
+    sample_A, sample_B : ot.Sample or numpy.ndarray
+        the two independent samples, of shape (N, modes)
+    mode_count : list of int
+        number of modes of each variable, in the order of the columns
+    second_order : bool
+        if True, the blocks for the second order indices are added
+    description : list of str, optional
+        description of the modes
+    groups : list of lists of int, optional
+        indices of the variables of each group, by default one group per
+        variable
+    group_names : list of str, optional
+        names of the groups, by default the names of their variables, taken
+        from the description, joined by '_'
+    '''
+    def __init__(self, sample_A, sample_B, mode_count, second_order=False,
+                 description=None, groups=None, group_names=None):
+        self.sample_A = np.array(sample_A, dtype=float)
+        self.sample_B = np.array(sample_B, dtype=float)
+        assert self.sample_A.shape == self.sample_B.shape, \
+            "The samples A and B must have the same shape"
+        self.mode_count = [int(count) for count in mode_count]
+        assert sum(self.mode_count) == self.sample_A.shape[1], \
+            "The numbers of modes do not add up to the dimension of the samples"
+        self.second_order = bool(second_order)
+        if description is None :
+            description = ot.Description.BuildDefault(self.getDimension(), 'X_')
+        self.description = ot.Description(description)
+        if groups is None :
+            groups = [[i] for i in range(len(self.mode_count))]
+        self.groups = [[int(i) for i in group] for group in groups]
+        grouped = sum(self.groups, [])
+        assert all(len(group) > 0 for group in self.groups), "The groups cannot be empty"
+        assert len(set(grouped)) == len(grouped) and \
+               set(grouped) <= set(range(len(self.mode_count))), \
+            "Each variable can only be in one group"
+        assert group_names is None or len(group_names) == len(self.groups), \
+            "Give one name per group"
+        self.group_names = list(group_names) if group_names is not None else None
+        # method, sequence, randomize and seed of the samples, see getMetadata
+        self.generation = dict()
+        variable = np.repeat(np.arange(len(self.mode_count)), self.mode_count)
+        # fromSource[g] : columns of the variables of the group g
+        self.__fromSource__ = np.array([np.isin(variable, group) for group in self.groups])
+
+    def __repr__(self):
+        return ', '.join(['VirtualSobolDesign',
+                          'size : {}'.format(self.getSize()),
+                          'dimension : {}'.format(self.getDimension()),
+                          'blocks : {} of {} rows'.format(self.getBlocksNumber(),
+                                                          self.getBlockSize()),
+                          'second order : {}'.format(self.second_order)])
+
+    def __len__(self):
+        return self.getSize()
+
+    def __getitem__(self, idx):
+        '''Returns an ot.Point for an integer, an ot.Sample for a slice of
+        rows, or for a tuple (rows, columns)
+        '''
+        columns = slice(None)
+        if isinstance(idx, tuple):
+            idx, columns = idx
+            if not isinstance(columns, slice):
+                columns = slice(columns, columns + 1)
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(self.getSize())
+            assert step > 0, "The rows can only be taken in increasing order"
+            sample = arrayToSample(self.getRows(start, max(start, stop))[::step, columns])
+            sample.setDescription(list(self.description)[columns])
+            return sample
+        idx = range(self.getSize())[idx]
+        return ot.Point(self.getRows(idx, idx + 1)[0, columns])
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.getRows(0, self.getSize())
+        return values if dtype is None else values.astype(dtype)
+
+    def __iter__(self):
+        for j in range(self.getSize()):
+            yield self[j]
+
+    def getClassName(self):
+        return self.__class__.__name__
+
+    def getSize(self):
+        '''Returns the number of rows of the design
+        '''
+        return self.getBlocksNumber() * self.getBlockSize()
+
+    def getDimension(self):
+        '''Returns the number of modes
+        '''
+        return self.sample_A.shape[1]
+
+    def getDescription(self):
+        return self.description
+
+    def setDescription(self, description):
+        self.description = ot.Description(description)
+
+    def getBlockSize(self):
+        '''Returns the number of rows of each block, the size N of A and B
+        '''
+        return self.sample_A.shape[0]
+
+    def getBlocksNumber(self):
+        '''Returns the number of blocks, 2 + d or 2 + 2d
+        '''
+        return 2 + len(self.groups) * (2 if self.second_order else 1)
+
+    def getModeCount(self):
+        return self.mode_count
+
+    def getGroups(self):
+        '''Returns the indices of the variables of each group
+        '''
+        return self.groups
+
+    def getGroupNames(self):
+        '''Returns the names of the groups, one per block A_B^i
+        '''
+        if self.group_names is not None :
+            return self.group_names
+        description = list(self.description)
+        firstModes = np.cumsum([0] + self.mode_count[:-1])
+        variables = [re.sub(r'_\d+$', '', description[k]) for k in firstModes]
+        return ['_'.join(variables[i] for i in group) for group in self.groups]
+
+    def getSamples(self):
+        '''Returns the samples A and B, as numpy arrays
+        '''
+        return self.sample_A, self.sample_B
+
+    def getMetadata(self, layout='Saltelli'):
+        '''Returns the SobolDesignMetadata of the design
+        '''
+        return SobolDesignMetadata(layout, self.getBlockSize(), self.mode_count,
+                                   self.groups, self.getGroupNames(),
+                                   self.second_order, **self.generation)
+
+    def getBlock(self, k):
+        '''Returns the block k as a numpy array
+        '''
+        size = self.getBlockSize()
+        return self.getRows(k * size, (k + 1) * size)
+
+    def getRows(self, start, stop, out=None):
+        '''Mixes the rows start to stop of the design
+
+        Arguments
+        ---------
+        start, stop : int
+        out : numpy.ndarray, optional
+            array of shape (stop - start, modes) to write the rows in
+
+        Returns
+        -------
+        rows : numpy.ndarray
+        '''
+        assert 0 <= start <= stop <= self.getSize(), "Rows out of the design"
+        if out is None :
+            out = np.empty((stop - start, self.getDimension()))
+        size = self.getBlockSize()
+        n_vars = len(self.groups)
+        for k in range(start // size, -(-stop // size)):
+            low, high = max(start, k * size), min(stop, (k + 1) * size)
+            rows = slice(low - k * size, high - k * size)
+            block = out[low - start : high - start]
+            if k < 2 :
+                block[:] = (self.sample_A, self.sample_B)[k][rows]
+                continue
+            # second order blocks mix A into B
+            base, source = (self.sample_A, self.sample_B) if k < 2 + n_vars \
+                           else (self.sample_B, self.sample_A)
+            np.copyto(block, base[rows])
+            np.copyto(block, source[rows], where=self.__fromSource__[(k - 2) % n_vars])
+        return out
+
+    def asSample(self):
+        '''Builds the whole design as an ot.Sample
+        '''
+        sample = ot.Sample(self.getSize(), self.getDimension())
+        values = getWritableArray(sample)
+        self.getRows(0, self.getSize(), out=values)
+        if not np.shares_memory(values, np.asarray(sample)):
+            sample = ot.Sample(values)
+        sample.setDescription(self.description)
+        return sample
@@ -89,7 +89,7 @@ def sequentialFunctionEvaulation(func, sample, limit=50000):
         for i in range(n_reps):
             outputs.append(func(sample[i*base_size:(i+1)*base_size,:]))
         if rest > 0:
-            outputs.append(func(sample[(n_reps+1)*base_size:(n_reps+1)*base_size+rest,:]))
+            outputs.append(func(sample[n_reps*base_size:n_reps*base_size+rest,:]))
         outputSample = outputs[0]
         [outputSample.add(outputs[i]) for i in range(1,len(outputs))]
         return outputSample
@@ -144,7 +144,17 @@ def all_same(items=None):
 
 
 
-def isValidSobolIndicesExperiment(sample_like, size, second_order = False):
+def isValidSobolIndicesExperiment(sample_like, size, second_order = False, metadata = None):
+    # an ot.Sample carries no metadata, pass the one of generateWithMetadata
+    if metadata is None :
+        metadata = klfs.getSobolDesignMetadata(sample_like)
+    if metadata is not None :
+        # designs of the experiments carry their structure, checked in O(1)
+        try :
+            return metadata.check(sample_like, N = size, secondOrder = second_order)
+        except AssertionError as ae :
+            print(ae)
+            return False
     try :
         sample = np.asarray(sample_like)
     except :
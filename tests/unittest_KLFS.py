@@ -2,11 +2,36 @@ import _aggregatedKarhunenLoeveResults as aklr
 import _karhunenLoeveGeneralizedFunctionWrapper as klgfw
 import _karhunenLoeveSobolIndicesExperiment as klsie
 import _sobolIndicesFactory as sif
+import _evaluationCheckpoint as ec
+import _evaluationInstrumentation as ei
+import _asyncSimulatorEvaluation as ase
+import _parallelEvaluation as pe
+import _evaluationServer as es
+import _fileWorkQueue as fwq
+import _karhunenLoeveSnapshot as kls
+import _outputCompression as oc
+import _virtualSobolDesign as vsd
+import _streamingSobolPipeline as ssp
+import _replicatedSobolIndices as rsi
+import _trajectorySobolExperiments as tse
+import _givenDataSensitivity as gds
+import _sobolDesignMetadata as sdm
 
 import openturns as ot
 import numpy as np
 
 import unittest
+import tempfile
+import shutil
+import pickle
+import json
+import sys
+import os
+import asyncio
+import time
+import threading
+import multiprocessing
+from unittest import mock
 
 
 ## Dummy Function taking as an input a 2D field, a 1D field and a scalar
@@ -298,6 +323,983 @@ class TestAggregatedKarhunenLoeve(unittest.TestCase):
 
         print('Tests Passed!')
 
+    def testLiftAsArrays(self):
+        n_modes = self.AKLR1.getSizeModes()
+        randVect = ot.ComposedDistribution([ot.Normal()]*n_modes)
+        ot.RandomGenerator.SetSeed(6817348)
+        randSample = randVect.getSample(10)
+        arrays = self.AKLR1.liftAsArrays(randSample)
+        procsamp_samp = self.AKLR1.liftAsProcessSample(randSample)
+        names = self.AKLR1.__process_distribution_description__
+        self.assertEqual(arrays[names[0]].shape, (10, mesh.getVerticesNumber()))
+        self.assertEqual(arrays[names[1]].shape, (10,))
+        for j in range(randSample.getSize()):
+            self.assertTrue(np.allclose(arrays[names[0]][j], np.array(procsamp_samp[0][j])[:,0]))
+            self.assertAlmostEqual(arrays[names[1]][j], procsamp_samp[1][j][0,0], 7)
+
+
+class TestEvaluationCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        ot.RandomGenerator.SetSeed(4)
+        self.design = ot.Normal(5).getSample(25)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testSaveAndResume(self):
+        checkpoint = ec.EvaluationCheckpoint(self.directory, 10)
+        bounds = checkpoint.open(self.design)
+        self.assertEqual(bounds, [(0, 10), (10, 20), (20, 25)])
+        output = [self.design[0:10, :2]]
+        checkpoint.saveChunk(0, output)
+        # a new object, as after a restart, finds the chunk back
+        resumed = ec.EvaluationCheckpoint(self.directory, 10)
+        resumed.open(self.design)
+        self.assertTrue(resumed.hasChunk(0))
+        self.assertFalse(resumed.hasChunk(1))
+        self.assertFalse(resumed.isComplete())
+        self.assertTrue(np.allclose(np.array(resumed.loadChunk(0)[0]), np.array(output[0])))
+        loaded, mask = resumed.loadChunkData(0)
+        self.assertTrue(np.allclose(np.array(loaded[0]), np.array(output[0])))
+        self.assertFalse(mask.any())
+        # a different design does not see the chunks
+        other = ec.EvaluationCheckpoint(self.directory, 10)
+        other.open(ot.Normal(5).getSample(25))
+        self.assertFalse(other.hasChunk(0))
+        # nor does a different model on the same design
+        other = ec.EvaluationCheckpoint(self.directory, np.int64(10), 'otherModel')
+        self.assertEqual(other.open(self.design), bounds)
+        self.assertFalse(other.hasChunk(0))
+
+    def testModelsKeptApart(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05])
+        ot.RandomGenerator.SetSeed(5)
+        design = ot.ComposedDistribution([ot.Normal()]*AKLR.getSizeModes()).getSample(20)
+        rows = []
+        def sumFunction(fieldSample, scalarSample):
+            rows.append(fieldSample.getSize())
+            return np.array(fieldSample).sum(axis=(1,2))
+        def scalarFunction(fieldSample, scalarSample):
+            rows.append(fieldSample.getSize())
+            return np.array(scalarSample).reshape(-1)
+        outputs = []
+        for function in (sumFunction, scalarFunction):
+            wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, function, 1)
+            wrapper.setCheckpoint(self.directory, 10)
+            outputs.append(np.array(wrapper(design)[0]))
+        self.assertEqual(sum(rows), 40)
+        self.assertFalse(np.allclose(outputs[0], outputs[1]))
+        # the same model finds its chunks back
+        wrapper.setCheckpoint(self.directory, 10)
+        self.assertTrue(np.allclose(np.array(wrapper(design)[0]), outputs[1]))
+        self.assertEqual(sum(rows), 40)
+        # unless told apart by a tag
+        wrapper.setCheckpoint(self.directory, 10, modelTag='scalar, second study')
+        wrapper(design)
+        self.assertEqual(sum(rows), 60)
+
+
+def fragileFunction(fieldSample, scalarSample):
+    ## Fails for the whole batch as soon as one of the scalars is too big
+    scalars = np.array(scalarSample).reshape(-1)
+    if np.any(scalars > 5.):
+        raise ValueError('Scalar out of the domain of the model')
+    return np.array([np.array(field).sum() for field in fieldSample]) + scalars
+
+
+class TestFailurePolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05])
+        n_modes = self.AKLR.getSizeModes()
+        ot.RandomGenerator.SetSeed(72)
+        self.design = ot.ComposedDistribution([ot.Normal()]*n_modes).getSample(30)
+        self.wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(
+                                    self.AKLR, None, fragileFunction, 1)
+
+    def testIsolateFailures(self):
+        with self.assertRaises(ValueError):
+            self.wrapper(self.design)
+        self.wrapper.setFailurePolicy(maxRetries=1)
+        output = np.array(self.wrapper(self.design)[0])[:,0]
+        mask = self.wrapper.getFailureMask()
+        scalars = np.array(self.AKLR.liftAsProcessSample(self.design)[1])[:,0,0]
+        self.assertTrue(np.array_equal(mask, scalars > 5.))
+        self.assertTrue(mask.any())
+        self.assertTrue(np.isnan(output[mask]).all())
+        self.assertFalse(np.isnan(output[~mask]).any())
+        self.assertEqual(len(self.wrapper.getFailures()), mask.sum())
+
+
+class TestMemoryBudget(unittest.TestCase):
+
+    def testChunkSizeFitsBudget(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05])
+        ot.RandomGenerator.SetSeed(74)
+        design = ot.ComposedDistribution([ot.Normal()]*AKLR.getSizeModes()).getSample(100)
+        sumFunction = lambda fieldSample, scalarSample : np.array(fieldSample).sum(axis=(1,2))
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, sumFunction, 1)
+        reference = np.array(wrapper(design)[0])
+        # lifted field and scalar, and the output
+        bytesPerRow = 8 * mesh.getVerticesNumber() + 8 + 8
+        wrapper.setMemoryBudget(25 * bytesPerRow, probeSize=10)
+        output = np.array(wrapper(design)[0])
+        self.assertEqual(wrapper.getLastChunkSizes(), [10, 25, 25, 25, 15])
+        self.assertTrue(np.allclose(output, reference))
+
+    def testCheckpointChunksFitBudget(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05])
+        ot.RandomGenerator.SetSeed(74)
+        design = ot.ComposedDistribution([ot.Normal()]*AKLR.getSizeModes()).getSample(100)
+        sumFunction = lambda fieldSample, scalarSample : np.array(fieldSample).sum(axis=(1,2))
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, sumFunction, 1)
+        reference = np.array(wrapper(design)[0])
+        bytesPerRow = 8 * mesh.getVerticesNumber() + 8 + 8
+        wrapper.setMemoryBudget(25 * bytesPerRow)
+        directory = tempfile.mkdtemp()
+        try :
+            wrapper.setCheckpoint(directory, 40)
+            # the first chunk is measured, saved, and found above the budget
+            self.assertRaises(AssertionError, wrapper, design)
+            self.assertAlmostEqual(wrapper.getMemoryBudget()['bytes_per_row'], bytesPerRow)
+            lifted = wrapper.getInstrumentation().getStatistics()['bytes_lifted']
+            # now known before any evaluation
+            self.assertRaises(AssertionError, wrapper, design)
+            self.assertEqual(wrapper.getInstrumentation().getStatistics()['bytes_lifted'], lifted)
+            wrapper.setCheckpoint(directory, 25)
+            output = np.array(wrapper(design)[0])
+            self.assertTrue(np.allclose(output, reference))
+        finally :
+            shutil.rmtree(directory)
+
+
+class TestDeduplication(unittest.TestCase):
+
+    def testDuplicatedRowsEvaluatedOnce(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05])
+        ot.RandomGenerator.SetSeed(75)
+        design = ot.ComposedDistribution([ot.Normal()]*AKLR.getSizeModes()).getSample(30)
+        design.add(design[5:15])
+        rows = []
+        def countingFunction(fieldSample, scalarSample):
+            rows.append(fieldSample.getSize())
+            return np.array(fieldSample).sum(axis=(1,2)) * np.array(scalarSample).reshape(-1)
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, countingFunction, 1)
+        reference = np.array(wrapper(design)[0])
+        wrapper.setDeduplication(cacheSize=100)
+        output = np.array(wrapper(design)[0])
+        self.assertEqual(rows[-1], 30)
+        self.assertTrue(np.allclose(output, reference))
+        stats = wrapper.getInstrumentation().getStatistics()
+        self.assertEqual(stats['deduplicated_rows'], 10)
+        # a rerun of the same rows is answered by the row cache
+        output = np.array(wrapper(design[10:20])[0])
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(np.allclose(output, reference[10:20]))
+        # rows read in chunks smaller than the design, the duplicates and
+        # the cached rows spanning several chunks
+        wrapper.HASH_CHUNK_SIZE = 7
+        extended = ot.Sample(design)
+        extended.add(ot.ComposedDistribution([ot.Normal()]*AKLR.getSizeModes()).getSample(8))
+        extended.add(design[0:4])
+        output = np.array(wrapper(extended)[0])
+        self.assertEqual(rows[-1], 8)
+        self.assertTrue(np.allclose(output[:40], reference))
+        self.assertTrue(np.allclose(output[48:], reference[0:4]))
+
+
+def buildServedWrapper():
+    ## Built once in each worker of the evaluation server
+    AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05])
+    wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, fragileFunction, 1)
+    wrapper.setFailurePolicy()
+    return wrapper
+
+
+def crashingFunction(fieldSample, scalarSample):
+    ## Kills its process on the huge scalars, as a segfault of the model
+    if np.any(np.array(scalarSample) > 100.):
+        os._exit(1)
+    return fragileFunction(fieldSample, scalarSample)
+
+
+def buildCrashingWrapper():
+    AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05])
+    wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, crashingFunction, 1)
+    wrapper.setFailurePolicy()
+    return wrapper
+
+
+class TestEvaluationServer(unittest.TestCase):
+
+    def testEvaluateOnServer(self):
+        wrapper = buildServedWrapper()
+        ot.RandomGenerator.SetSeed(76)
+        design = ot.ComposedDistribution([ot.Normal()]*wrapper.getInputDimension()).getSample(50)
+        reference = np.array(wrapper(design)[0])
+        with es.EvaluationServer(buildServedWrapper, n_workers=2) as server:
+            with es.EvaluationClient(server.getAddress(), chunk_size=15) as client:
+                starts = sorted(start for start, stop, output, mask in client.iterateChunks(design))
+                self.assertEqual(starts, [0, 15, 30, 45])
+                output = np.array(client.evaluate(design)[0])
+                self.assertTrue(np.allclose(output, reference, equal_nan=True))
+                self.assertTrue(np.array_equal(client.getFailureMask(), wrapper.getFailureMask()))
+
+    def testDeadWorkerReplaced(self):
+        wrapper = buildServedWrapper()
+        ot.RandomGenerator.SetSeed(79)
+        design = ot.ComposedDistribution([ot.Normal()]*wrapper.getInputDimension()).getSample(20)
+        reference = np.array(wrapper(design)[0])
+        crashing = ot.Sample(design)
+        crashing[3] = [1000.] * wrapper.getInputDimension()
+        with es.EvaluationServer(buildCrashingWrapper, n_workers=1) as server:
+            with es.EvaluationClient(server.getAddress(), chunk_size=10, timeout=60) as client:
+                with self.assertRaises(RuntimeError):
+                    client.evaluate(crashing)
+                # the chunk of the dead worker is answered, the new worker evaluates
+                output = np.array(client.evaluate(design)[0])
+                self.assertTrue(np.allclose(output, reference, equal_nan=True))
+                client.timeout = 0.
+                self.assertRaises(TimeoutError, client.evaluate, design)
+
+
+class TestFileWorkQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testWorkersShareDesign(self):
+        wrapper = buildServedWrapper()
+        ot.RandomGenerator.SetSeed(77)
+        design = ot.ComposedDistribution([ot.Normal()]*wrapper.getInputDimension()).getSample(60)
+        reference = np.array(wrapper(design)[0])
+        queue = fwq.FileWorkQueue(self.directory, chunk_size=10, lease=1.)
+        key = queue.submit(design, wrapper.getModelTag())
+        # a worker that crashed after claiming a chunk
+        self.assertEqual(queue.claim('crashed')[1], 0)
+        workers = [multiprocessing.Process(target=fwq.runWorker,
+                    args=(self.directory, buildServedWrapper, 1., 0.05, 2.))
+                                                                for i in range(2)]
+        for worker in workers :
+            worker.start()
+        wrapper.setWorkQueue(queue, participate=False, timeout=60, poll=0.05)
+        output = np.array(wrapper(design)[0])
+        for worker in workers :
+            worker.join()
+        self.assertTrue(queue.isComplete(key))
+        self.assertTrue(np.allclose(output, reference, equal_nan=True))
+        self.assertTrue(np.array_equal(wrapper.getFailureMask(),
+                                       np.isnan(reference[:,0])))
+
+    def testLeaseStartsAtClaim(self):
+        queue = fwq.FileWorkQueue(self.directory, chunk_size=10, lease=60.)
+        key = queue.submit(np.zeros((20, 3)))
+        # tasks queued for longer than the lease
+        for idx in range(2):
+            os.utime(queue._getTaskPath(key, idx), (1e9, 1e9))
+        claimedPath = queue.claim('worker')[3]
+        self.assertEqual(queue.requeueExpired(key), 0)
+        # the local clock is not used
+        with mock.patch.object(fwq.time, 'time', return_value=4e9):
+            self.assertEqual(queue.requeueExpired(key), 0)
+        os.utime(claimedPath, (1e9, 1e9))
+        self.assertEqual(queue.requeueExpired(key), 1)
+        self.assertEqual(queue.getProgress(key)['queued'], 2)
+
+    def testCommandLineWorker(self):
+        wrapper = buildServedWrapper()
+        ot.RandomGenerator.SetSeed(78)
+        design = ot.ComposedDistribution([ot.Normal()]*wrapper.getInputDimension()).getSample(25)
+        queue = fwq.FileWorkQueue(self.directory, chunk_size=10)
+        key = queue.submit(design, wrapper.getModelTag())
+        with self.assertLogs(fwq.__name__, level='INFO') as logs:
+            status = fwq.main([self.directory, __name__ + ':buildServedWrapper',
+                               '--poll', '0.01', '--idle-timeout', '0.1'])
+        self.assertEqual(status, 0)
+        self.assertTrue(queue.isComplete(key))
+        self.assertIn('Evaluated 3 chunks', logs.output[-1])
+
+
+class TestSurrogate(unittest.TestCase):
+
+    def testRoutingAndFallback(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05])
+        rows = []
+        def linearFunction(fieldSample, scalarSample):
+            rows.append(fieldSample.getSize())
+            return np.array(fieldSample).sum(axis=(1,2)) + np.array(scalarSample).reshape(-1)
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, linearFunction, 1)
+        distribution = ot.ComposedDistribution([ot.Normal()]*AKLR.getSizeModes())
+        ot.RandomGenerator.SetSeed(78)
+        training = distribution.getSample(50)
+        design = distribution.getSample(40)
+        reference = np.array(wrapper(design)[0])
+        # the model is linear in the coefficients, so is the surrogate
+        algo = ot.LinearLeastSquares(training, wrapper(training)[0])
+        algo.run()
+        variance = lambda coefficients : np.abs(coefficients[:,0])
+        wrapper.setSurrogate(algo.getMetaModel(), validationScore=0.99,
+                             variance=variance, varianceTolerance=1.5)
+        self.assertTrue(wrapper.isSurrogateActive())
+        calls = len(rows)
+        output = np.array(wrapper(design)[0])
+        fallback = np.abs(np.array(design)[:,0]) > 1.5
+        self.assertEqual(rows[calls:], [fallback.sum()])
+        self.assertTrue(np.allclose(output, reference))
+        wrapper.setSurrogateValidationScore(0.5)
+        self.assertFalse(wrapper.isSurrogateActive())
+
+
+class TestKarhunenLoeveSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def testLiftLikeAggregation(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N55])
+        AKLR.setLiftWithMean(True)
+        snapshot = kls.KarhunenLoeveSnapshot(AKLR)
+        ot.RandomGenerator.SetSeed(11)
+        coefficients = ot.ComposedDistribution([ot.Normal()]*AKLR.getSizeModes()).getSample(5)
+        snapshot.save(self.tempDir)
+        # saved, the snapshot pickles as its directory only
+        state = snapshot.__getstate__()
+        self.assertEqual(list(state), ['directory'])
+        loaded = pickle.loads(pickle.dumps(snapshot))
+        reference = AKLR.liftAsProcessSample(coefficients)
+        for lifted in (snapshot.liftAsProcessSample(coefficients),
+                       loaded.liftAsProcessSample(coefficients)):
+            for processSample, referenceSample in zip(lifted, reference):
+                self.assertEqual(processSample.getMesh(), referenceSample.getMesh())
+                self.assertTrue(np.allclose(np.array(processSample), np.array(referenceSample)))
+        def sumFunction(fieldSample, scalarSample):
+            return np.array(fieldSample).sum(axis=(1,2)) + np.array(scalarSample).reshape(-1)
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, sumFunction, 1)
+        light = wrapper.getSnapshot()
+        self.assertEqual(list(light.getInputDescription()), list(wrapper.getInputDescription()))
+        self.assertTrue(np.allclose(np.array(light(coefficients)[0]),
+                                    np.array(wrapper(coefficients)[0])))
+
+
+class TestOutputCompression(unittest.TestCase):
+
+    def testCompressedFieldsWithinBound(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05])
+        def scaledField(fieldSample, scalarSample):
+            fields = np.array(fieldSample)[:,:,0]
+            return [fields * np.array(scalarSample).reshape(-1,1)]
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, scaledField, 1)
+        wrapper.setOutputSchema([{'name':'F', 'kind':'field', 'mesh':results.getMesh()}])
+        ot.RandomGenerator.SetSeed(21)
+        design = ot.ComposedDistribution([ot.Normal()]*AKLR.getSizeModes()).getSample(120)
+        reference = np.array(wrapper(design)[0])
+        wrapper.setOutputCompression(1e-3)
+        wrapper.setChunkSize(40)
+        compressed = wrapper(design)[0]
+        self.assertIsInstance(compressed, oc.CompressedProcessSample)
+        self.assertEqual(compressed.getSize(), 120)
+        errors = np.sqrt(np.sum((np.array(compressed) - reference)**2, axis=(1,2)))
+        self.assertTrue(np.all(errors <= compressed.getErrors() + 1e-10))
+        scale = np.sqrt(np.mean(np.sum((reference[:40]-reference[:40].mean(axis=0))**2, axis=(1,2))))
+        self.assertLessEqual(compressed.getErrorBound(), 1e-3 * scale)
+        self.assertTrue(np.allclose(np.array(compressed[5:7]), reference[5:7]))
+        self.assertGreater(compressed.getCompressionRatio(), 1.)
+        processSample = compressed.asProcessSample()
+        self.assertEqual(processSample.getSize(), 120)
+        self.assertTrue(np.allclose(np.array(processSample), np.array(compressed)))
+        # with fewer modes allowed, the bound tells how far the fields are
+        wrapper.setOutputCompression(1e-3, maxModes=2)
+        truncated = wrapper(design)[0]
+        self.assertEqual(truncated.getCoefficients().shape[1], 2)
+        errors = np.sqrt(np.sum((np.array(truncated) - reference)**2, axis=(1,2)))
+        self.assertTrue(np.allclose(errors, truncated.getErrors()))
+
+    def testCompressedOnceThroughDeduplication(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05])
+        def scaledField(fieldSample, scalarSample):
+            fields = np.array(fieldSample)[:,:,0]
+            return [fields * np.array(scalarSample).reshape(-1,1)]
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, scaledField, 1)
+        wrapper.setOutputSchema([{'name':'F', 'kind':'field', 'mesh':results.getMesh()}])
+        ot.RandomGenerator.SetSeed(22)
+        design = ot.ComposedDistribution([ot.Normal()]*AKLR.getSizeModes()).getSample(120)
+        design.add(design[10:30])
+        reference = np.array(wrapper(design)[0])
+        compressedRows = []
+        compress = oc.FieldOutputCompressor.compress
+        def countingCompress(compressor, processSample, mask=None):
+            compressedRows.append(processSample.getSize())
+            return compress(compressor, processSample, mask)
+        oc.FieldOutputCompressor.compress = countingCompress
+        try :
+            wrapper.setDeduplication(cacheSize=200)
+            wrapper.setOutputCompression(1e-3, chunkSize=50)
+            compressed = wrapper(design)[0]
+            # the unique rows only, in chunks, each compressed once
+            self.assertEqual(compressedRows, [50, 50, 20])
+            self.assertIsInstance(compressed, oc.CompressedProcessSample)
+            errors = np.sqrt(np.sum((np.array(compressed) - reference)**2, axis=(1,2)))
+            self.assertTrue(np.all(errors <= compressed.getErrors() + 1e-10))
+            # the cached rows stay compressed
+            rerun = wrapper(design[5:25])[0]
+            self.assertEqual(compressedRows, [50, 50, 20])
+            self.assertIsInstance(rerun, oc.CompressedProcessSample)
+            self.assertTrue(np.allclose(np.array(rerun), np.array(compressed)[5:25]))
+        finally :
+            oc.FieldOutputCompressor.compress = compress
+
+
+class TestSobolIndicesExperiment(unittest.TestCase):
+
+    def testMixedBlocks(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05, ot.Uniform(-1,1)])
+        counts = AKLR.__mode_count__
+        bounds = np.cumsum([0] + counts)
+        N = 20
+        for secondOrder in (False, True):
+            experiment = klsie.KarhunenLoeveSobolIndicesExperiment(AKLR, N, secondOrder)
+            design = np.array(experiment.generate())
+            nBlocks = 2 + len(counts) * (2 if secondOrder else 1)
+            self.assertEqual(design.shape, (nBlocks * N, AKLR.getSizeModes()))
+            A, B = design[:N], design[N:2*N]
+            for i in range(len(counts)):
+                modes = slice(bounds[i], bounds[i+1])
+                others = np.ones(AKLR.getSizeModes(), dtype=bool)
+                others[modes] = False
+                block = design[(2+i)*N:(3+i)*N]
+                self.assertTrue(np.array_equal(block[:, modes], B[:, modes]))
+                self.assertTrue(np.array_equal(block[:, others], A[:, others]))
+                if secondOrder :
+                    block = design[(2+len(counts)+i)*N:(3+len(counts)+i)*N]
+                    self.assertTrue(np.array_equal(block[:, modes], A[:, modes]))
+                    self.assertTrue(np.array_equal(block[:, others], B[:, others]))
+
+    def testExtend(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05, ot.Uniform(-1,1)])
+        def sumFunction(fieldSample, scalarSample, uniformSample):
+            return np.array(fieldSample).sum(axis=(1,2)) + np.array(scalarSample).reshape(-1)
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, sumFunction, 1)
+        fresh = klsie.KarhunenLoeveSobolIndicesExperiment(AKLR, 64)
+        fresh.generate(method='QMC', sequence='Sobol')
+        freshA, freshB = fresh.getVirtualDesign().getSamples()
+        experiment = klsie.KarhunenLoeveSobolIndicesExperiment(AKLR, 16)
+        outputs = wrapper(experiment.generate(method='QMC', sequence='Sobol'))
+        for size in (32, 64):
+            increment = experiment.extend(size)
+            self.assertEqual(increment.getBlockSize(), size // 2)
+            outputs = experiment.mergeOutputs(outputs, wrapper(increment))
+        design = experiment.getVirtualDesign()
+        A, B = design.getSamples()
+        self.assertTrue(np.allclose(A, freshA))
+        self.assertTrue(np.allclose(B, freshB))
+        # the points 32 to 63 of the sequence (openturns skips the point 0),
+        # generated by both extensions, keep one point in each of 32 strata
+        for sample in (A, B):
+            block = sample[31:63]
+            uniforms = np.array(ot.Normal().computeCDF(ot.Sample(block.reshape(-1, 1))))
+            strata = np.floor(uniforms.reshape(block.shape) * 32).astype(int)
+            for column in strata.T :
+                self.assertTrue(np.array_equal(np.sort(column), np.arange(32)))
+        self.assertTrue(np.allclose(np.array(outputs[0]), np.array(wrapper(design)[0])))
+        self.assertRaises(AssertionError, experiment.extend, 10)
+        # the random shift is kept by the extension
+        randomized = klsie.KarhunenLoeveSobolIndicesExperiment(AKLR, 32)
+        ot.RandomGenerator.SetSeed(9)
+        randomized.generate(method='QMC', sequence='Sobol', randomize=True)
+        randomized.extend(64)
+        extendedA = randomized.getVirtualDesign().getSamples()[0]
+        ot.RandomGenerator.SetSeed(9)
+        randomized.setSize(64)
+        randomized.generate(method='QMC', sequence='Sobol', randomize=True)
+        self.assertTrue(np.allclose(randomized.getVirtualDesign().getSamples()[0], extendedA))
+
+    def testGroups(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05, ot.Uniform(-1,1)])
+        names = AKLR.__process_distribution_description__
+        counts = AKLR.__mode_count__
+        N = 50
+        experiment = klsie.KarhunenLoeveSobolIndicesExperiment(AKLR, N)
+        experiment.setGroups({'fieldAndScalar' : names[:2], 'uniform' : [2]})
+        design = experiment.generateVirtual()
+        self.assertEqual(design.getBlocksNumber(), 4)
+        self.assertEqual(design.getGroupNames(), ['fieldAndScalar', 'uniform'])
+        A, B = design.getSamples()
+        block = design.getBlock(2)
+        grouped = counts[0] + counts[1]
+        self.assertTrue(np.array_equal(block[:, :grouped], B[:, :grouped]))
+        self.assertTrue(np.array_equal(block[:, grouped:], A[:, grouped:]))
+        def sumFunction(fieldSample, scalarSample, uniformSample):
+            return np.array(fieldSample).sum(axis=(1,2)) + np.array(scalarSample).reshape(-1)
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, sumFunction, 1)
+        algorithm = sif.SobolKarhunenLoeveFieldSensitivityAlgorithm(
+                                        estimator=ot.JansenSensitivityAlgorithm())
+        algorithm.setDesign(design, wrapper(design))
+        totalOrder = algorithm.getTotalOrderIndices()[0]
+        self.assertTrue(totalOrder[0].getName().endswith('_fieldAndScalar'))
+        self.assertTrue(totalOrder[1].getName().endswith('_uniform'))
+        self.assertAlmostEqual(totalOrder[1][0], 0.)
+        experiment.setGroups(None)
+        self.assertEqual(experiment.generateVirtual().getBlocksNumber(), 5)
+
+    def testSeededStreams(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05, ot.Uniform(-1,1)])
+        for kwargs in ({'method' : 'MonteCarlo'}, {'method' : 'QMC', 'randomize' : True}):
+            experiment = klsie.KarhunenLoeveSobolIndicesExperiment(AKLR, 2500)
+            experiment.generate(seed=3, **kwargs)
+            A, B = experiment.getVirtualDesign().getSamples()
+            other = klsie.KarhunenLoeveSobolIndicesExperiment(AKLR, 2500)
+            for chunk in (700, 1024):
+                parts = [other.generateRows(start, min(start + chunk, 2500), seed=3, **kwargs)
+                         for start in range(0, 2500, chunk)]
+                self.assertTrue(np.array_equal(np.vstack([part.getSamples()[0] for part in parts]), A))
+                self.assertTrue(np.array_equal(np.vstack([part.getSamples()[1] for part in parts]), B))
+            # a chunk before the last one generated
+            earlier = other.generateRows(100, 200, seed=3, **kwargs).getSamples()[0]
+            self.assertTrue(np.array_equal(earlier, A[100:200]))
+            reseeded = other.generateRows(0, 10, seed=4, **kwargs).getSamples()[0]
+            self.assertFalse(np.allclose(reseeded, A[:10]))
+            # the rows of other seeds leave the streams of generate unchanged
+            experiment.generateRows(0, 10, seed=4, **kwargs)
+            increment = experiment.extend(2600).getSamples()[0]
+            self.assertTrue(np.array_equal(increment, other.generateRows(
+                                        2500, 2600, seed=3, **kwargs).getSamples()[0]))
+            experiment.setSize(2500)
+            experiment.generate(seed=3, **kwargs)
+            self.assertTrue(np.array_equal(experiment.getVirtualDesign().getSamples()[0], A))
+
+    def testVirtualDesign(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05, ot.Uniform(-1,1)])
+        experiment = klsie.KarhunenLoeveSobolIndicesExperiment(AKLR, 30, True)
+        ot.RandomGenerator.SetSeed(5)
+        design = experiment.generate()
+        ot.RandomGenerator.SetSeed(5)
+        virtual = experiment.generateVirtual()
+        self.assertIsInstance(virtual, vsd.VirtualSobolDesign)
+        self.assertEqual(len(virtual), len(design))
+        self.assertTrue(np.array_equal(np.array(virtual), np.array(design)))
+        self.assertTrue(np.array_equal(np.array(virtual[41:137]), np.array(design[41:137])))
+        self.assertEqual(virtual[100], design[100])
+        def sumFunction(fieldSample, scalarSample, uniformSample):
+            return np.array(fieldSample).sum(axis=(1,2)) + np.array(scalarSample).reshape(-1)
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, sumFunction, 1)
+        self.assertTrue(np.allclose(np.array(wrapper(virtual)[0]), np.array(wrapper(design)[0])))
+
+
+class TestStreamingSobolPipeline(unittest.TestCase):
+
+    def testMatchesJansen(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05, ot.Uniform(-1,1)])
+        N = 60
+        experiment = klsie.KarhunenLoeveSobolIndicesExperiment(AKLR, N)
+        ot.RandomGenerator.SetSeed(11)
+        virtual = experiment.generateVirtual()
+        def sumFunction(fieldSample, scalarSample, uniformSample):
+            return np.array(fieldSample).sum(axis=(1,2)) * np.array(uniformSample).reshape(-1) \
+                   + np.array(scalarSample).reshape(-1)
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, sumFunction, 1)
+        reference = sif.SobolKarhunenLoeveFieldSensitivityAlgorithm(
+                                        estimator=ot.JansenSensitivityAlgorithm())
+        reference.setDesign(virtual, wrapper(virtual))
+        for blockSize in (7, 25, N):
+            pipeline = ssp.StreamingSobolPipeline(wrapper, virtual, blockSize, 'Jansen')
+            progress = list(pipeline.iterate())
+            self.assertEqual(progress[-1], N)
+            self.assertEqual(len(progress), -(-N // blockSize))
+            firstOrder = [index[0] for index in pipeline.getFirstOrderIndices()[0]]
+            totalOrder = [index[0] for index in pipeline.getTotalOrderIndices()[0]]
+            self.assertTrue(np.allclose(firstOrder,
+                            [index[0] for index in reference.getFirstOrderIndices()[0]]))
+            self.assertTrue(np.allclose(totalOrder,
+                            [index[0] for index in reference.getTotalOrderIndices()[0]]))
+
+
+class TestReplicatedSobolIndices(unittest.TestCase):
+
+    def testRandomizedReplicates(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05, ot.Uniform(-1,1)])
+        experiment = klsie.KarhunenLoeveSobolIndicesExperiment(AKLR, 64)
+        ot.RandomGenerator.SetSeed(21)
+        designs = experiment.generateReplicates(5)
+        self.assertEqual(len(designs), 5)
+        self.assertFalse(np.allclose(designs[0].getSamples()[0], designs[1].getSamples()[0]))
+        self.assertRaises(AssertionError, experiment.extend, 128)
+        def sumFunction(fieldSample, scalarSample, uniformSample):
+            return np.array(fieldSample).sum(axis=(1,2)) * np.array(uniformSample).reshape(-1) \
+                   + np.array(scalarSample).reshape(-1)
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, sumFunction, 1)
+        algorithm = rsi.ReplicatedSobolSensitivityAlgorithm(designs,
+                                        [wrapper(design) for design in designs])
+        replicates = algorithm.getFirstOrderIndicesReplicates()[0]
+        self.assertEqual(replicates.shape, (5, 3, 1))
+        firstOrder = [index[0] for index in algorithm.getFirstOrderIndices()[0]]
+        self.assertTrue(np.allclose(firstOrder, replicates.mean(axis=0)[:, 0]))
+        intervals = algorithm.getFirstOrderIndicesInterval()[0]
+        errors = algorithm.getFirstOrderIndicesStandardError()[0]
+        for index, interval, error in zip(firstOrder, intervals, errors):
+            self.assertGreater(error[0], 0)
+            self.assertTrue(interval.contains([index]))
+        algorithm.setConfidenceLevel(0.5)
+        narrower = algorithm.getFirstOrderIndicesInterval()[0]
+        self.assertLess(narrower[0].getUpperBound()[0], intervals[0].getUpperBound()[0])
+        # the intervals can be asked for before the indices
+        fresh = rsi.ReplicatedSobolSensitivityAlgorithm(designs,
+                                        [wrapper(design) for design in designs])
+        self.assertEqual(len(fresh.getTotalOrderIndicesInterval()[0]), 3)
+
+
+class TestTrajectorySobolExperiments(unittest.TestCase):
+
+    def setUp(self):
+        self.AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05, ot.Uniform(-1,1)])
+        def sumFunction(fieldSample, scalarSample, uniformSample):
+            return np.array(fieldSample).sum(axis=(1,2)) + np.array(scalarSample).reshape(-1)
+        self.wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(self.AKLR, None, sumFunction, 1)
+
+    def getIndices(self, design, metadata, estimator):
+        algorithm = sif.SobolKarhunenLoeveFieldSensitivityAlgorithm(estimator=estimator)
+        algorithm.setDesign(design, self.wrapper(design), metadata.size, metadata=metadata)
+        return ([index[0] for index in algorithm.getFirstOrderIndices()[0]],
+                [index[0] for index in algorithm.getTotalOrderIndices()[0]])
+
+    def testRadial(self):
+        N = 40
+        experiment = tse.RadialSobolIndicesExperiment(self.AKLR, N)
+        ot.RandomGenerator.SetSeed(2)
+        design = np.array(experiment.generate())
+        virtual = experiment.getVirtualDesign()
+        saltelli = np.array(vsd.VirtualSobolDesign(*virtual.getSamples(),
+                                                   virtual.getModeCount()))
+        self.assertEqual(design.shape[0], N * 5)
+        self.assertTrue(np.array_equal(design[5:10], saltelli[1::N]))
+        self.assertTrue(np.array_equal(np.array(virtual[7:23]), design[7:23]))
+        firstOrder, totalOrder = self.getIndices(*experiment.generateWithMetadata(),
+                                                 tse.RadialSensitivityAlgorithm())
+        self.assertEqual(len(firstOrder), 3)
+        self.assertAlmostEqual(totalOrder[2], 0.)
+        self.assertAlmostEqual(firstOrder[2], 0., delta=0.2)
+
+    def testIntervals(self):
+        N = 40
+        for experiment, estimator in (
+                (tse.RadialSobolIndicesExperiment(self.AKLR, N), tse.RadialSensitivityAlgorithm()),
+                (tse.WindingStairsSobolIndicesExperiment(self.AKLR, N),
+                 tse.WindingStairsSensitivityAlgorithm())):
+            ot.RandomGenerator.SetSeed(3)
+            design, metadata = experiment.generateWithMetadata()
+            algorithm = sif.SobolKarhunenLoeveFieldSensitivityAlgorithm(estimator=estimator)
+            algorithm.setBootstrapSize(50)
+            algorithm.setDesign(design, self.wrapper(design), N, metadata=metadata)
+            for interval, aggregated in (
+                    (algorithm.getFirstOrderIndicesInterval()[0],
+                     algorithm.getAggregatedFirstOrderIndices()[0]),
+                    (algorithm.getTotalOrderIndicesInterval()[0],
+                     algorithm.getAggregatedTotalOrderIndices()[0])):
+                self.assertEqual(interval.getDimension(), 3)
+                self.assertTrue(interval.contains(aggregated))
+
+    def testExtend(self):
+        N = 20
+        for kind in (tse.RadialSobolIndicesExperiment, tse.WindingStairsSobolIndicesExperiment):
+            experiment = kind(self.AKLR, N)
+            ot.RandomGenerator.SetSeed(4)
+            outputs = self.wrapper(experiment.generate())
+            increment = experiment.extend(2 * N)
+            outputs = experiment.mergeOutputs(outputs, self.wrapper(increment))
+            design = experiment.getVirtualDesign()
+            self.assertEqual(len(outputs[0]), design.getSize())
+            self.assertTrue(np.allclose(np.array(outputs[0]), np.array(self.wrapper(design)[0])))
+
+    def testWindingStairs(self):
+        N = 50
+        counts = self.AKLR.__mode_count__
+        experiment = tse.WindingStairsSobolIndicesExperiment(self.AKLR, N)
+        experiment.setGroups([[0, 1], [2]])
+        design = np.array(experiment.generate())
+        self.assertEqual(design.shape[0], N * 2 + 1)
+        changed = np.diff(design, axis=0) != 0
+        grouped = counts[0] + counts[1]
+        self.assertFalse(changed[0::2, grouped:].any())
+        self.assertFalse(changed[1::2, :grouped].any())
+        firstOrder, totalOrder = self.getIndices(*experiment.generateWithMetadata(),
+                                                 tse.WindingStairsSensitivityAlgorithm())
+        self.assertEqual(len(firstOrder), 2)
+        self.assertAlmostEqual(totalOrder[1], 0.)
+        self.assertAlmostEqual(firstOrder[0], 1., delta=0.2)
+
+
+class TestGivenDataSensitivity(unittest.TestCase):
+
+    def testNearestNeighbourIndices(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05, ot.Uniform(-1,1)])
+        def sumFunction(fieldSample, scalarSample, uniformSample):
+            return np.array(scalarSample).reshape(-1) + 0.1 * np.array(fieldSample).sum(axis=(1,2))
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, sumFunction, 1)
+        ot.RandomGenerator.SetSeed(8)
+        sample = ot.Normal(AKLR.getSizeModes()).getSample(1000)
+        outputs = wrapper(sample)
+        algorithm = gds.GivenDataSensitivityAlgorithm(sample, outputs, AKLR,
+                                                      groups=[[0], [1], [2]], max_modes=2)
+        neighbours = algorithm.getNeighbours()
+        self.assertEqual(neighbours.shape, (3, 1000))
+        self.assertFalse((neighbours == np.arange(1000)).any())
+        variance = np.array(outputs[0]).var()
+        scalarIndex = 1. / variance
+        firstOrder = [index[0] for index in algorithm.getFirstOrderIndices()[0]]
+        self.assertAlmostEqual(firstOrder[1], scalarIndex, delta=0.1)
+        self.assertAlmostEqual(firstOrder[2], 0., delta=0.1)
+        algorithm.setBootstrapSize(50)
+        intervals = algorithm.getFirstOrderIndicesInterval()[0]
+        self.assertTrue(all(interval.contains([index])
+                            for interval, index in zip(intervals, firstOrder)))
+
+    def testGroupsParsedAsInExperiment(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05, ot.Uniform(-1,1)])
+        names = AKLR.__process_distribution_description__
+        algorithm = gds.GivenDataSensitivityAlgorithm(aggregation=AKLR,
+                            groups={'fieldAndScalar' : [names[0], np.int64(1)], 'uniform' : np.int64(2)})
+        self.assertEqual(algorithm.groups, [[0, 1], [2]])
+        self.assertEqual(algorithm.group_names, ['fieldAndScalar', 'uniform'])
+        self.assertEqual(algorithm.getBootstrapSize(), ot.ResourceMap.GetAsUnsignedInteger(
+                                        'SobolIndicesAlgorithm-DefaultBootstrapSize'))
+        experiment = klsie.KarhunenLoeveSobolIndicesExperiment(AKLR, 10)
+        for groups in ([[0, 1], [1]], [[0], [3]], [['unknown']], [[]]):
+            self.assertRaises(AssertionError, algorithm.setAggregation, AKLR, groups)
+            self.assertRaises(AssertionError, experiment.setGroups, groups)
+        experiment.setGroups([np.arange(2), [np.int32(2)]])
+        self.assertEqual(experiment.getGroups(), [[0, 1], [2]])
+
+
+class TestSobolDesignMetadata(unittest.TestCase):
+
+    def testAttachedAndChecked(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05, ot.Uniform(-1,1)])
+        N = 30
+        experiment = klsie.KarhunenLoeveSobolIndicesExperiment(AKLR, N)
+        experiment.setGroups([[0, 1], [2]])
+        design, metadata = experiment.generateWithMetadata(seed=12)
+        self.assertIsNone(sdm.getSobolDesignMetadata(design))
+        self.assertEqual(metadata, experiment.getMetadata())
+        self.assertEqual((metadata.layout, metadata.size, metadata.seed), ('Saltelli', N, 12))
+        self.assertEqual(metadata.getDesignSize(), len(design))
+        self.assertEqual(metadata.getIndicesNumber(), 2)
+        self.assertEqual(sdm.SobolDesignMetadata.fromJSON(metadata.toJSON()), metadata)
+        self.assertEqual(experiment.getVirtualDesign().getMetadata(), metadata)
+        def sumFunction(fieldSample, scalarSample, uniformSample):
+            return np.array(fieldSample).sum(axis=(1,2)) + np.array(scalarSample).reshape(-1)
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, sumFunction, 1)
+        outputs = wrapper(design)
+        algorithm = sif.SobolKarhunenLoeveFieldSensitivityAlgorithm()
+        algorithm.setDesign(design, outputs, metadata=metadata)
+        self.assertEqual(algorithm.N, N)
+        self.assertEqual(len(algorithm.getFirstOrderIndices()[0]), 2)
+        self.assertRaises(AssertionError, algorithm.setDesign, design, outputs, N + 1,
+                          metadata=metadata)
+        self.assertRaises(AssertionError, algorithm.setDesign, design, [outputs[0][:N]],
+                          metadata=metadata)
+        stairs = tse.WindingStairsSobolIndicesExperiment(AKLR, N)
+        chain, chainMetadata = stairs.generateWithMetadata()
+        self.assertEqual(chainMetadata.getDesignSize(), len(chain))
+        self.assertRaises(AssertionError, algorithm.setDesign, chain, wrapper(chain),
+                          metadata=chainMetadata)
+        # without its metadata, the layout of the chain is not guessed
+        trajectory = sif.SobolKarhunenLoeveFieldSensitivityAlgorithm(
+                                        estimator=tse.WindingStairsSensitivityAlgorithm())
+        self.assertRaises(AssertionError, trajectory.setDesign, chain, wrapper(chain), N)
+        trajectory.setDesign(chain, wrapper(chain), N, metadata=chainMetadata)
+        self.assertEqual(len(trajectory.getFirstOrderIndices()[0]), 3)
+
+
+class TestParallelEvaluator(unittest.TestCase):
+
+    def setUp(self):
+        self.attempts = dict()
+        self.lock = threading.Lock()
+
+    def slowOnce(self, idx, duration):
+        ## Straggles on its first attempt only, as on an overloaded node
+        with self.lock:
+            self.attempts[idx] = self.attempts.get(idx, 0) + 1
+            first = self.attempts[idx] == 1
+        time.sleep(duration if first else 0.01)
+        return idx
+
+    def testStragglerIsExecutedAgain(self):
+        evaluator = pe.ParallelEvaluator(max_workers=3, straggler_factor=3.)
+        durations = [0.01]*8 + [5.]
+        tic = time.time()
+        results = dict(evaluator.iterate(self.slowOnce, 9,
+                                         lambda idx : (idx, durations[idx])))
+        self.assertLess(time.time() - tic, 2.)
+        self.assertEqual(results, {idx : idx for idx in range(9)})
+        self.assertEqual(evaluator.getStatistics()['speculative_wins'], 1)
+
+    def testTimeout(self):
+        evaluator = pe.ParallelEvaluator(max_workers=2, timeout=0.5, speculative=False)
+        durations = [0.01, 3., 0.01]
+        results = dict(evaluator.iterate(self.slowOnce, 3,
+                                         lambda idx : (idx, durations[idx])))
+        self.assertIsInstance(results[1], TimeoutError)
+        self.assertEqual(results[0], 0)
+        self.assertEqual(results[2], 2)
+
+    def testTimeoutCountsFromStart(self):
+        ## The tasks waiting for the worker of an abandoned task are not abandoned
+        evaluator = pe.ParallelEvaluator(max_workers=1, timeout=0.5, speculative=False)
+        durations = [1.5, 0.3, 0.3]
+        results = dict(evaluator.iterate(self.slowOnce, 3,
+                                         lambda idx : (idx, durations[idx])))
+        self.assertIsInstance(results[0], TimeoutError)
+        self.assertEqual((results[1], results[2]), (1, 2))
+        self.assertEqual(evaluator.getStatistics()['timeouts'], 1)
+
+    def testAbandonedTasksHoldTheirWorkers(self):
+        ## The tasks are only submitted once the abandoned ones free a worker
+        evaluator = pe.ParallelEvaluator(max_workers=2, timeout=0.3, speculative=False)
+        durations = [1., 1., 0.05, 0.05]
+        submitted = dict()
+        def getArguments(idx):
+            submitted[idx] = time.monotonic()
+            return (durations[idx],)
+        results = dict(evaluator.iterate(time.sleep, 4, getArguments))
+        self.assertIsInstance(results[0], TimeoutError)
+        self.assertIsInstance(results[1], TimeoutError)
+        self.assertEqual((results[2], results[3]), (None, None))
+        self.assertGreater(submitted[2] - submitted[0], 0.9)
+        # the durations count from the start in the worker
+        self.assertTrue(all(duration < 0.3 for duration in
+                            evaluator.getStatistics()['durations']))
+
+    def testAbandonedProcessTerminated(self):
+        evaluator = pe.ParallelEvaluator(max_workers=2, kind='process', timeout=0.5,
+                                         speculative=False)
+        durations = [0.01, 30., 0.01]
+        tic = time.time()
+        results = dict(evaluator.iterate(time.sleep, 3, lambda idx : (durations[idx],)))
+        self.assertIsInstance(results[1], TimeoutError)
+        self.assertIsNone(results[2])
+        time.sleep(0.5)
+        self.assertEqual(multiprocessing.active_children(), [])
+        self.assertLess(time.time() - tic, 10.)
+
+    def testWrapperStreamsChunks(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05])
+        ot.RandomGenerator.SetSeed(73)
+        design = ot.ComposedDistribution([ot.Normal()]*AKLR.getSizeModes()).getSample(20)
+        def sumFunction(fieldSample, scalarSample):
+            return np.array(fieldSample).sum(axis=(1,2)) + np.array(scalarSample).reshape(-1)
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, sumFunction, 1)
+        wrapper.setFailurePolicy()
+        reference = np.array(wrapper(design)[0])
+        wrapper.setParallelExecutor(pe.ParallelEvaluator(max_workers=2, chunk_size=6))
+        chunks = sorted((start, stop) for start, stop, output, mask in wrapper.iterateChunks(design))
+        self.assertEqual(chunks, [(0, 6), (6, 12), (12, 18), (18, 20)])
+        output = np.array(wrapper(design)[0])
+        self.assertTrue(np.allclose(output, reference, equal_nan=True))
+
+
+class TestExternalSimulator(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.script = os.path.join(self.directory, 'simulator.py')
+        with open(self.script, 'w') as fic:
+            fic.write('import numpy as np\n'
+                      'field = np.loadtxt("E_.txt", ndmin=1)\n'
+                      'scalar = np.loadtxt("F_.txt", ndmin=1)[0]\n'
+                      'np.savetxt("VM.txt", field * scalar)\n'
+                      'np.savetxt("MD.txt", [field.sum() + scalar])\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testEvaluate(self):
+        simulator = ase.ExternalSimulator([sys.executable, self.script],
+                                          os.path.join(self.directory, 'runs'),
+                                          ['VM', 'MD'], max_concurrency=4)
+        inputArrays = {'E_' : np.arange(30.).reshape(6, 5), 'F_' : np.arange(6.)}
+        outputs = asyncio.run(simulator.evaluate(inputArrays, 6))
+        self.assertEqual(len(outputs), 6)
+        for j in range(6):
+            self.assertTrue(np.allclose(outputs[j][0], inputArrays['E_'][j] * j))
+            self.assertAlmostEqual(outputs[j][1], inputArrays['E_'][j].sum() + j)
+
+    def testWrapperCallAsync(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05])
+        names = AKLR.__process_distribution_description__
+        script = os.path.join(self.directory, 'wrapped.py')
+        with open(script, 'w') as fic:
+            fic.write('import numpy as np\n'
+                      'field = np.loadtxt("{}.txt", ndmin=1)\n'
+                      'scalar = np.loadtxt("{}.txt", ndmin=1)[0]\n'
+                      'np.savetxt("VM.txt", field * scalar)\n'
+                      'np.savetxt("MD.txt", [field.sum() + scalar])\n'.format(*names))
+        def arrayFunction(arrays):
+            fields, scalars = arrays[names[0]], arrays[names[1]]
+            return [fields * scalars[:,None], fields.sum(axis=1) + scalars]
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, arrayFunction, 2)
+        wrapper.setUseNumpyConvention()
+        wrapper.setExternalSimulator(ase.ExternalSimulator([sys.executable, script],
+                                        os.path.join(self.directory, 'runs'),
+                                        ['VM', 'MD'], max_concurrency=4))
+        ot.RandomGenerator.SetSeed(31)
+        design = ot.ComposedDistribution([ot.Normal()]*AKLR.getSizeModes()).getSample(6)
+        VM, MD = asyncio.run(wrapper.callAsync(design))
+        referenceVM, referenceMD = wrapper(design)
+        self.assertIsInstance(VM, ot.ProcessSample)
+        self.assertEqual(VM.getMesh().getVerticesNumber(), mesh.getVerticesNumber())
+        self.assertTrue(np.allclose(np.array(VM), np.array(referenceVM)))
+        self.assertIsInstance(MD, ot.Sample)
+        self.assertTrue(np.allclose(np.array(MD), np.array(referenceMD)))
+        self.assertEqual(wrapper.getCallsNumber(), 12)
+
+    def testRetriesBounded(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05])
+        names = AKLR.__process_distribution_description__
+        class FlakySimulator(ase.ExternalSimulator):
+            ## Fails the first run of each row, counts the runs at once
+            active, peak, attempts = 0, 0, dict()
+            async def run(self, idx, inputs):
+                self.active += 1
+                self.peak = max(self.peak, self.active)
+                await asyncio.sleep(0.01)
+                self.active -= 1
+                self.attempts[idx] = self.attempts.get(idx, 0) + 1
+                if self.attempts[idx] == 1 :
+                    raise RuntimeError('licence unavailable')
+                field, scalar = inputs[names[0]], inputs[names[1]]
+                return [field * scalar, float(np.sum(field) + scalar)]
+        def arrayFunction(arrays):
+            fields, scalars = arrays[names[0]], arrays[names[1]]
+            return [fields * scalars[:,None], fields.sum(axis=1) + scalars]
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, arrayFunction, 2)
+        wrapper.setUseNumpyConvention()
+        simulator = FlakySimulator(['true'], os.path.join(self.directory, 'runs'),
+                                   ['VM', 'MD'], max_concurrency=2)
+        wrapper.setExternalSimulator(simulator)
+        wrapper.setFailurePolicy(maxRetries=1, retryDelay=0.)
+        ot.RandomGenerator.SetSeed(32)
+        design = ot.ComposedDistribution([ot.Normal()]*AKLR.getSizeModes()).getSample(8)
+        VM, MD = asyncio.run(wrapper.callAsync(design))
+        self.assertFalse(wrapper.getFailureMask().any())
+        self.assertEqual(set(simulator.attempts.values()), {2})
+        self.assertLessEqual(simulator.peak, 2)
+
+    def testFailingRun(self):
+        simulator = ase.ExternalSimulator([sys.executable, '-c', 'raise SystemExit(3)'],
+                                          os.path.join(self.directory, 'runs'),
+                                          ['VM'])
+        with self.assertRaises(RuntimeError):
+            asyncio.run(simulator.evaluate({'E_' : np.zeros((2, 5))}, 2))
+
+
 #class DummyFuncResults :
 #    dim = 25
 #    size = 1000
@@ -351,5 +1353,217 @@ class TestAggregatedKarhunenLoeve(unittest.TestCase):
 
 
 
+class TestBatchConversion(unittest.TestCase):
+
+    def setUp(self):
+        self.AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05])
+        ot.RandomGenerator.SetSeed(27)
+        self.design = ot.ComposedDistribution([ot.Normal()]*self.AKLR.getSizeModes()).getSample(5)
+
+    def testSingleArrayOutput(self):
+        # one field output, as a single array of shape (n, vertices)
+        scaledField = lambda fieldSample, scalarSample : \
+                        np.array(fieldSample)[:,:,0] * np.array(scalarSample).reshape(-1,1)
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(self.AKLR, None, scaledField, 1)
+        output = wrapper(self.design)
+        self.assertEqual(len(output), 1)
+        self.assertIsInstance(output[0], ot.ProcessSample)
+        self.assertEqual(output[0].getSize(), 5)
+        self.assertEqual(output[0].getMesh().getVerticesNumber(), mesh.getVerticesNumber())
+        reference = scaledField(*self.AKLR.liftAsProcessSample(self.design))
+        self.assertTrue(np.allclose(np.array(output[0])[:,:,0], reference))
+        # one scalar output, as a single array of shape (n, 1)
+        columnSum = lambda fieldSample, scalarSample : \
+                        np.array(fieldSample).sum(axis=1) + np.array(scalarSample)[:,0]
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(self.AKLR, None, columnSum, 1)
+        output = wrapper(self.design)
+        self.assertEqual(len(output), 1)
+        self.assertIsInstance(output[0], ot.Sample)
+        self.assertEqual((output[0].getSize(), output[0].getDimension()), (5, 1))
+        reference = columnSum(*self.AKLR.liftAsProcessSample(self.design))
+        self.assertTrue(np.allclose(np.array(output[0]), reference))
+
+
+class TestOutputSchema(unittest.TestCase):
+
+    def setUp(self):
+        self.AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05])
+        ot.RandomGenerator.SetSeed(28)
+        self.design = ot.ComposedDistribution([ot.Normal()]*self.AKLR.getSizeModes()).getSample(6)
+        self.schema = [{'name':'VM', 'kind':'field', 'shape':(mesh.getVerticesNumber(),)},
+                       {'name':'MD', 'kind':'scalar', 'dimension':2}]
+
+    def twoOutputs(self, fieldSample, scalarSample):
+        fields = np.array(fieldSample)[:,:,0]
+        scalars = np.array(scalarSample).reshape(-1)
+        return [fields * scalars[:,None], np.column_stack([fields.sum(axis=1), scalars])]
+
+    def testDeclaredShapeAndDescription(self):
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(self.AKLR, None, self.twoOutputs, 1)
+        wrapper.setOutputSchema(self.schema)
+        self.assertEqual(wrapper.getNumberOutputs(), 2)
+        self.assertEqual(list(wrapper.getOutputDescription()), ['VM', 'MD'])
+        self.assertEqual(wrapper.getOutputDimension(), [1, 2])
+        VM, MD = wrapper(self.design)
+        self.assertIsInstance(VM, ot.ProcessSample)
+        self.assertEqual(VM.getName(), 'VM')
+        self.assertEqual(VM.getSize(), 6)
+        # the grid of the declared shape, built once
+        self.assertEqual(VM.getMesh().getVerticesNumber(), mesh.getVerticesNumber())
+        self.assertEqual(VM.getMesh(), wrapper.getOutputSchema()[0]['mesh'])
+        self.assertIsInstance(MD, ot.Sample)
+        self.assertEqual((MD.getName(), MD.getSize(), MD.getDimension()), ('MD', 6, 2))
+        reference = self.twoOutputs(*self.AKLR.liftAsProcessSample(self.design))
+        self.assertTrue(np.allclose(np.array(VM)[:,:,0], reference[0]))
+        self.assertTrue(np.allclose(np.array(MD), reference[1]))
+        # the declared mesh is used as is
+        wrapper.setOutputSchema([{'name':'VM', 'kind':'field', 'mesh':mesh}, self.schema[1]])
+        self.assertEqual(wrapper(self.design)[0].getMesh(), mesh)
+        wrapper.setOutputSchema(None)
+        self.assertIsNone(wrapper.getOutputSchema())
+
+    def testValidationFailures(self):
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(self.AKLR, None, self.twoOutputs, 1)
+        self.assertRaises(AssertionError, wrapper.setOutputSchema, [{'name':'VM', 'kind':'surface'}])
+        self.assertRaises(AssertionError, wrapper.setOutputSchema, [{'name':'VM', 'kind':'field'}])
+        # the function returns two outputs, one is declared
+        wrapper.setOutputSchema(self.schema[:1])
+        self.assertRaises(AssertionError, wrapper, self.design)
+        # the values do not fit the declared shape or dimension
+        wrapper.setOutputSchema([{'name':'VM', 'kind':'field', 'shape':(50,)},
+                                 {'name':'MD', 'kind':'scalar', 'dimension':2}])
+        self.assertRaises(AssertionError, wrapper, self.design)
+        wrapper.setOutputSchema([self.schema[0], {'name':'MD', 'kind':'scalar', 'dimension':3}])
+        self.assertRaises(AssertionError, wrapper, self.design)
+
+
+class TestNumpyConvention(unittest.TestCase):
+
+    def testNumpyInNumpyOut(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05])
+        names = AKLR.__process_distribution_description__
+        ot.RandomGenerator.SetSeed(29)
+        design = ot.ComposedDistribution([ot.Normal()]*AKLR.getSizeModes()).getSample(7)
+        received = []
+        def arrayFunction(arrays):
+            received.append(arrays)
+            fields, scalars = arrays[names[0]], arrays[names[1]]
+            return [fields * scalars[:,None], fields.sum(axis=1) + scalars]
+        def sampleFunction(fieldSample, scalarSample):
+            return arrayFunction({names[0] : np.array(fieldSample)[:,:,0],
+                                  names[1] : np.array(scalarSample).reshape(-1)})
+        reference = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, sampleFunction, 2)
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, arrayFunction, 2)
+        self.assertFalse(wrapper.getUseNumpyConvention())
+        wrapper.setUseNumpyConvention()
+        self.assertTrue(wrapper.getUseNumpyConvention())
+        field, scalar = wrapper(design)
+        # the function received the arrays of the lifted coefficients
+        arrays = received[-1]
+        self.assertEqual(sorted(arrays), sorted(names))
+        self.assertEqual(arrays[names[0]].shape, (7, mesh.getVerticesNumber()))
+        self.assertEqual(arrays[names[1]].shape, (7,))
+        # and its arrays are converted like the outputs of a ProcessSample function
+        referenceField, referenceScalar = reference(design)
+        self.assertIsInstance(field, ot.ProcessSample)
+        self.assertEqual(field.getMesh().getVerticesNumber(), mesh.getVerticesNumber())
+        self.assertTrue(np.allclose(np.array(field), np.array(referenceField)))
+        self.assertIsInstance(scalar, ot.Sample)
+        self.assertTrue(np.allclose(np.array(scalar), np.array(referenceScalar)))
+        # outputs returned by name with a schema
+        wrapper.func_sample = lambda arrays : dict(zip(['VM', 'MD'], arrayFunction(arrays)))
+        wrapper.setOutputSchema([{'name':'MD', 'kind':'scalar'},
+                                 {'name':'VM', 'kind':'field', 'mesh':mesh}])
+        MD, VM = wrapper(design)
+        self.assertEqual((MD.getName(), VM.getName()), ('MD', 'VM'))
+        self.assertTrue(np.allclose(np.array(VM), np.array(referenceField)))
+        self.assertTrue(np.allclose(np.array(MD), np.array(referenceScalar)))
+
+
+class TestEvaluationInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testTimersAndLog(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05])
+        ot.RandomGenerator.SetSeed(30)
+        design = ot.ComposedDistribution([ot.Normal()]*AKLR.getSizeModes()).getSample(10)
+        def sumFunction(fieldSample, scalarSample):
+            return np.array(fieldSample).sum(axis=(1,2)) + np.array(scalarSample).reshape(-1)
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, sumFunction, 1)
+        logFile = os.path.join(self.directory, 'calls.jsonl')
+        wrapper.setInstrumentationLog(logFile)
+        wrapper(design)
+        wrapper(design[:4])
+        stats = wrapper.getInstrumentation().getStatistics()
+        self.assertEqual(sorted(stats['time']), sorted(ei.EvaluationInstrumentation.STAGES))
+        self.assertTrue(all(stats['time'][stage] > 0 for stage in stats['time']))
+        self.assertEqual((stats['calls'], stats['rows']), (2, 14))
+        # one lifted field and one scalar per row, one scalar output
+        self.assertEqual(stats['bytes_lifted'], 14 * 8 * (mesh.getVerticesNumber() + 1))
+        self.assertEqual(stats['bytes_output'], 14 * 8)
+        self.assertGreater(stats['rows_per_second'], 0)
+        with open(logFile) as fic:
+            records = [json.loads(line) for line in fic]
+        self.assertEqual([record['call'] for record in records], [1, 2])
+        self.assertEqual([record['rows'] for record in records], [10, 4])
+        for record in records :
+            self.assertEqual(sorted(record['time']), sorted(ei.EvaluationInstrumentation.STAGES))
+            for key in ('wall_time', 'rows_per_second', 'bytes_lifted', 'bytes_output',
+                        'cache_hits', 'cache_misses'):
+                self.assertIn(key, record)
+            self.assertLessEqual(sum(record['time'].values()), record['wall_time'])
+        self.assertEqual(records[-1], stats['last_call'])
+        # no more records once the log is removed, the counters go on
+        wrapper.setInstrumentationLog(None)
+        wrapper(design)
+        with open(logFile) as fic:
+            self.assertEqual(len(fic.readlines()), 2)
+        self.assertEqual(wrapper.getInstrumentation().getStatistics()['calls'], 3)
+        wrapper.getInstrumentation().reset()
+        self.assertEqual(wrapper.getInstrumentation().getStatistics()['rows'], 0)
+
+
+class TestFailedRowsInSobolIndices(unittest.TestCase):
+
+    def testFailedTuplesDropped(self):
+        AKLR = aklr.AggregatedKarhunenLoeveResults([results, N05, ot.Uniform(-1,1)])
+        N = 40
+        experiment = klsie.KarhunenLoeveSobolIndicesExperiment(AKLR, N)
+        ot.RandomGenerator.SetSeed(8)
+        design = experiment.generate()
+        def sumFunction(fieldSample, scalarSample, uniformSample):
+            return np.array(fieldSample).sum(axis=(1,2)) * np.array(uniformSample).reshape(-1) \
+                   + np.array(scalarSample).reshape(-1)
+        wrapper = klgfw.KarhunenLoeveGeneralizedFunctionWrapper(AKLR, None, sumFunction, 1)
+        values = np.array(wrapper(design)[0])
+        mask = np.zeros(len(values), dtype=bool)
+        mask[[3, N + 7, 3 * N + 7, 4 * N + 12]] = True
+        failed = values.copy()
+        failed[mask] = np.nan
+        algorithm = sif.SobolKarhunenLoeveFieldSensitivityAlgorithm(
+                                        estimator=ot.JansenSensitivityAlgorithm())
+        algorithm.setDesign(design, ot.Sample(failed), N)
+        self.assertRaises(TypeError, algorithm.getFirstOrderIndices)
+        algorithm.setFailureMask(mask)
+        self.assertEqual(algorithm.getValidSize(), N - 3)
+        keep = np.setdiff1d(np.arange(N), [3, 7, 12])
+        rows = (np.arange(5)[:, None] * N + keep).reshape(-1)
+        reference = sif.SobolKarhunenLoeveFieldSensitivityAlgorithm(
+                                        estimator=ot.JansenSensitivityAlgorithm())
+        reducedDesign = ot.Sample(np.array(design)[rows])
+        reducedDesign.setDescription(design.getDescription())
+        reference.setDesign(reducedDesign, ot.Sample(values[rows]), N - 3)
+        for kind in ('getFirstOrderIndices', 'getTotalOrderIndices'):
+            self.assertTrue(np.allclose(
+                [index[0] for index in getattr(algorithm, kind)()[0]],
+                [index[0] for index in getattr(reference, kind)()[0]]))
+        self.assertRaises(AssertionError, algorithm.setFailureMask, mask[:N])
+
+
 if __name__ == '__main__':
     unittest.main()